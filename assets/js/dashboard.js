@@ -66,20 +66,42 @@ document.addEventListener('DOMContentLoaded', async () => {
                         'Content-Type': 'application/json',
                         'Authorization': `Bearer ${ApiClient.getToken()}`
                     },
-                    body: JSON.stringify({ prompt: prompt })
+                    body: JSON.stringify({ prompt: prompt, stream: true })
                 });
 
-                const data = await response.json();
-
                 if (!response.ok) {
+                    const data = await response.json();
                     throw new Error(data.detail || 'Failed to generate copy');
                 }
 
-                // Show result
-                const content = data.content || data.generated_copy || 'Generated successfully. Edit below:';
-                aiGeneratedContent.innerText = content;
-                waMessageContent.value = content; // Pre-fill whatsapp field
+                // Show tokens as they stream in (Server-Sent Events)
+                aiGeneratedContent.innerText = '';
                 aiResultBox.style.display = 'block';
+                let content = '';
+                const reader = response.body.getReader();
+                const decoder = new TextDecoder();
+                let buffer = '';
+                while (true) {
+                    const { value, done } = await reader.read();
+                    if (done) break;
+                    buffer += decoder.decode(value, { stream: true });
+                    const events = buffer.split('\n\n');
+                    buffer = events.pop();
+                    for (const event of events) {
+                        const dataLine = event.split('\n').find(line => line.startsWith('data: '));
+                        if (!dataLine) continue;
+                        const data = JSON.parse(dataLine.slice(6));
+                        if (event.startsWith('event: error')) {
+                            throw new Error(data.detail || 'Failed to generate copy');
+                        }
+                        if (data.delta) {
+                            content += data.delta;
+                            aiGeneratedContent.innerText = content;
+                        }
+                    }
+                }
+
+                waMessageContent.value = content; // Pre-fill whatsapp field
 
             } catch (err) {
                 aiGeneratedContent.innerHTML = `<span style="color: #ff5f56;"><i class="fa-solid fa-triangle-exclamation"></i> ${err.message}</span>`;
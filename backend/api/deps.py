@@ -1,4 +1,6 @@
-from typing import Generator
+import time
+import hashlib
+from typing import Any, Dict, Generator, Optional, Tuple
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import jwt, JWTError
@@ -6,8 +8,9 @@ from pydantic import ValidationError
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 
+from core.cache import TTLCache
 from core.config import settings
-from database import get_db
+from database import get_db, AsyncSessionLocal
 from models.user import User
 from schemas.user import TokenPayload
 
@@ -15,9 +18,25 @@ reusable_oauth2 = OAuth2PasswordBearer(
     tokenUrl=f"{settings.API_V1_STR}/auth/login"
 )
 
-async def get_current_user(
-    db: AsyncSession = Depends(get_db), token: str = Depends(reusable_oauth2)
-) -> User:
+# sha256(token) -> user id, so repeat requests skip jwt.decode
+_token_cache = TTLCache(settings.AUTH_TOKEN_CACHE_SIZE, settings.AUTH_CACHE_TTL_SECONDS)
+# user id -> detached User snapshot, so repeat requests skip the users lookup.
+# Anything that changes a user row must call invalidate_user_cache().
+_user_cache = TTLCache(settings.AUTH_USER_CACHE_SIZE, settings.AUTH_CACHE_TTL_SECONDS)
+
+def invalidate_user_cache(*user_ids: int) -> None:
+    for user_id in user_ids:
+        _user_cache.pop(user_id)
+
+def auth_cache_stats() -> Dict[str, Any]:
+    return {"tokens": _token_cache.stats(), "users": _user_cache.stats()}
+
+def _user_id_from_token(token: str) -> int:
+    key = hashlib.sha256(token.encode()).digest()
+    user_id = _token_cache.get(key)
+    if user_id is not None:
+        return user_id
+
     try:
         payload = jwt.decode(
             token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM]
@@ -28,18 +47,58 @@ async def get_current_user(
         # Need to cast or adjust depending on what we put in create_access_token
         # Standard approach uses id stringified.
         user_id = int(token_data.sub)
-    except (JWTError, ValidationError, ValueError):
+    except (JWTError, ValidationError, ValueError, TypeError):
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Could not validate credentials",
         )
-    
-    result = await db.execute(select(User).where(User.id == user_id))
-    user = result.scalars().first()
-    
-    if not user:
+
+    # Never cache a token past its own expiry
+    expires_in = payload["exp"] - time.time() if "exp" in payload else None
+    _token_cache.set(key, user_id, ttl=expires_in)
+    return user_id
+
+async def get_user_snapshot(db: AsyncSession, user_id: int) -> Optional[User]:
+    """
+    Cached, detached User for read-only use. Don't modify it; merge it into a session first.
+    """
+    snapshot = _user_cache.get(user_id)
+    if snapshot is None:
+        result = await db.execute(select(User).where(User.id == user_id))
+        snapshot = result.scalars().first()
+        if not snapshot:
+            return None
+        db.expunge(snapshot)
+        _user_cache.set(user_id, snapshot)
+    return snapshot
+
+async def rate_limit_identity(token: str) -> Optional[Tuple[int, str]]:
+    """
+    (user id, subscription_tier) for core.ratelimit.RateLimitMiddleware, or None for an
+    invalid token. Uses the same caches as get_current_user, and warms them for it.
+    """
+    try:
+        user_id = _user_id_from_token(token)
+    except HTTPException:
+        return None
+    snapshot = _user_cache.get(user_id)
+    if snapshot is None:
+        async with AsyncSessionLocal() as db:
+            snapshot = await get_user_snapshot(db, user_id)
+    return (user_id, snapshot.subscription_tier) if snapshot else None
+
+async def get_current_user(
+    db: AsyncSession = Depends(get_db), token: str = Depends(reusable_oauth2)
+) -> User:
+    user_id = _user_id_from_token(token)
+
+    snapshot = await get_user_snapshot(db, user_id)
+    if not snapshot:
         raise HTTPException(status_code=404, detail="User not found")
-    return user
+
+    # Attach a copy to this request's session without a SELECT, so handlers can still
+    # modify and commit current_user while the cached snapshot stays untouched.
+    return await db.merge(snapshot, load=False)
 
 async def get_current_active_user(
     current_user: User = Depends(get_current_user),
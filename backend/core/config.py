@@ -10,9 +10,28 @@ class Settings(BaseSettings):
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 60 * 24 * 7  # 7 days
     
+    # Authenticated-user cache (api/deps.py); TTL bounds staleness across workers
+    AUTH_CACHE_TTL_SECONDS: float = float(os.getenv("AUTH_CACHE_TTL_SECONDS", "60"))
+    AUTH_TOKEN_CACHE_SIZE: int = int(os.getenv("AUTH_TOKEN_CACHE_SIZE", "10000"))
+    AUTH_USER_CACHE_SIZE: int = int(os.getenv("AUTH_USER_CACHE_SIZE", "10000"))
+    
+    # Per-tenant rate limits on AI, bulk-send and import endpoints (core/ratelimit.py).
+    # "local" counts per worker process; "sqlite" shares counters between workers via RATE_LIMIT_DB_PATH
+    RATE_LIMIT_ENABLED: bool = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+    RATE_LIMIT_BACKEND: str = os.getenv("RATE_LIMIT_BACKEND", "local")
+    RATE_LIMIT_DB_PATH: str = os.getenv("RATE_LIMIT_DB_PATH", "./ratelimit.db")
+    
+    # Password hashing: bcrypt cost, hashing threads, and max logins/registrations queued for them
+    BCRYPT_ROUNDS: int = int(os.getenv("BCRYPT_ROUNDS", "12"))
+    PASSWORD_HASH_WORKERS: int = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+    PASSWORD_HASH_MAX_PENDING: int = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "64"))
+    
     # Database
     DATABASE_URL: str = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///./bharatmarketer.db")
     
+    # Contacts
+    CONTACT_IMPORT_BATCH_SIZE: int = int(os.getenv("CONTACT_IMPORT_BATCH_SIZE", "1000"))
+    
     # Payments
     RAZORPAY_KEY_ID: str = os.getenv("RAZORPAY_KEY_ID", "")
     RAZORPAY_KEY_SECRET: str = os.getenv("RAZORPAY_KEY_SECRET", "")
@@ -20,13 +39,125 @@ class Settings(BaseSettings):
     STRIPE_SECRET_KEY: str = os.getenv("STRIPE_SECRET_KEY", "")
     STRIPE_WEBHOOK_SECRET: str = os.getenv("STRIPE_WEBHOOK_SECRET", "")
     
+    # Gateway calls (services/payments.py): SDK threads, max queued calls, per-request timeout and
+    # connection retries. Base URLs are overridable so load tests can use local fake gateways
+    PAYMENT_GATEWAY_WORKERS: int = int(os.getenv("PAYMENT_GATEWAY_WORKERS", "8"))
+    PAYMENT_GATEWAY_MAX_PENDING: int = int(os.getenv("PAYMENT_GATEWAY_MAX_PENDING", "64"))
+    PAYMENT_GATEWAY_TIMEOUT_SECONDS: float = float(os.getenv("PAYMENT_GATEWAY_TIMEOUT_SECONDS", "15"))
+    PAYMENT_GATEWAY_MAX_RETRIES: int = int(os.getenv("PAYMENT_GATEWAY_MAX_RETRIES", "2"))
+    PAYMENT_GATEWAY_RETRY_BACKOFF_SECONDS: float = float(os.getenv("PAYMENT_GATEWAY_RETRY_BACKOFF_SECONDS", "0.5"))
+    STRIPE_API_BASE_URL: str = os.getenv("STRIPE_API_BASE_URL", "https://api.stripe.com")
+    RAZORPAY_API_BASE_URL: str = os.getenv("RAZORPAY_API_BASE_URL", "https://api.razorpay.com")
+    # Payment webhook inbox (services/payment_events.py): processing tasks per worker, how long each
+    # collects events to apply in one transaction (at most PAYMENT_EVENT_BATCH_SIZE), how long event ids
+    # are remembered in memory (Stripe retries for up to 3 days), how long applied events are kept, and
+    # how often an event that fails to apply is retried (exponential backoff from PAYMENT_EVENT_RETRY_BASE_SECONDS)
+    PAYMENT_EVENT_PROCESSING_TASKS: int = int(os.getenv("PAYMENT_EVENT_PROCESSING_TASKS", "4"))
+    PAYMENT_EVENT_BATCH_SECONDS: float = float(os.getenv("PAYMENT_EVENT_BATCH_SECONDS", "0.5"))
+    PAYMENT_EVENT_BATCH_SIZE: int = int(os.getenv("PAYMENT_EVENT_BATCH_SIZE", "500"))
+    PAYMENT_EVENT_DEDUPE_TTL_HOURS: int = int(os.getenv("PAYMENT_EVENT_DEDUPE_TTL_HOURS", "72"))
+    PAYMENT_EVENT_RETENTION_DAYS: int = int(os.getenv("PAYMENT_EVENT_RETENTION_DAYS", "30"))
+    PAYMENT_EVENT_MAX_ATTEMPTS: int = int(os.getenv("PAYMENT_EVENT_MAX_ATTEMPTS", "10"))
+    PAYMENT_EVENT_RETRY_BASE_SECONDS: int = int(os.getenv("PAYMENT_EVENT_RETRY_BASE_SECONDS", "10"))
+    
     # WhatsApp
     WHATSAPP_TOKEN: str = os.getenv("WHATSAPP_TOKEN", "")
     WHATSAPP_PHONE_NUMBER_ID: str = os.getenv("WHATSAPP_PHONE_NUMBER_ID", "")
     WHATSAPP_VERIFY_TOKEN: str = os.getenv("WHATSAPP_VERIFY_TOKEN", "bharatmarketer_verify_token_2026")
     
+    # Bulk dispatch: Meta's default throughput tier is 80 messages/sec per business phone number
+    WHATSAPP_MESSAGES_PER_SECOND: float = float(os.getenv("WHATSAPP_MESSAGES_PER_SECOND", "80"))
+    WHATSAPP_SEND_CONCURRENCY: int = int(os.getenv("WHATSAPP_SEND_CONCURRENCY", "32"))
+    # Template header images are fetched from the client's URL once and uploaded to Meta: https on
+    # public addresses only (optionally only these comma-separated hosts and their subdomains), capped
+    # in size (Meta's image limit is 5 MB) and total fetch time
+    WHATSAPP_MEDIA_ALLOWED_HOSTS: str = os.getenv("WHATSAPP_MEDIA_ALLOWED_HOSTS", "")
+    WHATSAPP_MEDIA_MAX_BYTES: int = int(os.getenv("WHATSAPP_MEDIA_MAX_BYTES", str(5 * 1024 * 1024)))
+    WHATSAPP_MEDIA_FETCH_TIMEOUT_SECONDS: float = float(os.getenv("WHATSAPP_MEDIA_FETCH_TIMEOUT_SECONDS", "15"))
+    
+    # Inbound webhook pipeline: processing tasks per worker, concurrent conversations per business
+    # number, and how long message ids are remembered (Meta retries undelivered webhooks for up to 7 days)
+    WEBHOOK_PROCESSING_TASKS: int = int(os.getenv("WEBHOOK_PROCESSING_TASKS", "4"))
+    WEBHOOK_TENANT_CONCURRENCY: int = int(os.getenv("WEBHOOK_TENANT_CONCURRENCY", "8"))
+    WHATSAPP_DEDUPE_TTL_HOURS: int = int(os.getenv("WHATSAPP_DEDUPE_TTL_HOURS", str(24 * 7)))
+    # Attempts at an event whose processing fails (exponential backoff from WEBHOOK_RETRY_BASE_SECONDS)
+    WEBHOOK_MAX_ATTEMPTS: int = int(os.getenv("WEBHOOK_MAX_ATTEMPTS", "5"))
+    WEBHOOK_RETRY_BASE_SECONDS: int = int(os.getenv("WEBHOOK_RETRY_BASE_SECONDS", "30"))
+    # How often each worker reloads the phone_number_id -> business routing table
+    WHATSAPP_ROUTES_REFRESH_SECONDS: int = int(os.getenv("WHATSAPP_ROUTES_REFRESH_SECONDS", "60"))
+    # Delivery/read status callbacks (services/message_status.py): buffered in memory and written
+    # every MESSAGE_STATUS_FLUSH_SECONDS, or sooner once MESSAGE_STATUS_BATCH_SIZE are buffered
+    MESSAGE_STATUS_FLUSH_SECONDS: float = float(os.getenv("MESSAGE_STATUS_FLUSH_SECONDS", "2"))
+    MESSAGE_STATUS_BATCH_SIZE: int = int(os.getenv("MESSAGE_STATUS_BATCH_SIZE", "5000"))
+    MESSAGE_STATUS_MAX_PENDING: int = int(os.getenv("MESSAGE_STATUS_MAX_PENDING", "200000"))
+    # Recently seen callbacks remembered in memory, so most redeliveries skip the write; any the cache has
+    # forgotten (it holds minutes of traffic at high volume, not WHATSAPP_DEDUPE_TTL_HOURS) hit the unique key
+    MESSAGE_STATUS_DEDUPE_CACHE_SIZE: int = int(os.getenv("MESSAGE_STATUS_DEDUPE_CACHE_SIZE", "200000"))
+    # How often buffered increments are added to the campaign analytics rollups (services/analytics.py)
+    ANALYTICS_FLUSH_SECONDS: float = float(os.getenv("ANALYTICS_FLUSH_SECONDS", "5"))
+    
+    # AI agent conversation memory: turns kept in memory per conversation, how many conversations
+    # stay cached, and the token budget for earlier turns in the prompt (oldest are trimmed first)
+    CONVERSATION_WINDOW_MESSAGES: int = int(os.getenv("CONVERSATION_WINDOW_MESSAGES", "20"))
+    CONVERSATION_CACHE_SIZE: int = int(os.getenv("CONVERSATION_CACHE_SIZE", "10000"))
+    CONVERSATION_CACHE_TTL_SECONDS: int = int(os.getenv("CONVERSATION_CACHE_TTL_SECONDS", "900"))
+    AGENT_HISTORY_TOKEN_BUDGET: int = int(os.getenv("AGENT_HISTORY_TOKEN_BUDGET", "1500"))
+    
+    # Campaign worker (see worker.py)
+    EMAIL_MESSAGES_PER_SECOND: float = float(os.getenv("EMAIL_MESSAGES_PER_SECOND", "14"))
+    CAMPAIGN_BATCH_SIZE: int = int(os.getenv("CAMPAIGN_BATCH_SIZE", "100"))
+    # How long a dead worker's leased recipients wait before another worker takes them over (live
+    # workers renew their lease every third of this while sending)
+    CAMPAIGN_LEASE_SECONDS: int = int(os.getenv("CAMPAIGN_LEASE_SECONDS", "120"))
+    CAMPAIGN_MAX_ATTEMPTS: int = int(os.getenv("CAMPAIGN_MAX_ATTEMPTS", "5"))
+    CAMPAIGN_RETRY_BASE_SECONDS: int = int(os.getenv("CAMPAIGN_RETRY_BASE_SECONDS", "30"))
+    CAMPAIGN_POLL_INTERVAL_SECONDS: float = float(os.getenv("CAMPAIGN_POLL_INTERVAL_SECONDS", "2"))
+    
+    # Email campaigns over SMTP (services/email.py); sends are mocked while SMTP_HOST is empty
+    SMTP_HOST: str = os.getenv("SMTP_HOST", "")
+    SMTP_PORT: int = int(os.getenv("SMTP_PORT", "587"))
+    SMTP_USERNAME: str = os.getenv("SMTP_USERNAME", "")
+    SMTP_PASSWORD: str = os.getenv("SMTP_PASSWORD", "")
+    SMTP_USE_TLS: bool = os.getenv("SMTP_USE_TLS", "false").lower() == "true"  # implicit TLS (port 465); otherwise STARTTLS when offered
+    SMTP_TIMEOUT_SECONDS: float = float(os.getenv("SMTP_TIMEOUT_SECONDS", "30"))
+    SMTP_POOL_SIZE: int = int(os.getenv("SMTP_POOL_SIZE", "4"))
+    SMTP_MAX_MESSAGES_PER_CONNECTION: int = int(os.getenv("SMTP_MAX_MESSAGES_PER_CONNECTION", "100"))
+    
+    # AI credit metering (services/credits.py): users spending more than CREDIT_RESERVE_AFTER
+    # credits a minute get credits reserved in blocks, returned after CREDIT_RESERVATION_IDLE_SECONDS idle.
+    # Credits used from a block reach the ledger every CREDIT_USAGE_FLUSH_SECONDS; blocks of a worker
+    # that has not flushed for CREDIT_RESERVATION_STALE_SECONDS (it died) are returned by the others
+    CREDIT_RESERVE_AFTER: int = int(os.getenv("CREDIT_RESERVE_AFTER", "30"))
+    CREDIT_RESERVATION_BLOCK: int = int(os.getenv("CREDIT_RESERVATION_BLOCK", "10"))
+    CREDIT_RESERVATION_IDLE_SECONDS: int = int(os.getenv("CREDIT_RESERVATION_IDLE_SECONDS", "30"))
+    CREDIT_USAGE_FLUSH_SECONDS: float = float(os.getenv("CREDIT_USAGE_FLUSH_SECONDS", "5"))
+    CREDIT_RESERVATION_STALE_SECONDS: int = int(os.getenv("CREDIT_RESERVATION_STALE_SECONDS", "300"))
+    
+    # Referral leaderboards (services/leaderboard.py): ranked entries kept per window, and how
+    # often each worker reloads them to pick up referrals applied on other workers
+    REFERRAL_LEADERBOARD_SIZE: int = int(os.getenv("REFERRAL_LEADERBOARD_SIZE", "100"))
+    REFERRAL_LEADERBOARD_REFRESH_SECONDS: int = int(os.getenv("REFERRAL_LEADERBOARD_REFRESH_SECONDS", "300"))
+    
     # AI
     OPENAI_API_KEY: str = os.getenv("OPENAI_API_KEY", "")
+    # Generated-copy cache; AI_CACHE_DB_PATH enables the on-disk SQLite tier
+    AI_CACHE_TTL_SECONDS: float = float(os.getenv("AI_CACHE_TTL_SECONDS", str(60 * 60 * 24)))
+    AI_CACHE_MAX_ENTRIES: int = int(os.getenv("AI_CACHE_MAX_ENTRIES", "5000"))
+    AI_CACHE_DB_PATH: str = os.getenv("AI_CACHE_DB_PATH", "")
+    AI_CACHE_DISK_MAX_ENTRIES: int = int(os.getenv("AI_CACHE_DISK_MAX_ENTRIES", "100000"))
+    
+    # Outbound HTTP (shared per-host connection pools, see services/http_client.py)
+    HTTP_MAX_CONNECTIONS_PER_HOST: int = int(os.getenv("HTTP_MAX_CONNECTIONS_PER_HOST", "100"))
+    HTTP_MAX_KEEPALIVE_PER_HOST: int = int(os.getenv("HTTP_MAX_KEEPALIVE_PER_HOST", "20"))
+    HTTP_KEEPALIVE_EXPIRY_SECONDS: float = float(os.getenv("HTTP_KEEPALIVE_EXPIRY_SECONDS", "60"))
+    HTTP_TIMEOUT_SECONDS: float = float(os.getenv("HTTP_TIMEOUT_SECONDS", "60"))
+    HTTP_CONNECT_TIMEOUT_SECONDS: float = float(os.getenv("HTTP_CONNECT_TIMEOUT_SECONDS", "5"))
+    HTTP_MAX_RETRIES: int = int(os.getenv("HTTP_MAX_RETRIES", "2"))
+    HTTP_RETRY_BACKOFF_SECONDS: float = float(os.getenv("HTTP_RETRY_BACKOFF_SECONDS", "0.5"))
+    HTTP_CIRCUIT_FAILURE_THRESHOLD: int = int(os.getenv("HTTP_CIRCUIT_FAILURE_THRESHOLD", "5"))
+    HTTP_CIRCUIT_RESET_SECONDS: float = float(os.getenv("HTTP_CIRCUIT_RESET_SECONDS", "30"))
+    # Upstream hosts with a pooled client (OpenAI, Meta Graph API, ...); least recently used beyond this are closed
+    HTTP_MAX_UPSTREAMS: int = int(os.getenv("HTTP_MAX_UPSTREAMS", "16"))
 
     class Config:
         case_sensitive = True
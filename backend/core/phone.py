@@ -0,0 +1,25 @@
+import re
+
+_NON_DIGITS = re.compile(r"\D")
+
+def normalize_e164(raw: str, default_country_code: str = "91") -> str:
+    """
+    Normalizes a phone number to E.164 ("+919876543210").
+
+    Accepts the shapes numbers arrive in: Meta's display_phone_number ("+91 98765 43210",
+    "919876543210"), international "00" prefixes and local numbers with a trunk "0"
+    or no country code at all, which get `default_country_code`.
+    Raises ValueError if the result can't be a valid E.164 number.
+    """
+    raw = (raw or "").strip()
+    digits = _NON_DIGITS.sub("", raw)
+    if raw.startswith("+"):
+        pass
+    elif digits.startswith("00"):
+        digits = digits[2:]
+    elif digits.startswith("0") or len(digits) <= 10:
+        digits = default_country_code + digits.lstrip("0")
+
+    if not 8 <= len(digits) <= 15 or digits.startswith("0"):
+        raise ValueError(f"Invalid phone number: {raw!r}")
+    return "+" + digits
@@ -0,0 +1,178 @@
+import json
+import time
+import asyncio
+import logging
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from core.config import settings
+
+logger = logging.getLogger(__name__)
+
+API = settings.API_V1_STR
+
+# (method, path) -> route class. Only these expensive endpoints are limited.
+ROUTE_CLASSES: Dict[Tuple[str, str], str] = {
+    ("POST", f"{API}/ai/generate-copy"): "ai",
+    ("POST", f"{API}/ai/agent-reply"): "ai",
+    ("POST", f"{API}/marketing/whatsapp/send-bulk"): "bulk",
+    ("POST", f"{API}/marketing/email/send-campaign"): "bulk",
+    ("POST", f"{API}/contacts/import-csv"): "import",
+}
+
+# subscription_tier -> route class -> (requests per minute, burst)
+RATE_LIMITS: Dict[str, Dict[str, Tuple[int, int]]] = {
+    "free":    {"ai": (10, 5),   "bulk": (2, 2),   "import": (2, 2)},
+    "starter": {"ai": (30, 10),  "bulk": (5, 3),   "import": (5, 3)},
+    "growth":  {"ai": (60, 20),  "bulk": (10, 5),  "import": (10, 5)},
+    "pro":     {"ai": (120, 40), "bulk": (30, 10), "import": (20, 10)},
+}
+# Paid checkouts set these tiers (routers/payments.py); they get Growth limits
+RATE_LIMITS["paid_stripe"] = RATE_LIMITS["paid_razorpay"] = RATE_LIMITS["growth"]
+
+class LocalRateLimitBackend:
+    """
+    Token buckets in a dict. Counts per worker process, so with N workers a tenant
+    effectively gets N times the limit; use the sqlite backend to share them.
+    """
+    PRUNE_EVERY = 10_000
+
+    def __init__(self):
+        self._buckets: Dict[str, Tuple[float, float]] = {}  # key -> (tokens, updated_at)
+        self._hits = 0
+
+    async def hit(self, key: str, rate: float, burst: int) -> Tuple[bool, float, float]:
+        """Takes a token. Returns (allowed, tokens remaining, seconds until the next token)."""
+        now = time.monotonic()
+        tokens, updated = self._buckets.get(key, (burst, now))
+        tokens = min(burst, tokens + (now - updated) * rate)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        self._buckets[key] = (tokens, now)
+
+        self._hits += 1
+        if self._hits % self.PRUNE_EVERY == 0:
+            self._prune(now)
+        return allowed, tokens, (1 - tokens) / rate if tokens < 1 else 0.0
+
+    def _prune(self, now: float) -> None:
+        # Buckets idle for a minute are (nearly) full again; dropping them changes nothing
+        for key, (_, updated) in list(self._buckets.items()):
+            if now - updated > 60:
+                del self._buckets[key]
+
+class SQLiteRateLimitBackend:
+    """
+    Token buckets in a SQLite file shared by all workers on the host (WAL mode).
+    Each hit is one short write transaction, run on a dedicated thread so a busy file
+    never blocks the event loop; if the file is locked for longer than a few
+    milliseconds the request is allowed rather than stalled.
+    """
+    def __init__(self, path: str):
+        # One thread owns the connection, so transactions never interleave
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ratelimit")
+        self._conn = sqlite3.connect(path, timeout=0.05, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=OFF")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS rate_limit_buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+
+    async def hit(self, key: str, rate: float, burst: int) -> Tuple[bool, float, float]:
+        return await asyncio.get_running_loop().run_in_executor(self._executor, self._hit, key, rate, burst)
+
+    def _hit(self, key: str, rate: float, burst: int) -> Tuple[bool, float, float]:
+        now = time.time()
+        try:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT tokens, updated_at FROM rate_limit_buckets WHERE key = ?", (key,)
+                ).fetchone()
+                tokens = burst if row is None else min(burst, row[0] + (now - row[1]) * rate)
+                allowed = tokens >= 1
+                if allowed:
+                    tokens -= 1
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO rate_limit_buckets (key, tokens, updated_at) VALUES (?, ?, ?)",
+                    (key, tokens, now),
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        except sqlite3.OperationalError as e:
+            logger.warning(f"Rate limit store unavailable, allowing request: {e}")
+            return True, burst, 0.0
+        return allowed, tokens, (1 - tokens) / rate if tokens < 1 else 0.0
+
+def create_rate_limit_backend():
+    if settings.RATE_LIMIT_BACKEND == "sqlite":
+        return SQLiteRateLimitBackend(settings.RATE_LIMIT_DB_PATH)
+    return LocalRateLimitBackend()
+
+# Resolves a bearer token to (user id, subscription_tier), or None if it isn't valid
+Identify = Callable[[str], Awaitable[Optional[Tuple[int, str]]]]
+
+class RateLimitMiddleware:
+    """
+    ASGI middleware applying per-user token buckets to the expensive endpoints in
+    ROUTE_CLASSES, sized by the user's subscription_tier. Limited responses carry
+    X-RateLimit-Limit/-Remaining/-Reset; rejected ones are a 429 with Retry-After.
+    Requests without a valid token pass through; the endpoint itself rejects them.
+    """
+    def __init__(self, app, identify: Identify, backend=None):
+        self.app = app
+        self.identify = identify
+        self.backend = backend or create_rate_limit_backend()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        route_class = ROUTE_CLASSES.get((scope["method"], scope["path"]))
+        if route_class is None:
+            return await self.app(scope, receive, send)
+
+        token = _bearer_token(scope)
+        identity = await self.identify(token) if token else None
+        if identity is None:
+            return await self.app(scope, receive, send)
+
+        user_id, tier = identity
+        per_minute, burst = RATE_LIMITS.get(tier, RATE_LIMITS["free"])[route_class]
+        allowed, remaining, retry_after = await self.backend.hit(f"{user_id}:{route_class}", per_minute / 60, burst)
+        headers = [
+            (b"x-ratelimit-limit", str(per_minute).encode()),
+            (b"x-ratelimit-remaining", str(int(remaining)).encode()),
+            (b"x-ratelimit-reset", str(int(retry_after + 0.999)).encode()),
+        ]
+
+        if not allowed:
+            body = json.dumps({"detail": f"Rate limit exceeded for {route_class} requests. Please retry shortly."}).encode()
+            await send({
+                "type": "http.response.start",
+                "status": 429,
+                "headers": headers + [
+                    (b"retry-after", str(int(retry_after + 0.999)).encode()),
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode()),
+                ],
+            })
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        async def send_with_headers(message):
+            if message["type"] == "http.response.start":
+                message = {**message, "headers": list(message.get("headers", [])) + headers}
+            await send(message)
+
+        await self.app(scope, receive, send_with_headers)
+
+def _bearer_token(scope) -> Optional[str]:
+    for name, value in scope["headers"]:
+        if name == b"authorization":
+            scheme, _, token = value.decode("latin-1").partition(" ")
+            return token if scheme.lower() == "bearer" and token else None
+    return None
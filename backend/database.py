@@ -1,7 +1,12 @@
+import logging
+from sqlalchemy import inspect
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.schema import CreateIndex
 from core.config import settings
 
+logger = logging.getLogger(__name__)
+
 engine = create_async_engine(settings.DATABASE_URL, echo=False)
 
 AsyncSessionLocal = sessionmaker(
@@ -13,3 +18,38 @@ Base = declarative_base()
 async def get_db():
     async with AsyncSessionLocal() as session:
         yield session
+
+def _index_names(connection, inspector, table_name: str) -> set:
+    """A table's index names. SQLite's reflection skips expression indexes, so read its catalog."""
+    if connection.dialect.name == "sqlite":
+        rows = connection.exec_driver_sql("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = ?", (table_name,))
+        return {name for (name,) in rows}
+    return {index["name"] for index in inspector.get_indexes(table_name)}
+
+def upgrade_schema(connection) -> None:
+    """
+    One-off migration run after create_all (which only creates missing tables): adds the
+    nullable columns and the indexes that models gained after their table was created.
+    Cheap no-op once the database matches the models.
+    """
+    inspector = inspect(connection)
+    quote = connection.dialect.identifier_preparer.quote
+    existing_tables = set(inspector.get_table_names())
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        columns = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in columns:
+                continue
+            if not column.nullable:
+                logger.error(f"Cannot add NOT NULL column {table.name}.{column.name} to an existing table; migrate it by hand")
+                continue
+            column_type = column.type.compile(dialect=connection.dialect)
+            connection.exec_driver_sql(f"ALTER TABLE {quote(table.name)} ADD COLUMN {quote(column.name)} {column_type}")
+            logger.info(f"Added column {table.name}.{column.name}")
+        indexes = _index_names(connection, inspector, table.name)
+        for index in table.indexes:
+            if index.name not in indexes:
+                connection.execute(CreateIndex(index, if_not_exists=True))
+                logger.info(f"Created index {index.name}")
@@ -1,10 +1,34 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from core.config import settings
-from database import Base, engine
+from database import Base, engine, upgrade_schema, AsyncSessionLocal
 from routers import auth, payments, marketing, ai, contacts, referrals, webhooks
 from models.user import User
-from models.contact import Contact
+from models.contact import Contact, ContactTag
+from models.campaign import Campaign, CampaignRecipient, CampaignWhatsAppTemplate
+from models.webhook import InboundWebhookEvent, ProcessedWhatsAppMessage
+from models.whatsapp_number import WhatsAppNumber
+from models.conversation import ConversationMessage
+from models.credit import CreditLedgerEntry, CreditReservation
+from models.message_event import MessageEvent
+from models.analytics import CampaignStatsHourly, CampaignStatsDaily
+from models.referral import ReferralEvent, ReferralClosure
+from models.payment import PaymentEvent
+from services.http_client import close_http_clients, http_client_stats
+from services.payments import payment_gateway_stats
+from services.payment_events import payment_events
+from services.tags import backfill_contact_tags
+from api.deps import auth_cache_stats, rate_limit_identity
+from core.ratelimit import RateLimitMiddleware
+from services.ai import copy_cache
+from services.inbound import inbound_pipeline
+from services.whatsapp_numbers import whatsapp_routes
+from services.conversations import conversation_store
+from services.credits import credit_meter
+from services.message_status import message_status
+from services.analytics import analytics
+from services.leaderboard import backfill_referral_events, referral_leaderboard
+from services.referral_tree import backfill_referral_closure
 
 # Will create tables on startup (for simplicity in development)
 # In production, use Alembic migrations instead!
@@ -13,6 +37,10 @@ app = FastAPI(
     openapi_url=f"{settings.API_V1_STR}/openapi.json"
 )
 
+# Per-tenant rate limits (added before CORS so 429 responses still get CORS headers)
+if settings.RATE_LIMIT_ENABLED:
+    app.add_middleware(RateLimitMiddleware, identify=rate_limit_identity)
+
 # CORS configuration
 app.add_middleware(
     CORSMiddleware,
@@ -32,6 +60,41 @@ async def startup():
     # create db tables
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        # add columns and indexes that models gained after their tables were created
+        await conn.run_sync(upgrade_schema)
+    # index tags of contacts created before the contact_tags table existed
+    async with AsyncSessionLocal() as db:
+        await backfill_contact_tags(db)
+        # date referrals applied before the referral_events table existed
+        await backfill_referral_events(db)
+        # build the multi-level referral tree from referred_by_id (no-op once populated)
+        await backfill_referral_closure(db)
+    # load the phone_number_id -> business routing table before processing webhooks
+    await whatsapp_routes.start()
+    # return idle AI credit reservations to users' balances
+    await credit_meter.start()
+    # batch delivery/read status callbacks into message_events and contact counters
+    await message_status.start()
+    # add buffered increments to the campaign analytics rollups
+    await analytics.start()
+    # referral leaderboards are served from memory
+    await referral_leaderboard.start()
+    # process inbound webhooks off the request path (re-queues any left over from a restart)
+    await inbound_pipeline.start()
+    # apply stored Stripe/Razorpay webhook events (re-queues any left over from a restart)
+    await payment_events.start()
+
+@app.on_event("shutdown")
+async def shutdown():
+    await inbound_pipeline.stop()
+    await payment_events.stop()
+    await message_status.stop()
+    await credit_meter.stop()
+    await analytics.stop()
+    await whatsapp_routes.stop()
+    await referral_leaderboard.stop()
+    # close pooled upstream connections (OpenAI, Meta Graph API)
+    await close_http_clients()
 
 @app.get("/")
 def read_root():
@@ -41,6 +104,23 @@ def read_root():
 def health_check():
     return {"status": "ok"}
 
+@app.get("/metrics")
+def metrics():
+    return {
+        "http_clients": http_client_stats(),
+        "auth_cache": auth_cache_stats(),
+        "ai_copy_cache": copy_cache.snapshot(),
+        "inbound_webhooks": inbound_pipeline.snapshot(),
+        "whatsapp_routes": whatsapp_routes.snapshot(),
+        "conversation_windows": conversation_store.snapshot(),
+        "credit_meter": credit_meter.snapshot(),
+        "message_status": message_status.snapshot(),
+        "analytics": analytics.snapshot(),
+        "referral_leaderboard": referral_leaderboard.snapshot(),
+        "payment_gateways": payment_gateway_stats(),
+        "payment_events": payment_events.snapshot(),
+    }
+
 # Include routers for auth, payments, etc.
 app.include_router(auth.router, prefix=f"{settings.API_V1_STR}/auth", tags=["auth"])
 app.include_router(payments.router, prefix=f"{settings.API_V1_STR}/payments", tags=["payments"])
@@ -0,0 +1,26 @@
+from sqlalchemy import Column, Integer, DateTime
+from database import Base
+
+class RollupCounters:
+    """
+    Engagement counters of one (owner, campaign, time bucket). campaign_id 0 is the owner's
+    total: every campaign plus messages outside campaigns (AI agent replies, AI copy).
+    """
+    owner_id = Column(Integer, primary_key=True)
+    campaign_id = Column(Integer, primary_key=True)
+    bucket = Column(DateTime(timezone=True), primary_key=True)  # start of the hour/day (UTC)
+
+    sent = Column(Integer, nullable=False, default=0)
+    delivered = Column(Integer, nullable=False, default=0)
+    read = Column(Integer, nullable=False, default=0)
+    failed = Column(Integer, nullable=False, default=0)
+    replies = Column(Integer, nullable=False, default=0)
+    ai_credits_used = Column(Integer, nullable=False, default=0)
+
+class CampaignStatsHourly(RollupCounters, Base):
+    """Hourly rollup maintained incrementally by services/analytics.py."""
+    __tablename__ = "campaign_stats_hourly"
+
+class CampaignStatsDaily(RollupCounters, Base):
+    """Daily rollup maintained incrementally by services/analytics.py."""
+    __tablename__ = "campaign_stats_daily"
@@ -0,0 +1,69 @@
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, Index
+from sqlalchemy.sql import func
+from sqlalchemy.orm import relationship
+from database import Base
+
+class Campaign(Base):
+    __tablename__ = "campaigns"
+
+    id = Column(Integer, primary_key=True, index=True)
+    owner_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+
+    channel = Column(String, nullable=False)  # whatsapp, email
+    status = Column(String, default="queued")  # queued, running, completed
+
+    # Message content
+    subject = Column(String, nullable=True)  # email only
+    body = Column(Text, nullable=False)
+
+    total_recipients = Column(Integer, default=0)
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+    completed_at = Column(DateTime(timezone=True), nullable=True)
+
+    # Relationships
+    recipients = relationship("CampaignRecipient", back_populates="campaign", cascade="all, delete-orphan")
+
+class CampaignRecipient(Base):
+    __tablename__ = "campaign_recipients"
+    __table_args__ = (
+        # Worker polling: due pending rows and expired leases
+        Index("ix_campaign_recipients_status_next_attempt", "status", "next_attempt_at"),
+        # Progress endpoint: per-status counts for one campaign
+        Index("ix_campaign_recipients_campaign_status", "campaign_id", "status"),
+        # Attributing delivery statuses and replies to their campaign
+        Index("ix_campaign_recipients_provider_message_id", "provider_message_id"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    campaign_id = Column(Integer, ForeignKey("campaigns.id"), nullable=False)
+    recipient = Column(String, nullable=False)  # phone number or email address
+
+    # Delivery state: pending -> leased -> sent | pending (retry) | dead (dead letter)
+    status = Column(String, default="pending")
+    attempts = Column(Integer, default=0)
+    next_attempt_at = Column(DateTime(timezone=True), nullable=True)
+    last_error = Column(Text, nullable=True)
+
+    # Lease held by a worker while the send is in flight
+    lease_token = Column(String, nullable=True)
+    lease_expires_at = Column(DateTime(timezone=True), nullable=True)
+
+    provider_message_id = Column(String, nullable=True)
+    sent_at = Column(DateTime(timezone=True), nullable=True)
+
+    # Relationship
+    campaign = relationship("Campaign", back_populates="recipients")
+
+class CampaignWhatsAppTemplate(Base):
+    """
+    Approved WhatsApp template a campaign sends instead of a free-form text body.
+    """
+    __tablename__ = "campaign_whatsapp_templates"
+
+    campaign_id = Column(Integer, ForeignKey("campaigns.id"), primary_key=True)
+    template_name = Column(String, nullable=False)
+    language_code = Column(String, nullable=False, default="en_US")
+    body_parameters = Column(Text, nullable=False, default="[]")  # JSON list of contact templates, e.g. ["{{name|there}}", "20%"]
+    header_image_url = Column(String, nullable=True)  # uploaded once, then sent by media id
@@ -1,10 +1,18 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, Index, literal_column
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from database import Base
 
 class Contact(Base):
     __tablename__ = "contacts"
+    __table_args__ = (
+        # Import dedupe and per-owner phone lookups
+        Index("ix_contacts_owner_phone", "owner_id", "phone"),
+        # Email campaign personalization lookups
+        Index("ix_contacts_owner_email", "owner_id", "email"),
+        # Keyset pagination of the contact list
+        Index("ix_contacts_owner_id_id", "owner_id", "id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     owner_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
@@ -15,7 +23,7 @@ class Contact(Base):
     email = Column(String, nullable=True)
     
     # Organization / categorization
-    tags = Column(String, default="")  # comma-separated tags like "vip,diwali-2024,new-lead"
+    tags = Column(String, default="")  # comma-separated tags like "vip,diwali-2024,new-lead" (display copy; filtering uses contact_tags)
     notes = Column(Text, default="")
     source = Column(String, default="manual")  # manual, csv_import, justdial, referral
     
@@ -29,3 +37,23 @@ class Contact(Base):
     
     # Relationship
     owner = relationship("User", back_populates="contacts")
+
+# The contact list's created_at sort key. Rows saved without created_at sort as the oldest
+# instead of dropping out of keyset comparisons; the literal is the epoch as SQLAlchemy
+# stores datetimes in SQLite, so it also compares right against encoded cursors there.
+CONTACT_CREATED_AT_KEY = func.coalesce(Contact.created_at, literal_column("'1970-01-01 00:00:00.000000'"))
+Index("ix_contacts_owner_created_key_id", Contact.owner_id, CONTACT_CREATED_AT_KEY, Contact.id)
+
+class ContactTag(Base):
+    """
+    One row per (contact, tag): the indexed form of Contact.tags, kept in sync by services/tags.py.
+    """
+    __tablename__ = "contact_tags"
+    __table_args__ = (
+        # Tag filters and per-owner tag counts are index-only scans on this
+        Index("ix_contact_tags_owner_tag", "owner_id", "tag", "contact_id"),
+    )
+
+    contact_id = Column(Integer, ForeignKey("contacts.id", ondelete="CASCADE"), primary_key=True)
+    tag = Column(String, primary_key=True)
+    owner_id = Column(Integer, ForeignKey("users.id"), nullable=False)
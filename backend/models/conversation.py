@@ -0,0 +1,24 @@
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, Index
+from sqlalchemy.sql import func
+from database import Base
+
+class ConversationMessage(Base):
+    """
+    One turn of a WhatsApp conversation between a business (owner) and a customer,
+    either the customer's inbound message or the AI agent's reply.
+    """
+    __tablename__ = "conversation_messages"
+    __table_args__ = (
+        # Timeline of one conversation
+        Index("ix_conversation_messages_owner_phone_created", "owner_id", "customer_phone", "created_at"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    owner_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    customer_phone = Column(String, nullable=False)
+
+    direction = Column(String, nullable=False)  # inbound, outbound
+    text = Column(Text, nullable=False)
+    whatsapp_message_id = Column(String, nullable=True)
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
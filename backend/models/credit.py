@@ -0,0 +1,41 @@
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Index
+from sqlalchemy.sql import func
+from database import Base
+
+class CreditLedgerEntry(Base):
+    """
+    Append-only record of every change to a user's AI credits. Rows are never updated or deleted.
+    Credits held by a credit_reservations row are in neither users.ai_credits_remaining
+    nor the ledger until they are used (one entry each) or returned to the balance, so the
+    ledger sums to the balance plus the credits held.
+    """
+    __tablename__ = "credit_ledger"
+    __table_args__ = (
+        # A user's credit history, newest first
+        Index("ix_credit_ledger_user_id_id", "user_id", "id"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+
+    delta = Column(Integer, nullable=False)  # negative for usage
+    balance_after = Column(Integer, nullable=False)  # users.ai_credits_remaining, so not counting held credits
+    reason = Column(String, nullable=False)  # ai_copy, agent_reply, referral_bonus, referral_welcome, refund (reservation, reservation_release: older rows)
+    reference = Column(String, nullable=True)  # e.g. the WhatsApp message id or referral code
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class CreditReservation(Base):
+    """
+    A block of a user's credits held by one worker process and handed out in-process
+    (services/credits.py). `updated_at` is refreshed while the worker is alive; a stale
+    row belongs to a worker that died and is returned to the user's balance.
+    """
+    __tablename__ = "credit_reservations"
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    worker_id = Column(String, nullable=False, index=True)
+
+    remaining = Column(Integer, nullable=False)  # held, not yet recorded as used
+    updated_at = Column(DateTime, nullable=False)
@@ -0,0 +1,31 @@
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, Index
+from sqlalchemy.sql import func
+from database import Base
+
+class MessageEvent(Base):
+    """
+    Append-only log of WhatsApp delivery status callbacks (sent, delivered, read, failed)
+    and customer replies, written in batches by services/message_status.py.
+    """
+    __tablename__ = "message_events"
+    __table_args__ = (
+        # Status history of one outbound message
+        Index("ix_message_events_provider_message_id", "provider_message_id"),
+        # A business's events over time
+        Index("ix_message_events_owner_occurred", "owner_id", "occurred_at"),
+        # Redelivered callbacks are dropped by this key (the in-memory seen-set only catches recent ones)
+        Index("uq_message_events_dedupe_id_status", "dedupe_id", "status", unique=True),
+    )
+
+    id = Column(Integer, primary_key=True)
+    owner_id = Column(Integer, ForeignKey("users.id"), nullable=True)  # null if the business number is unknown
+    phone_number_id = Column(String, nullable=True)
+
+    provider_message_id = Column(String, nullable=False)  # wamid of the outbound message (a reply: the message it answers, else its own)
+    dedupe_id = Column(String, nullable=True)  # id Meta redelivers the callback under (a status: the message's wamid, a reply: its own)
+    recipient = Column(String, nullable=False)  # customer phone
+    status = Column(String, nullable=False)  # sent, delivered, read, failed, replied
+    error = Column(Text, nullable=True)  # Meta's error title/code for failed sends
+
+    occurred_at = Column(DateTime(timezone=True), nullable=False)
+    received_at = Column(DateTime(timezone=True), server_default=func.now())
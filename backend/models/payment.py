@@ -0,0 +1,37 @@
+from sqlalchemy import Column, Integer, String, DateTime, Text, Index, UniqueConstraint
+from sqlalchemy.sql import func
+from database import Base
+
+class PaymentEvent(Base):
+    """
+    Inbox of Stripe and Razorpay webhook events, stored (once per provider event id) before
+    they are acknowledged and applied asynchronously by services/payment_events.py.
+    """
+    __tablename__ = "payment_events"
+    __table_args__ = (
+        # Gateway retries and replays of an event are dropped by this constraint
+        UniqueConstraint("provider", "event_id", name="uq_payment_events_provider_event_id"),
+        # Recovery and retry sweeps of events that were received but never processed
+        Index("ix_payment_events_status_id", "status", "id"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    provider = Column(String, nullable=False)  # stripe, razorpay
+    event_id = Column(String, nullable=False)  # Stripe evt_..., Razorpay X-Razorpay-Event-Id
+    event_type = Column(String, nullable=False)
+
+    # Extracted at receipt so processing never re-parses the payload
+    user_id = Column(Integer, nullable=True)  # our user (Stripe client_reference_id, Razorpay notes.user_id)
+    customer_id = Column(String, nullable=True)  # the gateway's customer id
+    occurred_at = Column(DateTime(timezone=True), nullable=False)  # when the gateway created the event
+    payload = Column(Text, nullable=False)
+
+    # 'failed' once PAYMENT_EVENT_MAX_ATTEMPTS attempts have failed; such events are kept (never
+    # purged) and are retried by setting them back to 'received' with attempts = 0
+    status = Column(String, default="received")  # received, processed, stale, failed
+    attempts = Column(Integer, default=0)  # failed attempts to apply the event
+    next_attempt_at = Column(DateTime(timezone=True), nullable=True)  # re-queued from then on while still 'received'
+    last_error = Column(Text, nullable=True)
+
+    received_at = Column(DateTime(timezone=True), server_default=func.now())
+    processed_at = Column(DateTime(timezone=True), nullable=True)
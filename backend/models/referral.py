@@ -0,0 +1,38 @@
+from sqlalchemy import Column, Integer, DateTime, ForeignKey, Index
+from sqlalchemy.sql import func
+from database import Base
+
+class ReferralEvent(Base):
+    """
+    One row per successful referral, so leaderboards can be windowed by time
+    (users.total_referrals only holds the all-time count).
+    """
+    __tablename__ = "referral_events"
+    __table_args__ = (
+        # Windowed leaderboards: referrals since the start of this week/month
+        Index("ix_referral_events_created_referrer", "created_at", "referrer_id"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    referrer_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    referred_id = Column(Integer, ForeignKey("users.id"), nullable=False, unique=True)  # a user is referred at most once
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class ReferralClosure(Base):
+    """
+    Transitive closure of the referral tree (users.referred_by_id): one row per
+    (ancestor, descendant) pair, at any depth (1 = referred directly). Maintained by
+    services/referral_tree.py, so downline queries never recurse.
+    """
+    __tablename__ = "referral_closure"
+    __table_args__ = (
+        # Downline size, per-depth counts and (depth, id) keyset listing of one ancestor
+        Index("ix_referral_closure_ancestor_depth_descendant", "ancestor_id", "depth", "descendant_id"),
+        # Upline of one user (cycle checks, linking a new referral)
+        Index("ix_referral_closure_descendant_depth", "descendant_id", "depth"),
+    )
+
+    ancestor_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    descendant_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    depth = Column(Integer, nullable=False)
@@ -25,6 +25,7 @@ class User(Base):
     # Subscriptions
     subscription_tier = Column(String, default="free") # free, starter, growth, pro
     subscription_status = Column(String, default="active") # inactive, active, past_due, canceled
+    subscription_event_at = Column(DateTime(timezone=True), nullable=True)  # gateway time of the last applied payment event
     
     # Payment Gateway specific IDs (for mapping webhooks)
     stripe_customer_id = Column(String, unique=True, index=True, nullable=True)
@@ -32,9 +33,9 @@ class User(Base):
     
     # Referral Engine (USP #4)
     referral_code = Column(String, unique=True, index=True, default=generate_referral_code)
-    referred_by_id = Column(Integer, ForeignKey("users.id"), nullable=True)
+    referred_by_id = Column(Integer, ForeignKey("users.id"), nullable=True, index=True)
     referral_credits = Column(Integer, default=0)  # Credits earned from referrals (₹199 packs)
-    total_referrals = Column(Integer, default=0)    # Count of successful referrals
+    total_referrals = Column(Integer, default=0, index=True)    # Count of successful referrals
     
     # AI Usage Tracking
     ai_credits_remaining = Column(Integer, default=50)  # Free tier gets 50 AI generations
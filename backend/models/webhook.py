@@ -0,0 +1,39 @@
+from sqlalchemy import Column, Integer, String, DateTime, Text, Index
+from sqlalchemy.sql import func
+from database import Base
+
+class InboundWebhookEvent(Base):
+    """
+    Raw inbound webhook delivery, stored before it is acknowledged and processed asynchronously.
+    """
+    __tablename__ = "inbound_webhook_events"
+    __table_args__ = (
+        # Startup recovery of events that were received but never processed
+        Index("ix_inbound_webhook_events_status_id", "status", "id"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    provider = Column(String, nullable=False, default="whatsapp")
+    payload = Column(Text, nullable=False)
+
+    # A failed event goes back to 'received' until WEBHOOK_MAX_ATTEMPTS attempts have failed
+    status = Column(String, default="received")  # received, processing, processed, failed
+    attempts = Column(Integer, default=0)  # failed attempts to process the event
+    next_attempt_at = Column(DateTime(timezone=True), nullable=True)  # re-queued from then on while still 'received'
+    last_error = Column(Text, nullable=True)
+
+    received_at = Column(DateTime(timezone=True), server_default=func.now())
+    claimed_at = Column(DateTime(timezone=True), nullable=True)  # when a worker started processing it
+    processed_at = Column(DateTime(timezone=True), nullable=True)
+
+class ProcessedWhatsAppMessage(Base):
+    """
+    Seen-set of inbound WhatsApp message ids (wamid), so Meta redeliveries are ignored.
+    A message is claimed ('processing') while it is being answered, and the claim is
+    dropped again if no reply went out. Rows older than WHATSAPP_DEDUPE_TTL_HOURS are purged.
+    """
+    __tablename__ = "processed_whatsapp_messages"
+
+    message_id = Column(String, primary_key=True)
+    status = Column(String, nullable=True)  # processing, handled (null: recorded before claims, handled)
+    seen_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)  # when last claimed
@@ -0,0 +1,21 @@
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey
+from sqlalchemy.sql import func
+from database import Base
+
+class WhatsAppNumber(Base):
+    """
+    A WhatsApp Business number connected by a user. Inbound webhooks are routed to the
+    owning business by Meta's phone_number_id (see services/whatsapp_numbers.py).
+    """
+    __tablename__ = "whatsapp_numbers"
+
+    id = Column(Integer, primary_key=True, index=True)
+    owner_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+
+    phone_number_id = Column(String, unique=True, index=True, nullable=False)  # Meta's id for the number
+    display_phone_number = Column(String, nullable=False)  # E.164, e.g. +919876543210
+    # The owner's Cloud API token, checked against the number at registration and used
+    # to send replies from it. NULL for numbers connected before ownership was verified.
+    access_token = Column(String, nullable=True)
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
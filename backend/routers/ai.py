@@ -1,10 +1,23 @@
-from typing import Any, Optional
-from fastapi import APIRouter, Depends, HTTPException
+import json
+import logging
+from typing import Any, AsyncIterator, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
 
 from models.user import User
+from models.conversation import ConversationMessage
+from database import get_db, AsyncSessionLocal
 from api.deps import get_current_active_user
-from services.ai import generate_marketing_copy, agentic_chat_response
+from services.credits import credit_meter
+from services.ai import (
+    generate_marketing_copy, agentic_chat_response, copy_cache, copy_cache_key,
+    ensure_openai_configured, stream_marketing_copy, stream_agentic_chat_response,
+)
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
@@ -12,43 +25,164 @@ class CopyGenerationRequest(BaseModel):
     prompt: str
     language: str = "Hindi"
     tone: str = "Persuasive"
+    stream: bool = False  # Server-Sent Events, one `data:` event per token
 
 class AgentChatRequest(BaseModel):
     message: str
     business_context: str
+    stream: bool = False
+
+# --- Streaming helpers ---
+
+def _sse(data: dict, event: Optional[str] = None) -> str:
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def _sse_response(events: AsyncIterator[str]) -> StreamingResponse:
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        # Stop proxies (nginx/Render) from buffering the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+async def _reserve_copy_credit(db: AsyncSession, user_id: int) -> None:
+    """Takes the AI credit before GPT-4o is called; 403 if the user has none left."""
+    if not await credit_meter.consume(db, user_id, "ai_copy"):
+        raise HTTPException(status_code=403, detail="No AI credits remaining.")
+
+async def _refund_copy_credit(user_id: int) -> None:
+    # Own session: the request's may be closed (streaming) or interrupted (cancellation)
+    async with AsyncSessionLocal() as session:
+        await credit_meter.refund(session, user_id)
+
+async def _relay_tokens(request: Request, tokens: AsyncIterator[str], cached: bool = False) -> AsyncIterator[str]:
+    """
+    Forwards upstream tokens as SSE `data` events followed by a `done` event.
+    Stops (and closes the upstream stream) as soon as the client goes away.
+    """
+    try:
+        async for token in tokens:
+            if await request.is_disconnected():
+                logger.info("AI stream client disconnected; cancelling upstream completion")
+                return
+            yield _sse({"delta": token})
+    except Exception as e:
+        logger.error(f"AI stream failed: {e}")
+        yield _sse({"detail": "AI generation failed."}, event="error")
+        return
+    finally:
+        await tokens.aclose()
+
+    yield _sse({"cached": cached}, event="done")
 
 @router.post("/generate-copy")
 async def generate_copy(
     req: CopyGenerationRequest,
+    request: Request,
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ) -> Any:
     """
     Generates AI marketing copy based on user requirements.
-    In real app, we'd deduct 'AI Credits' from the user's account here.
+    Repeated prompts (same text, language and tone, ignoring case/spacing) are served
+    from cache, and concurrent duplicates share one GPT-4o call. Only a request that
+    actually calls GPT-4o keeps the AI credit it reserves up front; it is refunded if
+    nothing was generated.
+    With `stream: true` the copy is sent as Server-Sent Events while it is generated;
+    concurrent duplicates share one streamed GPT-4o call (and the credit of the request
+    that started it).
     """
     if current_user.subscription_status != "active":
         # Usually, basic plans might have a limit, pro plans unlimited
         pass
 
-    generated_text = await generate_marketing_copy(req.prompt, req.language, req.tone)
+    key = copy_cache_key(req.prompt, req.language, req.tone)
+    cached_text = await copy_cache.get(key)
+    if cached_text:
+        if req.stream:
+            async def replay():
+                yield _sse({"delta": cached_text})
+                yield _sse({"cached": True}, event="done")
+            return _sse_response(replay())
+        return {"status": "success", "content": cached_text, "cached": True}
+
+    user_id = current_user.id
+    if req.stream:
+        ensure_openai_configured()
+        # Joining a call already in flight is free, like a cache hit
+        reserved = not copy_cache.in_flight(key)
+        if reserved:
+            await _reserve_copy_credit(db, user_id)
+
+        async def settle(generated: bool):
+            if not generated:
+                await _refund_copy_credit(user_id)
+
+        tokens, called_upstream = copy_cache.stream(
+            key, lambda: stream_marketing_copy(req.prompt, req.language, req.tone), on_done=settle if reserved else None,
+        )
+        if reserved and not called_upstream:
+            # Another request started the same call while the credit was reserved
+            await _refund_copy_credit(user_id)
+        return _sse_response(_relay_tokens(request, tokens, cached=not called_upstream))
+
+    await _reserve_copy_credit(db, user_id)
+    try:
+        generated_text, called_upstream = await copy_cache.get_or_generate(
+            key, lambda: generate_marketing_copy(req.prompt, req.language, req.tone)
+        )
+    except BaseException:
+        await _refund_copy_credit(user_id)
+        raise
+    if not generated_text or not called_upstream:
+        # Nothing generated, or another request's GPT-4o call served this one
+        await _refund_copy_credit(user_id)
     if not generated_text:
         raise HTTPException(status_code=500, detail="Failed to generate AI copy.")
-        
-    return {"status": "success", "content": generated_text}
+
+    return {"status": "success", "content": generated_text, "cached": not called_upstream}
 
 @router.post("/agent-reply")
 async def get_agent_reply(
     req: AgentChatRequest,
+    request: Request,
     current_user: User = Depends(get_current_active_user)
 ) -> Any:
     """
     Simulates the AI hitting a webhook from WhatsApp, processing the message against business context, and generating a reply.
+    With `stream: true` the reply is sent as Server-Sent Events while it is generated.
     """
     if current_user.subscription_tier not in ["growth", "paid_stripe", "paid_razorpay"]:
         raise HTTPException(status_code=403, detail="Agentic AI requires Growth plan or higher.")
+    
+    if req.stream:
+        ensure_openai_configured()
+        return _sse_response(_relay_tokens(request, stream_agentic_chat_response(req.message, req.business_context)))
         
     reply = await agentic_chat_response(req.message, req.business_context)
     if not reply:
         raise HTTPException(status_code=500, detail="AI Agent failed to respond.")
         
     return {"status": "success", "agent_reply": reply}
+
+@router.get("/conversations/{customer_phone}")
+async def get_conversation(
+    customer_phone: str,
+    limit: int = Query(50, ge=1, le=500),
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_active_user)
+) -> Any:
+    """
+    Latest turns of the AI agent's WhatsApp conversation with a customer, oldest first.
+    """
+    result = await db.execute(
+        select(ConversationMessage)
+        .where(ConversationMessage.owner_id == current_user.id, ConversationMessage.customer_phone == customer_phone)
+        .order_by(ConversationMessage.created_at.desc(), ConversationMessage.id.desc())
+        .limit(limit)
+    )
+    return [
+        {"direction": m.direction, "text": m.text, "created_at": m.created_at}
+        for m in reversed(result.scalars().all())
+    ]
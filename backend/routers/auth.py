@@ -7,14 +7,23 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 
 from core.config import settings
-from core.security import get_password_hash, verify_password, create_access_token
+from core.security import (
+    PasswordHasherBusy, create_access_token, get_password_hash_async, verify_password_async,
+)
 from database import get_db
 from models.user import User
 from schemas.user import UserCreate, UserResponse, Token
-from api.deps import get_current_active_user
+from api.deps import get_current_active_user, invalidate_user_cache
 
 router = APIRouter()
 
+def _hasher_busy() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Too many login attempts in progress. Please retry shortly.",
+        headers={"Retry-After": "1"},
+    )
+
 @router.post("/register", response_model=UserResponse, status_code=status.HTTP_201_CREATED)
 async def register(
     *,
@@ -32,9 +41,14 @@ async def register(
             detail="The user with this user name already exists in the system.",
         )
     
+    try:
+        hashed_password = await get_password_hash_async(user_in.password)
+    except PasswordHasherBusy:
+        raise _hasher_busy()
+    
     user = User(
         email=user_in.email,
-        hashed_password=get_password_hash(user_in.password),
+        hashed_password=hashed_password,
         full_name=user_in.full_name,
         company_name=user_in.company_name,
         phone_number=user_in.phone_number
@@ -49,15 +63,28 @@ async def login_access_token(
     db: AsyncSession = Depends(get_db), form_data: OAuth2PasswordRequestForm = Depends()
 ) -> Any:
     """
-    OAuth2 compatible token login, get an access token for future requests
+    OAuth2 compatible token login, get an access token for future requests.
+    Hashes made with an old bcrypt cost are transparently upgraded on success.
     """
     result = await db.execute(select(User).where(User.email == form_data.username))
     user = result.scalars().first()
     
-    if not user or not verify_password(form_data.password, user.hashed_password):
+    valid, new_hash = False, None
+    if user:
+        try:
+            valid, new_hash = await verify_password_async(form_data.password, user.hashed_password)
+        except PasswordHasherBusy:
+            raise _hasher_busy()
+    
+    if not valid:
         raise HTTPException(status_code=400, detail="Incorrect email or password")
     elif not user.is_active:
         raise HTTPException(status_code=400, detail="Inactive user")
+    
+    if new_hash:
+        user.hashed_password = new_hash
+        await db.commit()
+        invalidate_user_cache(user.id)
         
     access_token_expires = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
     return {
@@ -1,16 +1,19 @@
-from typing import Any, List, Optional
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
+import json
+import base64
+from datetime import datetime
+from typing import Any, List, Literal, Optional
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Query
 from pydantic import BaseModel
+from sqlalchemy import func, tuple_
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 
 from models.user import User
-from models.contact import Contact
+from models.contact import CONTACT_CREATED_AT_KEY, Contact
 from database import get_db
 from api.deps import get_current_active_user
-
-import csv
-import io
+from services.contact_import import import_contacts_csv_stream
+from services.tags import parse_tags, format_tags, set_contact_tags, tag_filters, get_tag_counts
 
 router = APIRouter()
 
@@ -42,20 +45,99 @@ class ContactResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class ContactPage(BaseModel):
+    items: List[ContactResponse]
+    next_cursor: Optional[str] = None
+    total: Optional[int] = None
+
+# --- Pagination helpers ---
+# Columns returned by the listing; selected directly so rows are never hydrated as ORM entities
+LIST_COLUMNS = (
+    Contact.id, Contact.name, Contact.phone, Contact.email, Contact.tags,
+    Contact.notes, Contact.source, Contact.total_messages_sent, CONTACT_CREATED_AT_KEY.label("created_at"),
+)
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+def _encode_cursor(row, order_field: str) -> str:
+    key = row["id"] if order_field == "id" else row["created_at"].isoformat()
+    raw = json.dumps([key, row["id"]]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def _decode_cursor(cursor: str, order_field: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        key, last_id = json.loads(raw)
+        if order_field == "created_at":
+            key = datetime.fromisoformat(key)
+        return key, int(last_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
 # --- Endpoints ---
 
-@router.get("/", response_model=List[ContactResponse])
+@router.get("/", response_model=ContactPage)
 async def list_contacts(
     tag: Optional[str] = None,
+    tags_all: Optional[str] = None,
+    tags_any: Optional[str] = None,
+    tags_not: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    order: Literal["id", "-id", "created_at", "-created_at"] = "id",
+    include_total: bool = False,
     db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ) -> Any:
-    """List all contacts for the current business owner. Optionally filter by tag."""
-    query = select(Contact).where(Contact.owner_id == current_user.id)
-    if tag:
-        query = query.where(Contact.tags.contains(tag))
-    result = await db.execute(query)
-    return result.scalars().all()
+    """
+    List contacts for the current business owner, one page at a time.
+    Tag filters take comma-separated tags: `tags_all` (has every tag), `tags_any`
+    (has at least one), `tags_not` (has none). `tag` is shorthand for a single exact tag.
+    Pass the returned `next_cursor` back as `cursor` to fetch the following page;
+    `total` is only counted when `include_total=true`.
+    """
+    descending = order.startswith("-")
+    order_field = order.lstrip("-")
+
+    filters = [Contact.owner_id == current_user.id]
+    filters += tag_filters(
+        current_user.id,
+        all_of=parse_tags(tag) + parse_tags(tags_all),
+        any_of=parse_tags(tags_any),
+        none_of=parse_tags(tags_not),
+    )
+
+    # Keyset on (sort column, id): served from the (owner_id, id) / (owner_id, created_at key, id) indexes
+    sort_key = (Contact.id,) if order_field == "id" else (CONTACT_CREATED_AT_KEY, Contact.id)
+    query = select(*LIST_COLUMNS).where(*filters)
+    if cursor:
+        key, last_id = _decode_cursor(cursor, order_field)
+        if order_field == "id":
+            position, bound = Contact.id, last_id
+        else:
+            # Compare against the stored value of the cursor row so the DB's own datetime
+            # representation is used; the encoded timestamp only covers a deleted cursor row.
+            stored = select(CONTACT_CREATED_AT_KEY).where(Contact.id == last_id).scalar_subquery()
+            position, bound = tuple_(*sort_key), tuple_(func.coalesce(stored, key), last_id)
+        query = query.where(position < bound if descending else position > bound)
+    query = query.order_by(*(col.desc() if descending else col.asc() for col in sort_key)).limit(limit + 1)
+
+    rows = (await db.execute(query)).mappings().all()
+    next_cursor = _encode_cursor(rows[limit - 1], order_field) if len(rows) > limit else None
+
+    total = None
+    if include_total:
+        total = (await db.execute(select(func.count()).select_from(Contact).where(*filters))).scalar_one()
+
+    return {"items": rows[:limit], "next_cursor": next_cursor, "total": total}
+
+@router.get("/tags")
+async def list_tags(
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_active_user)
+) -> Any:
+    """Every tag the business uses, with how many contacts carry it."""
+    return await get_tag_counts(db, current_user.id)
 
 @router.post("/", response_model=ContactResponse, status_code=201)
 async def create_contact(
@@ -64,16 +146,19 @@ async def create_contact(
     current_user: User = Depends(get_current_active_user)
 ) -> Any:
     """Add a single contact to the business's list."""
+    tags = parse_tags(contact_in.tags)
     contact = Contact(
         owner_id=current_user.id,
         name=contact_in.name,
         phone=contact_in.phone,
         email=contact_in.email,
-        tags=contact_in.tags or "",
+        tags=format_tags(tags),
         notes=contact_in.notes or "",
         source="manual"
     )
     db.add(contact)
+    await db.flush()
+    await set_contact_tags(db, current_user.id, contact.id, tags)
     await db.commit()
     await db.refresh(contact)
     return contact
@@ -94,6 +179,10 @@ async def update_contact(
         raise HTTPException(status_code=404, detail="Contact not found")
     
     for field, value in contact_in.dict(exclude_unset=True).items():
+        if field == "tags":
+            tags = parse_tags(value)
+            await set_contact_tags(db, current_user.id, contact.id, tags)
+            value = format_tags(tags)
         setattr(contact, field, value)
     
     await db.commit()
@@ -114,6 +203,7 @@ async def delete_contact(
     if not contact:
         raise HTTPException(status_code=404, detail="Contact not found")
     
+    await set_contact_tags(db, current_user.id, contact.id, [])
     await db.delete(contact)
     await db.commit()
     return {"status": "deleted"}
@@ -127,39 +217,10 @@ async def import_contacts_csv(
     """
     Import contacts from a CSV file.
     CSV must have columns: name, phone (required), email (optional), tags (optional)
+    The upload is streamed and written in batches; rows whose phone already exists
+    for this owner (or earlier in the file) are skipped as duplicates.
     """
     if not file.filename.endswith('.csv'):
         raise HTTPException(status_code=400, detail="Only CSV files are accepted")
     
-    contents = await file.read()
-    decoded = contents.decode('utf-8')
-    reader = csv.DictReader(io.StringIO(decoded))
-    
-    imported_count = 0
-    errors = []
-    
-    for i, row in enumerate(reader):
-        phone = row.get('phone', '').strip()
-        name = row.get('name', '').strip()
-        
-        if not phone:
-            errors.append(f"Row {i+1}: Missing phone number")
-            continue
-            
-        contact = Contact(
-            owner_id=current_user.id,
-            name=name,
-            phone=phone,
-            email=row.get('email', '').strip() or None,
-            tags=row.get('tags', '').strip(),
-            source="csv_import"
-        )
-        db.add(contact)
-        imported_count += 1
-    
-    await db.commit()
-    return {
-        "status": "success",
-        "imported": imported_count,
-        "errors": errors
-    }
+    return await import_contacts_csv_stream(db, current_user.id, file.file)
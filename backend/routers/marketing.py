@@ -1,56 +1,236 @@
-from typing import Any, List
-from fastapi import APIRouter, Depends, HTTPException
+from typing import Any, List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query
 from pydantic import BaseModel
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
 
+from core.phone import normalize_e164
 from models.user import User
+from models.campaign import Campaign
+from models.whatsapp_number import WhatsAppNumber
+from database import get_db
 from api.deps import get_current_active_user
-from services.whatsapp import send_whatsapp_message
-from services.email import send_email
+from services.whatsapp import ensure_whatsapp_configured, fetch_phone_number, resolve_media_url
+from services.analytics import MAX_PERIODS, get_analytics
+from services.campaigns import enqueue_campaign, get_campaign_progress
+from services.templating import TemplateError, compile_template
+from services.whatsapp_numbers import whatsapp_routes
 
 router = APIRouter()
 
+class WhatsAppTemplateRequest(BaseModel):
+    template_name: str
+    language_code: str = "en_US"
+    body_parameters: List[str] = []  # {{1}}, {{2}}... of the approved template; may use contact fields like {{name|there}}
+    header_image_url: Optional[str] = None
+
 class BulkMessageRequest(BaseModel):
     numbers: List[str]
-    message: str
+    message: str = ""  # may use {{name}}, {{name|there}} etc. (see services/templating.py)
+    template: Optional[WhatsAppTemplateRequest] = None  # required to message customers outside the 24h window
 
 class EmailCampaignRequest(BaseModel):
     emails: List[str]
     subject: str
     html_content: str
 
+class WhatsAppNumberRequest(BaseModel):
+    phone_number_id: str
+    display_phone_number: str
+    access_token: str  # a Cloud API token for the WhatsApp Business Account owning the number
+
+def _validate_template(body: str) -> None:
+    try:
+        compile_template(body)
+    except TemplateError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 @router.post("/whatsapp/send-bulk")
 async def send_bulk_whatsapp(
     req: BulkMessageRequest,
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ) -> Any:
     """
-    Send a bulk WhatsApp message to a list of numbers. 
+    Queue a bulk WhatsApp message to a list of numbers. 
     Requires user to have an active subscription (mock validation included).
+    The campaign worker (worker.py) sends it in the background under the
+    per-phone-number rate limit; poll GET /campaigns/{id} for progress.
     """
     if current_user.subscription_status != "active":
         raise HTTPException(status_code=403, detail="Active subscription required for bulk sending.")
+    ensure_whatsapp_configured()
+    if req.template:
+        for parameter in req.template.body_parameters:
+            _validate_template(parameter)
+        if req.template.header_image_url:
+            # Reject non-https or internal URLs now rather than when the worker fetches them
+            await resolve_media_url(req.template.header_image_url)
+        body = req.message or f"[template] {req.template.template_name}"
+    elif req.message:
+        _validate_template(req.message)
+        body = req.message
+    else:
+        raise HTTPException(status_code=400, detail="Either message or template is required.")
         
-    results = []
-    for number in req.numbers:
-        res = await send_whatsapp_message(number, req.message)
-        results.append(res)
-        
-    return {"status": "success", "results": results}
+    campaign = await enqueue_campaign(
+        db, current_user.id, "whatsapp", req.numbers, body,
+        whatsapp_template=req.template.model_dump() if req.template else None,
+    )
+    return {"status": "queued", "campaign_id": campaign.id, "total_recipients": campaign.total_recipients}
 
 @router.post("/email/send-campaign")
 async def send_email_campaign(
     req: EmailCampaignRequest,
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ) -> Any:
     """
-    Send an email campaign.
+    Queue an email campaign for the background worker.
     """
     if current_user.subscription_status != "active":
         raise HTTPException(status_code=403, detail="Active subscription required.")
+    _validate_template(req.html_content)
         
-    results = []
-    for email in req.emails:
-        res = await send_email(email, req.subject, req.html_content)
-        results.append(res)
-        
-    return {"status": "success", "results": results}
+    campaign = await enqueue_campaign(db, current_user.id, "email", req.emails, req.html_content, subject=req.subject)
+    return {"status": "queued", "campaign_id": campaign.id, "total_recipients": campaign.total_recipients}
+
+@router.get("/campaigns/{campaign_id}")
+async def get_campaign(
+    campaign_id: int,
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_active_user)
+) -> Any:
+    """
+    Delivery progress of a queued campaign.
+    """
+    result = await db.execute(
+        select(Campaign).where(Campaign.id == campaign_id, Campaign.owner_id == current_user.id)
+    )
+    campaign = result.scalars().first()
+    if not campaign:
+        raise HTTPException(status_code=404, detail="Campaign not found")
+    return await get_campaign_progress(db, campaign)
+
+@router.get("/analytics")
+async def get_marketing_analytics(
+    campaign_id: Optional[int] = None,
+    granularity: str = Query("day", pattern="^(hour|day)$"),
+    periods: int = Query(30, ge=1, le=MAX_PERIODS["day"]),
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_active_user)
+) -> Any:
+    """
+    Sent/delivered/read/failed, replies and AI credits used over the last `periods` hours or
+    days, for one campaign or (without campaign_id) the whole account. Served from
+    precomputed rollups (services/analytics.py); hourly data covers up to 7 days.
+    """
+    if campaign_id is not None:
+        result = await db.execute(
+            select(Campaign.id).where(Campaign.id == campaign_id, Campaign.owner_id == current_user.id)
+        )
+        if result.scalar() is None:
+            raise HTTPException(status_code=404, detail="Campaign not found")
+    return await get_analytics(db, current_user.id, campaign_id or 0, granularity, periods)
+
+def _serialize_number(number: WhatsAppNumber) -> dict:
+    return {
+        "id": number.id,
+        "phone_number_id": number.phone_number_id,
+        "display_phone_number": number.display_phone_number,
+        "created_at": number.created_at,
+    }
+
+@router.get("/whatsapp/numbers")
+async def list_whatsapp_numbers(
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_active_user)
+) -> Any:
+    """
+    WhatsApp Business numbers connected to this account.
+    """
+    result = await db.execute(
+        select(WhatsAppNumber).where(WhatsAppNumber.owner_id == current_user.id).order_by(WhatsAppNumber.id)
+    )
+    return [_serialize_number(n) for n in result.scalars().all()]
+
+@router.post("/whatsapp/numbers", status_code=201)
+async def register_whatsapp_number(
+    req: WhatsAppNumberRequest,
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_active_user)
+) -> Any:
+    """
+    Connect a WhatsApp Business number (Meta's phone_number_id + its display number),
+    so inbound messages to it are answered by this account's AI agent.
+
+    Ownership is checked with Meta first: the given access token must be able to read
+    the number, and Meta's display number for it must match. A verified registration
+    takes over a number connected before verification existed.
+    """
+    phone_number_id = req.phone_number_id.strip()
+    access_token = req.access_token.strip()
+    if not phone_number_id:
+        raise HTTPException(status_code=400, detail="phone_number_id is required")
+    if not access_token:
+        raise HTTPException(status_code=400, detail="access_token is required")
+    try:
+        display_phone_number = normalize_e164(req.display_phone_number)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    try:
+        verified_number = normalize_e164(await fetch_phone_number(phone_number_id, access_token))
+    except ValueError:
+        verified_number = None
+    if verified_number != display_phone_number:
+        raise HTTPException(status_code=403, detail="Meta reports a different display number for this phone_number_id.")
+
+    owner_id = current_user.id
+    number = WhatsAppNumber(
+        owner_id=owner_id,
+        phone_number_id=phone_number_id,
+        display_phone_number=display_phone_number,
+        access_token=access_token,
+    )
+    db.add(number)
+    try:
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        result = await db.execute(
+            update(WhatsAppNumber)
+            .where(WhatsAppNumber.phone_number_id == phone_number_id, WhatsAppNumber.access_token.is_(None))
+            .values(owner_id=owner_id, display_phone_number=display_phone_number, access_token=access_token)
+            .returning(WhatsAppNumber.id)
+        )
+        number_id = result.scalar()
+        await db.commit()
+        if number_id is None:
+            raise HTTPException(status_code=409, detail="This WhatsApp number is already connected to an account.")
+        number = await db.get(WhatsAppNumber, number_id)
+    await db.refresh(number)
+    await whatsapp_routes.refresh(db)
+    return _serialize_number(number)
+
+@router.delete("/whatsapp/numbers/{number_id}")
+async def delete_whatsapp_number(
+    number_id: int,
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_active_user)
+) -> Any:
+    """
+    Disconnect a WhatsApp Business number.
+    """
+    result = await db.execute(
+        select(WhatsAppNumber).where(WhatsAppNumber.id == number_id, WhatsAppNumber.owner_id == current_user.id)
+    )
+    number = result.scalars().first()
+    if not number:
+        raise HTTPException(status_code=404, detail="WhatsApp number not found")
+    await db.delete(number)
+    await db.commit()
+    await whatsapp_routes.refresh(db)
+    return {"status": "deleted"}
@@ -1,28 +1,21 @@
 from typing import Any
 from fastapi import APIRouter, Depends, HTTPException, Request, Header
-from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.future import select
 
 import stripe
-import razorpay
 import hmac
 import hashlib
 import json
 
 from core.config import settings
-from database import get_db
 from models.user import User
 from api.deps import get_current_active_user
+from services.payment_events import payment_events, razorpay_event_row, stripe_event_row
+from services.payments import (
+    PaymentGatewayBusy, construct_stripe_event, razorpay_create_subscription, stripe_create_checkout_session,
+)
 
 router = APIRouter()
 
-stripe.api_key = settings.STRIPE_SECRET_KEY
-
-# Initialize Razorpay Client
-if not settings.RAZORPAY_KEY_ID or not settings.RAZORPAY_KEY_SECRET:
-    raise ValueError("RAZORPAY_KEY_ID and RAZORPAY_KEY_SECRET must be set in the environment.")
-razorpay_client = razorpay.Client(auth=(settings.RAZORPAY_KEY_ID, settings.RAZORPAY_KEY_SECRET))
-
 # Pricing Plans (Hardcoded for beta MVP)
 PLANS = {
     "starter_inr": {"razorpay_plan_id": "plan_starter", "stripe_price_id": "price_starter_inr", "name": "starter"},
@@ -42,7 +35,7 @@ async def create_stripe_checkout(
         raise HTTPException(status_code=400, detail="Invalid plan")
         
     try:
-        checkout_session = stripe.checkout.Session.create(
+        checkout_session = await stripe_create_checkout_session(
             customer_email=current_user.email,
             payment_method_types=['card'],
             line_items=[
@@ -57,6 +50,8 @@ async def create_stripe_checkout(
             client_reference_id=str(current_user.id)
         )
         return {"url": checkout_session.url}
+    except PaymentGatewayBusy:
+        raise HTTPException(status_code=503, detail="Payment gateway is busy, please try again.")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -71,9 +66,6 @@ async def create_razorpay_subscription(
     if plan_key not in PLANS:
         raise HTTPException(status_code=400, detail="Invalid plan")
         
-    if not razorpay_client:
-        raise HTTPException(status_code=500, detail="Razorpay not configured")
-        
     try:
         subscription_data = {
             "plan_id": PLANS[plan_key]["razorpay_plan_id"],
@@ -83,8 +75,10 @@ async def create_razorpay_subscription(
                 "user_id": str(current_user.id)
             }
         }
-        subscription = razorpay_client.subscription.create(data=subscription_data)
+        subscription = await razorpay_create_subscription(subscription_data)
         return {"subscription_id": subscription['id'], "short_url": subscription.get('short_url')}
+    except PaymentGatewayBusy:
+        raise HTTPException(status_code=503, detail="Payment gateway is busy, please try again.")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -92,36 +86,22 @@ async def create_razorpay_subscription(
 async def stripe_webhook(
     request: Request,
     stripe_signature: str = Header(None),
-    db: AsyncSession = Depends(get_db)
 ) -> Any:
     """
     Stripe Webhook handler
     """
     payload = await request.body()
     try:
-        event = stripe.Webhook.construct_event(
-            payload, stripe_signature, settings.STRIPE_WEBHOOK_SECRET
-        )
+        construct_stripe_event(payload, stripe_signature)
     except ValueError as e:
         raise HTTPException(status_code=400, detail="Invalid payload")
     except stripe.error.SignatureVerificationError as e:
         raise HTTPException(status_code=400, detail="Invalid signature")
 
-    if event['type'] == 'checkout.session.completed':
-        session = event['data']['object']
-        client_reference_id = session.get('client_reference_id')
-        customer_id = session.get('customer')
-        
-        if client_reference_id:
-            user_id = int(client_reference_id)
-            result = await db.execute(select(User).where(User.id == user_id))
-            user = result.scalars().first()
-            if user:
-                user.stripe_customer_id = customer_id
-                user.subscription_status = "active"
-                # TODO: Retrieve actual plan name from Stripe subscription
-                user.subscription_tier = "paid_stripe"
-                await db.commit()
+    # Store the event and acknowledge; it is applied by services/payment_events.py
+    row = stripe_event_row(payload)
+    if row:
+        await payment_events.receive(row)
 
     return {"status": "success"}
 
@@ -129,7 +109,7 @@ async def stripe_webhook(
 async def razorpay_webhook(
     request: Request,
     X_Razorpay_Signature: str = Header(None),
-    db: AsyncSession = Depends(get_db)
+    X_Razorpay_Event_Id: str = Header(None),
 ) -> Any:
     """
     Razorpay Webhook handler
@@ -147,21 +127,8 @@ async def razorpay_webhook(
         raise HTTPException(status_code=400, detail="Invalid signature")
         
     data = json.loads(payload)
-    event_type = data.get('event')
-    
-    if event_type == 'subscription.authenticated' or event_type == 'subscription.charged':
-        sub_entity = data['payload']['subscription']['entity']
-        notes = sub_entity.get('notes', {})
-        user_id_str = notes.get('user_id')
-        
-        if user_id_str:
-            user_id = int(user_id_str)
-            result = await db.execute(select(User).where(User.id == user_id))
-            user = result.scalars().first()
-            if user:
-                user.razorpay_customer_id = sub_entity.get('customer_id')
-                user.subscription_status = "active"
-                user.subscription_tier = "paid_razorpay"
-                await db.commit()
-                
+    row = razorpay_event_row(data, payload, X_Razorpay_Event_Id)
+    if row:
+        await payment_events.receive(row)
+
     return {"status": "success"}
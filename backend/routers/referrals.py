@@ -1,12 +1,24 @@
-from typing import Any
-from fastapi import APIRouter, Depends, HTTPException
+import json
+import base64
+from datetime import datetime
+from typing import Any, List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query
 from pydantic import BaseModel
+from sqlalchemy import insert, update
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 
+from core.config import settings
 from models.user import User
+from models.referral import ReferralEvent
 from database import get_db
-from api.deps import get_current_active_user
+from api.deps import get_current_active_user, invalidate_user_cache
+from services.credits import grant_credits
+from services.leaderboard import referral_leaderboard
+from services.referral_tree import (
+    downline_depth_counts, downline_size, is_in_downline, link_referral, list_downline,
+)
 
 router = APIRouter()
 
@@ -20,9 +32,36 @@ class ReferralDashboardResponse(BaseModel):
     referral_credits: int
     referral_link: str
 
+class DownlineUser(BaseModel):
+    id: int
+    name: str
+    depth: int  # 1 = referred by you directly
+    referred_by_id: Optional[int]
+    joined_at: Optional[datetime]
+
+class DownlinePage(BaseModel):
+    items: List[DownlineUser]
+    next_cursor: Optional[str] = None
+
 # --- Constants ---
 REFERRAL_CREDIT_REWARD = 1  # Each successful referral = 1 AI Credit Pack (₹199 worth)
 REFERRED_USER_BONUS_CREDITS = 10  # New user who used a code gets 10 bonus AI credits
+REFERRER_BONUS_AI_CREDITS = 20  # Referrer also gets 20 AI credits per successful referral
+CYCLE_DETAIL = "You cannot use the referral code of someone you referred."
+
+DEFAULT_DOWNLINE_PAGE_SIZE = 50
+MAX_DOWNLINE_PAGE_SIZE = 500
+
+def _encode_downline_cursor(row) -> str:
+    raw = json.dumps([row["depth"], row["id"]]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def _decode_downline_cursor(cursor: str):
+    try:
+        depth, last_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return int(depth), int(last_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
 
 # --- Endpoints ---
 
@@ -70,17 +109,52 @@ async def apply_referral_code(
         raise HTTPException(status_code=400, detail="You cannot refer yourself.")
     
     # --- Dual-Sided Reward ---
+    # Counters are updated in SQL so concurrent referrals can't lose an increment
+    
+    # The NEW USER can only be referred once, even by concurrent requests
+    result = await db.execute(
+        update(User)
+        .where(User.id == current_user.id, User.referred_by_id.is_(None))
+        .values(referred_by_id=referrer.id)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount != 1:
+        await db.rollback()
+        raise HTTPException(status_code=400, detail="You have already used a referral code.")
+    
+    # Someone in your own downline can't become your referrer. Checked after claiming the
+    # row above, so a referral the other way round committed meanwhile is seen
+    if await is_in_downline(db, current_user.id, referrer.id):
+        await db.rollback()
+        raise HTTPException(status_code=400, detail=CYCLE_DETAIL)
     
     # Reward the REFERRER
-    referrer.referral_credits += REFERRAL_CREDIT_REWARD
-    referrer.total_referrals += 1
-    referrer.ai_credits_remaining += 20  # Bonus AI credits for bringing a new user
+    await db.execute(
+        update(User)
+        .where(User.id == referrer.id)
+        .values(
+            referral_credits=User.referral_credits + REFERRAL_CREDIT_REWARD,
+            total_referrals=User.total_referrals + 1,
+        )
+        .execution_options(synchronize_session=False)
+    )
+    await grant_credits(db, referrer.id, REFERRER_BONUS_AI_CREDITS, "referral_bonus", req.referral_code, commit=False)  # Bonus AI credits for bringing a new user
     
     # Reward the NEW USER
-    current_user.referred_by_id = referrer.id
-    current_user.ai_credits_remaining += REFERRED_USER_BONUS_CREDITS
+    await grant_credits(db, current_user.id, REFERRED_USER_BONUS_CREDITS, "referral_welcome", req.referral_code, commit=False)
     
-    await db.commit()
+    # Dated record for the weekly/monthly leaderboards
+    await db.execute(insert(ReferralEvent).values(referrer_id=referrer.id, referred_id=current_user.id))
+    # Place the new user (and anyone they already referred) in the multi-level referral tree.
+    # A concurrent referral linking the same users conflicts on the closure's primary key
+    try:
+        await link_referral(db, referrer.id, current_user.id)
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        raise HTTPException(status_code=400, detail=CYCLE_DETAIL)
+    invalidate_user_cache(referrer.id, current_user.id)
+    referral_leaderboard.record(referrer.id, referrer.full_name or referrer.company_name or "Anonymous")
     
     return {
         "status": "success",
@@ -90,25 +164,64 @@ async def apply_referral_code(
     }
 
 @router.get("/leaderboard")
-async def referral_leaderboard(
+async def get_referral_leaderboard(
+    window: str = Query("all", pattern="^(all|month|week)$"),
+    limit: int = Query(10, ge=1, le=settings.REFERRAL_LEADERBOARD_SIZE),
+    current_user: User = Depends(get_current_active_user)
+) -> Any:
+    """
+    Show top referrers on the platform (gamification to encourage more referrals),
+    all-time or for this month/week. Served from memory (services/leaderboard.py).
+    """
+    return referral_leaderboard.top(window, limit)
+
+@router.get("/leaderboard/me")
+async def get_my_referral_rank(
+    window: str = Query("all", pattern="^(all|month|week)$"),
+    current_user: User = Depends(get_current_active_user)
+) -> Any:
+    """
+    The current user's leaderboard rank (null until their first referral in the window).
+    """
+    return referral_leaderboard.rank(current_user.id, window)
+
+@router.get("/downline/size")
+async def get_downline_size(
+    max_depth: Optional[int] = Query(None, ge=1),
     db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ) -> Any:
     """
-    Show top 10 referrers on the platform (gamification to encourage more referrals).
+    How many users are in your downline: people you referred, people they referred, and so on
+    (optionally only down to `max_depth` levels).
     """
-    result = await db.execute(
-        select(User.full_name, User.company_name, User.total_referrals)
-        .where(User.total_referrals > 0)
-        .order_by(User.total_referrals.desc())
-        .limit(10)
-    )
-    leaders = result.all()
-    return [
-        {
-            "rank": i + 1,
-            "name": leader.full_name or leader.company_name or "Anonymous",
-            "referrals": leader.total_referrals
-        }
-        for i, leader in enumerate(leaders)
-    ]
+    return {"total": await downline_size(db, current_user.id, max_depth)}
+
+@router.get("/downline/depths")
+async def get_downline_depths(
+    max_depth: Optional[int] = Query(None, ge=1),
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_active_user)
+) -> Any:
+    """
+    Downline size per level (depth 1 = referred by you directly).
+    """
+    return await downline_depth_counts(db, current_user.id, max_depth)
+
+@router.get("/downline", response_model=DownlinePage)
+async def get_downline(
+    depth: Optional[int] = Query(None, ge=1),
+    max_depth: Optional[int] = Query(None, ge=1),
+    limit: int = Query(DEFAULT_DOWNLINE_PAGE_SIZE, ge=1, le=MAX_DOWNLINE_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_active_user)
+) -> Any:
+    """
+    Users in your downline, nearest levels first; `depth` lists a single level.
+    Pass the returned `next_cursor` back as `cursor` to fetch the following page.
+    """
+    after = _decode_downline_cursor(cursor) if cursor else None
+    rows = await list_downline(db, current_user.id, depth=depth, max_depth=max_depth, after=after, limit=limit)
+    next_cursor = _encode_downline_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return {"items": rows[:limit], "next_cursor": next_cursor}
@@ -1,16 +1,16 @@
 import os
+import json
 import logging
+from datetime import datetime, timedelta
 from typing import Any
 
 from fastapi import APIRouter, Depends, HTTPException, Request, Query
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.future import select
 
-from core.config import settings
 from database import get_db
-from models.user import User
-from services.ai import agentic_chat_response
-from services.whatsapp import send_whatsapp_message
+from models.webhook import InboundWebhookEvent
+from services.inbound import REQUEUE_AFTER_SECONDS, has_messages, inbound_pipeline
+from services.message_status import message_status
 
 logger = logging.getLogger(__name__)
 
@@ -47,109 +47,34 @@ async def receive_whatsapp_message(
     Flow:
     1. Customer sends a WhatsApp message to the business's number.
     2. Meta forwards this message to our webhook URL.
-    3. We extract the sender's number and message text.
-    4. We look up which business owns this WhatsApp number.
-    5. We read the business's context (e.g., "Dental clinic, open 9-5").
-    6. We call GPT-4o with the customer message + business context.
-    7. We send the AI-generated reply back to the customer via WhatsApp API.
+    3. We store the raw payload and acknowledge immediately, so Meta doesn't time out and redeliver.
+    4. The inbound pipeline (services/inbound.py) then looks up the business, calls GPT-4o
+       with the customer message + business context and sends the reply back via WhatsApp API.
+       Redelivered messages are recognised by their message id and answered only once.
+    Delivery/read status callbacks for our outbound messages arrive here too; they update
+    the contacts' engagement counters (services/message_status.py) without storing the payload.
     
     All of this happens instantly while the business owner sleeps.
     """
-    body = await request.json()
-    
+    payload = await request.body()
     try:
-        # Extract the incoming message from Meta's webhook payload
-        entry = body.get("entry", [])
-        if not entry:
-            return {"status": "ok"}
-        
-        changes = entry[0].get("changes", [])
-        if not changes:
-            return {"status": "ok"}
-        
-        value = changes[0].get("value", {})
-        messages = value.get("messages", [])
-        
-        if not messages:
-            # This might be a status update (delivered, read), not an actual message
-            return {"status": "ok"}
-        
-        # Get the incoming message details
-        message = messages[0]
-        sender_phone = message.get("from", "")
-        message_type = message.get("type", "")
-        
-        # We only handle text messages for now
-        if message_type != "text":
-            logger.info(f"Received non-text message type: {message_type} from {sender_phone}")
-            return {"status": "ok", "note": "Only text messages are supported by the AI agent currently."}
-        
-        message_text = message.get("text", {}).get("body", "")
-        
-        if not message_text:
-            return {"status": "ok"}
-        
-        logger.info(f"Incoming WhatsApp from {sender_phone}: {message_text}")
-        
-        # Find the business owner who owns the WhatsApp number that received this message
-        # The phone_number_id from the webhook tells us which business number was messaged
-        metadata = value.get("metadata", {})
-        display_phone = metadata.get("display_phone_number", "")
-        
-        # Look up the business owner by their registered phone number or by their WhatsApp number
-        result = await db.execute(
-            select(User).where(User.phone_number == display_phone)
-        )
-        business_owner = result.scalars().first()
-        
-        if not business_owner:
-            # Fallback: use the first active user (for MVP/demo purposes)
-            result = await db.execute(
-                select(User).where(User.is_active == True).limit(1)
-            )
-            business_owner = result.scalars().first()
-        
-        if not business_owner:
-            logger.warning("No business owner found for this WhatsApp number")
-            return {"status": "ok"}
-        
-        # Check if the business owner has AI Agent enabled (Growth plan or higher)
-        if business_owner.subscription_tier in ["free", "starter"]:
-            logger.info(f"Business {business_owner.email} is on {business_owner.subscription_tier} plan - AI Agent not available")
-            return {"status": "ok", "note": "AI Agent requires Growth plan or higher"}
-        
-        # Check AI credits
-        if business_owner.ai_credits_remaining <= 0:
-            logger.info(f"Business {business_owner.email} has no AI credits remaining")
-            return {"status": "ok", "note": "No AI credits remaining"}
-        
-        # Get the business context for smart replies
-        business_context = business_owner.business_context or f"Business: {business_owner.company_name or 'Unknown'}. Please assist the customer."
-        
-        # Generate the autonomous AI reply
-        ai_reply = await agentic_chat_response(message_text, business_context)
-        
-        if not ai_reply:
-            logger.error("AI Agent failed to generate a response")
-            return {"status": "error", "note": "AI generation failed"}
-        
-        # Send the AI reply back to the customer via WhatsApp
-        send_result = await send_whatsapp_message(sender_phone, ai_reply)
-        
-        # Deduct 1 AI credit
-        business_owner.ai_credits_remaining -= 1
-        await db.commit()
-        
-        logger.info(f"AI Agent replied to {sender_phone}: {ai_reply[:50]}...")
-        
-        return {
-            "status": "success",
-            "customer_phone": sender_phone,
-            "customer_message": message_text,
-            "ai_reply": ai_reply,
-            "credits_remaining": business_owner.ai_credits_remaining
-        }
-        
-    except Exception as e:
-        logger.error(f"Error processing inbound WhatsApp message: {str(e)}")
-        return {"status": "error", "detail": str(e)}
+        body = json.loads(payload)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid JSON payload")
+
+    # Delivery/read statuses only update buffered counters; they are written in batches
+    message_status.ingest(body)
+    if not has_messages(body):
+        return {"status": "ok"}
+
+    event = InboundWebhookEvent(
+        provider="whatsapp",
+        payload=payload.decode("utf-8"),
+        # The retry sweep picks it up from then on if it is still unprocessed (e.g. this worker died)
+        next_attempt_at=datetime.utcnow() + timedelta(seconds=REQUEUE_AFTER_SECONDS),
+    )
+    db.add(event)
+    await db.commit()
+
+    inbound_pipeline.submit(event.id)
+    return {"status": "ok"}
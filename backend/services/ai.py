@@ -1,74 +1,130 @@
 import os
-import httpx
-from typing import Optional
+import json
+from typing import AsyncIterator, Dict, List, Optional
+
+from core.config import settings
+from services.ai_cache import ResponseCache, make_cache_key
+from services.http_client import get_http_client
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
+OPENAI_API_BASE_URL = os.getenv("OPENAI_API_BASE_URL", "https://api.openai.com")
+COPY_MODEL = "gpt-4o"  # or gpt-3.5-turbo
 
-async def generate_marketing_copy(prompt: str, language: str = "English", tone: str = "Professional") -> Optional[str]:
+# Identical copy requests (after normalization) are served from here instead of GPT-4o
+copy_cache = ResponseCache(
+    settings.AI_CACHE_MAX_ENTRIES,
+    settings.AI_CACHE_TTL_SECONDS,
+    disk_path=settings.AI_CACHE_DB_PATH,
+    disk_max_entries=settings.AI_CACHE_DISK_MAX_ENTRIES,
+)
+
+def copy_cache_key(prompt: str, language: str, tone: str) -> str:
+    return make_cache_key(prompt, language, tone, COPY_MODEL)
+
+def ensure_openai_configured():
     """
-    Calls OpenAI API to generate marketing copy in a specific language and tone.
+    Raises a 500 if the OpenAI API key is not configured.
     """
     if not OPENAI_API_KEY:
         from fastapi import HTTPException
         raise HTTPException(status_code=500, detail="OpenAI API Key is missing. Please configure it in your environment variables.")
 
-    url = "https://api.openai.com/v1/chat/completions"
+def _completions_request():
+    url = f"{OPENAI_API_BASE_URL}/v1/chat/completions"
     headers = {
         "Authorization": f"Bearer {OPENAI_API_KEY}",
         "Content-Type": "application/json"
     }
-    
+    return url, headers
+
+def _copy_payload(prompt: str, language: str, tone: str) -> dict:
     system_prompt = f"You are an expert digital marketing copywriter for Indian SMBs. Write highly converting marketing text. Language: {language}. Tone: {tone}."
     
-    payload = {
-        "model": "gpt-4o",  # or gpt-3.5-turbo
+    return {
+        "model": COPY_MODEL,
         "messages": [
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": f"Write a WhatsApp/Email marketing message for the following: {prompt}. Include emojis where appropriate but keep it professional."}
         ],
         "temperature": 0.7
     }
-    
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.post(url, json=payload, headers=headers)
-            response.raise_for_status()
-            data = response.json()
-            return data["choices"][0]["message"]["content"]
-        except Exception as e:
-            print(f"Error calling OpenAI API: {e}")
-            return None
 
-async def agentic_chat_response(customer_message: str, business_context: str) -> Optional[str]:
-    """
-    Generates a smart, autonomous reply based on the customer's message and the business's context (e.g., booking availability).
-    """
-    if not OPENAI_API_KEY:
-        from fastapi import HTTPException
-        raise HTTPException(status_code=500, detail="OpenAI API Key is missing. Please configure it in your environment variables.")
-        
-    url = "https://api.openai.com/v1/chat/completions"
-    headers = {
-        "Authorization": f"Bearer {OPENAI_API_KEY}",
-        "Content-Type": "application/json"
-    }
-    
+def _agent_payload(customer_message: str, business_context: str, history: Optional[List[Dict[str, str]]] = None) -> dict:
     system_prompt = f"You are a helpful AI customer service agent for an Indian business. The business details are: {business_context}. Answer the user's question accurately in a friendly tone. If you are asked to book something, assume it is possible if requested. Keep it concise for WhatsApp."
     
-    payload = {
+    return {
         "model": "gpt-4o",
         "messages": [
             {"role": "system", "content": system_prompt},
+            *(history or []),
             {"role": "user", "content": customer_message}
         ]
     }
+
+async def generate_marketing_copy(prompt: str, language: str = "English", tone: str = "Professional") -> Optional[str]:
+    """
+    Calls OpenAI API to generate marketing copy in a specific language and tone.
+    """
+    ensure_openai_configured()
+    url, headers = _completions_request()
+    payload = _copy_payload(prompt, language, tone)
     
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.post(url, json=payload, headers=headers)
-            response.raise_for_status()
-            data = response.json()
-            return data["choices"][0]["message"]["content"]
-        except Exception as e:
-            print(f"Error acting as AI Agent: {e}")
-            return None
+    try:
+        response = await get_http_client(url).post(url, json=payload, headers=headers)
+        response.raise_for_status()
+        data = response.json()
+        return data["choices"][0]["message"]["content"]
+    except Exception as e:
+        print(f"Error calling OpenAI API: {e}")
+        return None
+
+async def agentic_chat_response(customer_message: str, business_context: str, history: Optional[List[Dict[str, str]]] = None) -> Optional[str]:
+    """
+    Generates a smart, autonomous reply based on the customer's message and the business's context (e.g., booking availability).
+    `history` holds the conversation's earlier turns as chat messages, oldest first
+    (see services/conversations.py, which keeps it within a token budget).
+    """
+    ensure_openai_configured()
+    url, headers = _completions_request()
+    payload = _agent_payload(customer_message, business_context, history)
+    
+    try:
+        response = await get_http_client(url).post(url, json=payload, headers=headers)
+        response.raise_for_status()
+        data = response.json()
+        return data["choices"][0]["message"]["content"]
+    except Exception as e:
+        print(f"Error acting as AI Agent: {e}")
+        return None
+
+async def _stream_completion(payload: dict) -> AsyncIterator[str]:
+    """
+    Yields content tokens from a streamed chat completion as they arrive.
+    Closing the generator early (e.g. the browser disconnected) closes the upstream
+    connection, which makes OpenAI stop generating.
+    """
+    ensure_openai_configured()
+    url, headers = _completions_request()
+    response = await get_http_client(url).post(url, json={**payload, "stream": True}, headers=headers, stream=True)
+    try:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            if not line.startswith("data:"):
+                continue
+            data = line[len("data:"):].strip()
+            if data == "[DONE]":
+                break
+            choices = json.loads(data).get("choices") or [{}]
+            token = (choices[0].get("delta") or {}).get("content")
+            if token:
+                yield token
+    finally:
+        await response.aclose()
+
+def stream_marketing_copy(prompt: str, language: str = "English", tone: str = "Professional") -> AsyncIterator[str]:
+    """Streaming variant of generate_marketing_copy."""
+    return _stream_completion(_copy_payload(prompt, language, tone))
+
+def stream_agentic_chat_response(customer_message: str, business_context: str, history: Optional[List[Dict[str, str]]] = None) -> AsyncIterator[str]:
+    """Streaming variant of agentic_chat_response."""
+    return _stream_completion(_agent_payload(customer_message, business_context, history))
@@ -0,0 +1,285 @@
+import re
+import time
+import json
+import asyncio
+import hashlib
+import sqlite3
+import logging
+import threading
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+
+from core.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE = re.compile(r"\s+")
+
+def normalize_prompt_part(value: str) -> str:
+    """Case- and whitespace-insensitive form used for cache keys."""
+    return _WHITESPACE.sub(" ", (value or "").strip().lower())
+
+def make_cache_key(*parts: str) -> str:
+    raw = json.dumps([normalize_prompt_part(p) for p in parts], ensure_ascii=False)
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+class _DiskTier:
+    """
+    Optional SQLite-backed second tier, shared by every worker on the host.
+    Keeps roughly `max_entries` rows, evicting least recently used ones.
+    """
+    PRUNE_EVERY = 100  # writes between eviction passes
+
+    def __init__(self, path: str, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS response_cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_response_cache_last_used ON response_cache (last_used)")
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM response_cache WHERE key = ? AND created_at > ?", (key, now - self.ttl)
+            ).fetchone()
+            if row:
+                self._conn.execute("UPDATE response_cache SET last_used = ? WHERE key = ?", (now, key))
+        return row[0] if row else None
+
+    def set(self, key: str, value: str) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO response_cache (key, value, created_at, last_used) VALUES (?, ?, ?, ?)",
+                (key, value, now, now),
+            )
+            self._writes += 1
+            if self._writes % self.PRUNE_EVERY:
+                return
+            self._conn.execute(
+                "DELETE FROM response_cache WHERE created_at <= ? OR key IN ("
+                "SELECT key FROM response_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (now - self.ttl, self.max_entries),
+            )
+
+class _LeaderCancelled(Exception):
+    """Set on an in-flight result when the caller generating it was cancelled."""
+
+class SharedTokenStream:
+    """
+    One upstream token stream read by every concurrent request for the same key.
+
+    The upstream is consumed by its own task, so any one client going away doesn't stop
+    it for the others; once the last listener has left it is cancelled. A listener that
+    joins late is first sent the tokens it missed.
+    """
+    def __init__(self, tokens: AsyncIterator[str], on_done: Callable[["SharedTokenStream"], Awaitable[None]]):
+        self.parts: List[str] = []
+        self.error: Optional[BaseException] = None
+        self.done = False
+        self._reading = True  # only the upstream read is cancelled when everyone leaves, never the settling
+        self._listeners = 0
+        self._update = asyncio.Event()
+        self._task = asyncio.create_task(self._pump(tokens, on_done))
+
+    def _notify(self) -> None:
+        self._update.set()
+        self._update = asyncio.Event()
+
+    @property
+    def text(self) -> Optional[str]:
+        """The full text of a stream that completed (read once it has ended), else None."""
+        return "".join(self.parts) if self.parts and self.error is None else None
+
+    async def _pump(self, tokens: AsyncIterator[str], on_done: Callable[["SharedTokenStream"], Awaitable[None]]) -> None:
+        try:
+            async for token in tokens:
+                self.parts.append(token)
+                self._notify()
+        except BaseException as e:
+            self.error = e
+            if not isinstance(e, asyncio.CancelledError):
+                logger.error(f"AI stream failed: {e}")
+        finally:
+            self._reading = False
+            await tokens.aclose()
+            try:
+                # Settled (cached, credit kept or refunded) before the listeners see the end
+                await on_done(self)
+            except Exception as e:
+                logger.error(f"AI stream completion failed: {e}")
+            self.done = True
+            self._notify()
+
+    async def listen(self) -> AsyncIterator[str]:
+        """Yields the stream's tokens; raises if the upstream failed."""
+        self._listeners += 1
+        sent = 0
+        try:
+            while True:
+                update = self._update
+                while sent < len(self.parts):
+                    yield self.parts[sent]
+                    sent += 1
+                    update = self._update
+                if self.done:
+                    if self.error is not None:
+                        raise RuntimeError("AI generation failed") from self.error
+                    return
+                await update.wait()
+        finally:
+            self._listeners -= 1
+            if not self._listeners and self._reading:
+                self._task.cancel()
+
+    async def result(self) -> Optional[str]:
+        """Waits for the stream to end (without keeping it alive); its full text, or None if it failed."""
+        await asyncio.gather(asyncio.shield(self._task), return_exceptions=True)
+        return self.text
+
+class ResponseCache:
+    """
+    Two-tier (memory LRU + optional SQLite) cache for AI responses with single-flight
+    coalescing: concurrent misses for the same key share one upstream call.
+    """
+    def __init__(self, max_entries: int, ttl: float, disk_path: str = "", disk_max_entries: int = 0):
+        self.memory = TTLCache(max_entries, ttl)
+        self.disk = _DiskTier(disk_path, ttl, disk_max_entries or max_entries * 10) if disk_path else None
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._streams: Dict[str, SharedTokenStream] = {}
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "coalesced": 0, "upstream_calls": 0, "upstream_failures": 0}
+
+    async def get(self, key: str) -> Optional[str]:
+        value = self.memory.get(key)
+        if value is not None:
+            self.stats["memory_hits"] += 1
+            return value
+        if self.disk:
+            try:
+                value = await run_in_threadpool(self.disk.get, key)
+            except sqlite3.Error as e:
+                logger.warning(f"AI response disk cache read failed: {e}")
+            if value is not None:
+                self.stats["disk_hits"] += 1
+                self.memory.set(key, value)
+                return value
+        self.stats["misses"] += 1
+        return None
+
+    async def put(self, key: str, value: str) -> None:
+        self.memory.set(key, value)
+        if self.disk:
+            try:
+                await run_in_threadpool(self.disk.set, key, value)
+            except sqlite3.Error as e:
+                logger.warning(f"AI response disk cache write failed: {e}")
+
+    async def get_or_generate(self, key: str, generate: Callable[[], Awaitable[Optional[str]]]) -> Tuple[Optional[str], bool]:
+        """
+        Returns (value, called_upstream). Only the first caller for a key runs `generate`;
+        concurrent callers wait for its result and get called_upstream=False. If that
+        caller is cancelled (e.g. its client disconnected) the waiting callers start over,
+        one of them generating. Failed (None) results are not cached.
+        """
+        shared = self._streams.get(key)
+        if shared is not None:
+            # Generated by a stream already: wait for its text
+            self.stats["coalesced"] += 1
+            value = await shared.result()
+            if value is not None:
+                return value, False
+        while True:
+            future = self._inflight.get(key)
+            if future is None:
+                break
+            self.stats["coalesced"] += 1
+            try:
+                return await asyncio.shield(future), False
+            except _LeaderCancelled:
+                continue
+        # A leader may have finished between the caller's get() and now
+        value = self.memory.get(key)
+        if value is not None:
+            return value, False
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            self.stats["upstream_calls"] += 1
+            value = await generate()
+            if value is None:
+                self.stats["upstream_failures"] += 1
+            else:
+                await self.put(key, value)
+            future.set_result(value)
+            return value, True
+        except asyncio.CancelledError:
+            future.set_exception(_LeaderCancelled())
+            future.exception()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark the exception retrieved when nobody else was waiting on it
+            future.exception()
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+    def stream(
+        self, key: str, start: Callable[[], AsyncIterator[str]],
+        on_done: Optional[Callable[[bool], Awaitable[None]]] = None,
+    ) -> Tuple[AsyncIterator[str], bool]:
+        """
+        Streaming counterpart of get_or_generate: returns (tokens, called_upstream). Only
+        the first caller for a key runs `start()`; concurrent callers share its stream and
+        get called_upstream=False, as do callers arriving while a non-streaming call
+        generates the key (they get its result as one token). The text is cached once the
+        stream completes. `on_done` is told whether any tokens were generated once the
+        upstream stream ends, however many clients stayed to read it.
+        """
+        shared = self._streams.get(key)
+        if shared is not None:
+            self.stats["coalesced"] += 1
+            return shared.listen(), False
+        if key in self._inflight:
+            self.stats["coalesced"] += 1
+            return self._replay(key), False
+
+        async def finish(done: SharedTokenStream) -> None:
+            if self._streams.get(key) is done:
+                del self._streams[key]
+            if done.text is None:
+                self.stats["upstream_failures"] += 1
+            else:
+                await self.put(key, done.text)
+            if on_done:
+                await on_done(bool(done.parts))
+
+        self.stats["upstream_calls"] += 1
+        shared = self._streams[key] = SharedTokenStream(start(), finish)
+        return shared.listen(), True
+
+    async def _replay(self, key: str) -> AsyncIterator[str]:
+        future = self._inflight[key]
+        try:
+            value = await asyncio.shield(future)
+        except _LeaderCancelled:
+            value = None
+        if value is None:
+            raise RuntimeError("AI generation failed")
+        yield value
+
+    def in_flight(self, key: str) -> bool:
+        """Whether a call is already generating `key` (a new caller would share it)."""
+        return key in self._streams or key in self._inflight
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {**self.stats, "memory": self.memory.stats(), "disk_enabled": self.disk is not None, "streams": len(self._streams)}
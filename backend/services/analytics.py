@@ -0,0 +1,251 @@
+"""
+Campaign analytics rollups.
+
+Hourly and daily counters per (owner, campaign) are maintained incrementally: message
+status flushes, the campaign worker and the credit meter record() increments, which are
+upserted (count = count + increment) every ANALYTICS_FLUSH_SECONDS. The dashboard reads
+only the rollups. To regenerate them from the raw events:
+
+    cd backend && python -m services.analytics rebuild [--owner-id N]
+"""
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional, Tuple
+
+from sqlalchemy import and_, delete, func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from core.config import settings
+from database import AsyncSessionLocal, engine
+from models.analytics import CampaignStatsDaily, CampaignStatsHourly
+from models.campaign import Campaign, CampaignRecipient
+from models.credit import CreditLedgerEntry
+from models.message_event import MessageEvent
+
+logger = logging.getLogger(__name__)
+
+COUNTERS = ("sent", "delivered", "read", "failed", "replies", "ai_credits_used")
+# message_events.status -> counter
+STATUS_COUNTERS = {"sent": "sent", "delivered": "delivered", "read": "read", "failed": "failed", "replied": "replies"}
+# Credit ledger reasons that are AI usage (or give usage back)
+CREDIT_USAGE_REASONS = ("ai_copy", "agent_reply", "reservation", "reservation_release", "refund")
+
+GRANULARITIES = {"hour": (CampaignStatsHourly, timedelta(hours=1)), "day": (CampaignStatsDaily, timedelta(days=1))}
+MAX_PERIODS = {"hour": 24 * 7, "day": 366}
+
+# (owner id, campaign id, start of hour) -> counter -> increment
+Increments = Dict[Tuple[int, int, datetime], Dict[str, int]]
+
+def _hour(at: datetime) -> datetime:
+    return at.replace(minute=0, second=0, microsecond=0, tzinfo=None)
+
+def _day(at: datetime) -> datetime:
+    return at.replace(hour=0, minute=0, second=0, microsecond=0, tzinfo=None)
+
+def _accumulate(increments: Increments, owner_id: int, campaign_id: Optional[int], at: datetime, counts: Dict[str, int]) -> None:
+    hour = _hour(at)
+    for key in {(owner_id, campaign_id or 0, hour), (owner_id, 0, hour)}:
+        totals = increments.setdefault(key, {})
+        for counter, value in counts.items():
+            totals[counter] = totals.get(counter, 0) + value
+
+def _upsert(model):
+    insert = pg_insert if engine.dialect.name == "postgresql" else sqlite_insert
+    stmt = insert(model)
+    return stmt.on_conflict_do_update(
+        index_elements=["owner_id", "campaign_id", "bucket"],
+        set_={counter: getattr(model, counter) + getattr(stmt.excluded, counter) for counter in COUNTERS},
+    )
+
+async def apply_increments(db: AsyncSession, increments: Increments) -> None:
+    """Adds hourly increments to both rollup tables (one executemany upsert each). Does not commit."""
+    if not increments:
+        return
+    daily: Dict[Tuple[int, int, datetime], Dict[str, int]] = {}
+    for (owner_id, campaign_id, hour), counts in increments.items():
+        totals = daily.setdefault((owner_id, campaign_id, _day(hour)), {})
+        for counter, value in counts.items():
+            totals[counter] = totals.get(counter, 0) + value
+
+    for model, buckets in ((CampaignStatsHourly, increments), (CampaignStatsDaily, daily)):
+        rows = [
+            {"owner_id": owner_id, "campaign_id": campaign_id, "bucket": bucket, **{c: counts.get(c, 0) for c in COUNTERS}}
+            for (owner_id, campaign_id, bucket), counts in buckets.items()
+        ]
+        await db.execute(_upsert(model), rows)
+
+class AnalyticsRecorder:
+    """
+    Buffers rollup increments in memory and upserts them every ANALYTICS_FLUSH_SECONDS,
+    so recording an event costs no database write. Each increment also counts towards
+    the owner's total (campaign_id 0). Unflushed increments are lost if the process
+    crashes; `rebuild` recomputes them from the raw events.
+    """
+    def __init__(self):
+        self._increments: Increments = {}
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {"recorded": 0, "flushes": 0, "flushed_rows": 0, "failures": 0}
+
+    def record(self, owner_id: Optional[int], campaign_id: Optional[int] = None, at: Optional[datetime] = None, **counts: int) -> None:
+        if owner_id is None:
+            return
+        _accumulate(self._increments, owner_id, campaign_id, at or datetime.utcnow(), counts)
+        self.stats["recorded"] += 1
+
+    async def flush(self) -> None:
+        async with self._flush_lock:
+            increments, self._increments = self._increments, {}
+            if not increments:
+                return
+            try:
+                async with AsyncSessionLocal() as db:
+                    await apply_increments(db, increments)
+                    await db.commit()
+            except Exception:
+                self.stats["failures"] += 1
+                # Keep them for the next flush
+                for key, counts in increments.items():
+                    totals = self._increments.setdefault(key, {})
+                    for counter, value in counts.items():
+                        totals[counter] = totals.get(counter, 0) + value
+                raise
+            self.stats["flushes"] += 1
+            self.stats["flushed_rows"] += len(increments)
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error(f"Failed to flush analytics rollups at shutdown: {e}")
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(settings.ANALYTICS_FLUSH_SECONDS)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Failed to flush analytics rollups: {e}")
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {**self.stats, "pending_rows": len(self._increments)}
+
+analytics = AnalyticsRecorder()
+
+async def get_analytics(db: AsyncSession, owner_id: int, campaign_id: int = 0, granularity: str = "day", periods: int = 30) -> Dict[str, Any]:
+    """
+    Totals and a per-bucket series for the last `periods` hours/days, read from one rollup
+    table by primary key range: at most MAX_PERIODS rows, however long the history is.
+    """
+    model, step = GRANULARITIES[granularity]
+    periods = max(1, min(periods, MAX_PERIODS[granularity]))
+    now = datetime.utcnow()
+    until = _hour(now) if granularity == "hour" else _day(now)
+    since = until - step * (periods - 1)
+
+    result = await db.execute(
+        select(model).where(model.owner_id == owner_id, model.campaign_id == campaign_id, model.bucket >= since)
+    )
+    by_bucket = {row.bucket.replace(tzinfo=None): row for row in result.scalars().all()}
+
+    series = []
+    totals = dict.fromkeys(COUNTERS, 0)
+    for i in range(periods):
+        bucket = since + step * i
+        row = by_bucket.get(bucket)
+        counts = {c: (getattr(row, c) or 0) if row else 0 for c in COUNTERS}
+        for c in COUNTERS:
+            totals[c] += counts[c]
+        series.append({"bucket": bucket, **counts})
+
+    return {
+        "campaign_id": campaign_id or None,
+        "granularity": granularity,
+        "since": since,
+        "until": until + step,
+        "totals": totals,
+        "series": series,
+    }
+
+async def rebuild(db: AsyncSession, owner_id: Optional[int] = None) -> int:
+    """
+    Regenerates the rollups (of one owner, or all) from message_events, campaign_recipients
+    and the credit ledger. Returns the number of hourly rows written. AI credits reserved in
+    blocks (services/credits.py) are counted when reserved rather than when used.
+    """
+    increments: Increments = {}
+
+    # WhatsApp statuses and replies; a reply carries the id of the campaign message it answers
+    events = select(MessageEvent.owner_id, CampaignRecipient.campaign_id, MessageEvent.occurred_at, MessageEvent.status).outerjoin(
+        CampaignRecipient, CampaignRecipient.provider_message_id == MessageEvent.provider_message_id
+    ).where(MessageEvent.owner_id.isnot(None))
+    if owner_id is not None:
+        events = events.where(MessageEvent.owner_id == owner_id)
+    async for event_owner, campaign_id, occurred_at, status in await db.stream(events):
+        counter = STATUS_COUNTERS.get(status)
+        if counter:
+            _accumulate(increments, event_owner, campaign_id, occurred_at, {counter: 1})
+
+    # Sends only the campaign worker sees: emails (no delivery callbacks) and undeliverable recipients
+    recipients = select(
+        Campaign.owner_id, Campaign.id, Campaign.channel, CampaignRecipient.status,
+        CampaignRecipient.sent_at, func.coalesce(CampaignRecipient.next_attempt_at, Campaign.created_at),
+    ).join(Campaign, Campaign.id == CampaignRecipient.campaign_id).where(
+        (and_(Campaign.channel == "email", CampaignRecipient.status == "sent")) | (CampaignRecipient.status == "dead")
+    )
+    if owner_id is not None:
+        recipients = recipients.where(Campaign.owner_id == owner_id)
+    async for campaign_owner, campaign_id, channel, status, sent_at, failed_at in await db.stream(recipients):
+        if status == "sent":
+            _accumulate(increments, campaign_owner, campaign_id, sent_at or failed_at, {"sent": 1})
+        else:
+            _accumulate(increments, campaign_owner, campaign_id, failed_at, {"failed": 1})
+
+    credits = select(CreditLedgerEntry.user_id, CreditLedgerEntry.created_at, CreditLedgerEntry.delta).where(
+        CreditLedgerEntry.reason.in_(CREDIT_USAGE_REASONS)
+    )
+    if owner_id is not None:
+        credits = credits.where(CreditLedgerEntry.user_id == owner_id)
+    async for user_id, created_at, delta in await db.stream(credits):
+        _accumulate(increments, user_id, None, created_at, {"ai_credits_used": -delta})
+
+    for model in (CampaignStatsHourly, CampaignStatsDaily):
+        clear = delete(model)
+        if owner_id is not None:
+            clear = clear.where(model.owner_id == owner_id)
+        await db.execute(clear)
+    await apply_increments(db, increments)
+    await db.commit()
+    return len(increments)
+
+async def _main(argv=None) -> None:
+    import argparse
+    from models.user import User  # noqa: F401  (mappers referenced by the models above)
+    from models.contact import Contact  # noqa: F401
+
+    parser = argparse.ArgumentParser(prog="python -m services.analytics", description="Campaign analytics rollups")
+    parser.add_argument("command", choices=["rebuild"])
+    parser.add_argument("--owner-id", type=int, default=None, help="only this owner's rollups")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    try:
+        async with AsyncSessionLocal() as db:
+            rows = await rebuild(db, args.owner_id)
+        logger.info(f"Rebuilt analytics rollups: {rows} hourly buckets")
+    finally:
+        await engine.dispose()
+
+if __name__ == "__main__":
+    asyncio.run(_main())
@@ -0,0 +1,344 @@
+import os
+import json
+import random
+import socket
+import asyncio
+import logging
+from uuid import uuid4
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import and_, or_, func, insert, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from core.config import settings
+from database import AsyncSessionLocal
+from models.campaign import Campaign, CampaignRecipient, CampaignWhatsAppTemplate
+from services.analytics import analytics
+from services.dispatch import TokenBucket, dispatch, get_phone_number_bucket
+from services.whatsapp import (
+    WhatsAppTemplateMessage, send_whatsapp_message, message_id_from_response, WHATSAPP_PHONE_NUMBER_ID,
+)
+from services.email import PreparedEmail, send_prepared_email
+from services.templating import compile_template, load_contact_fields
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_STATUSES = ("pending", "leased")
+
+async def enqueue_campaign(
+    db: AsyncSession,
+    owner_id: int,
+    channel: str,
+    recipients: List[str],
+    body: str,
+    subject: Optional[str] = None,
+    whatsapp_template: Optional[Dict[str, Any]] = None,
+) -> Campaign:
+    """
+    Persists a campaign and one pending row per recipient for the worker to pick up.
+    `whatsapp_template` (template_name, language_code, body_parameters, header_image_url)
+    makes a WhatsApp campaign send that approved template instead of `body`.
+    """
+    campaign = Campaign(
+        owner_id=owner_id,
+        channel=channel,
+        subject=subject,
+        body=body,
+        total_recipients=len(recipients),
+    )
+    db.add(campaign)
+    await db.flush()
+    if whatsapp_template:
+        db.add(CampaignWhatsAppTemplate(
+            campaign_id=campaign.id,
+            template_name=whatsapp_template["template_name"],
+            language_code=whatsapp_template.get("language_code") or "en_US",
+            body_parameters=json.dumps(whatsapp_template.get("body_parameters") or []),
+            header_image_url=whatsapp_template.get("header_image_url"),
+        ))
+
+    now = datetime.utcnow()
+    if recipients:
+        await db.execute(
+            insert(CampaignRecipient),
+            [
+                {"campaign_id": campaign.id, "recipient": r, "status": "pending", "attempts": 0, "next_attempt_at": now}
+                for r in recipients
+            ],
+        )
+    await db.commit()
+    return campaign
+
+async def get_campaign_progress(db: AsyncSession, campaign: Campaign) -> Dict[str, Any]:
+    result = await db.execute(
+        select(CampaignRecipient.status, func.count())
+        .where(CampaignRecipient.campaign_id == campaign.id)
+        .group_by(CampaignRecipient.status)
+    )
+    counts = {status: count for status, count in result.all()}
+    done = counts.get("sent", 0) + counts.get("dead", 0)
+    return {
+        "campaign_id": campaign.id,
+        "channel": campaign.channel,
+        "status": campaign.status,
+        "total_recipients": campaign.total_recipients,
+        "sent": counts.get("sent", 0),
+        "pending": counts.get("pending", 0),
+        "in_flight": counts.get("leased", 0),
+        "dead": counts.get("dead", 0),
+        "progress_percent": round(100 * done / campaign.total_recipients, 1) if campaign.total_recipients else 100.0,
+        "created_at": campaign.created_at,
+        "completed_at": campaign.completed_at,
+    }
+
+def _retry_delay(attempts: int) -> timedelta:
+    """Exponential backoff with full jitter."""
+    ceiling = settings.CAMPAIGN_RETRY_BASE_SECONDS * (2 ** (attempts - 1))
+    return timedelta(seconds=random.uniform(ceiling / 2, ceiling))
+
+class CampaignWorker:
+    """
+    Pulls due campaign recipients from the DB in leased batches and sends them.
+
+    Every send is checkpointed on its own as soon as it completes, so a restart only
+    ever retries recipients whose outcome was never recorded. The batch's lease is
+    renewed while it is being sent (rate limits, timeouts and retries can outlast any
+    fixed lease), so only a worker that died loses its rows to another. stop() drains: no new
+    sends start, in-flight sends finish and are checkpointed, and unstarted rows in
+    the current batch are handed back to the queue.
+    """
+    def __init__(self, worker_id: Optional[str] = None):
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        self._stopping = asyncio.Event()
+        self._email_bucket = TokenBucket(settings.EMAIL_MESSAGES_PER_SECOND)
+        # campaign id -> email MIME / WhatsApp template send, built once per campaign
+        self._prepared_emails: Dict[int, PreparedEmail] = {}
+        self._whatsapp_templates: Dict[int, Optional[WhatsAppTemplateMessage]] = {}
+
+    def stop(self) -> None:
+        if not self._stopping.is_set():
+            logger.info(f"Campaign worker {self.worker_id} draining...")
+            self._stopping.set()
+
+    async def run(self) -> None:
+        logger.info(f"Campaign worker {self.worker_id} started")
+        while not self._stopping.is_set():
+            processed = await self.run_once()
+            if not processed:
+                try:
+                    await asyncio.wait_for(self._stopping.wait(), timeout=settings.CAMPAIGN_POLL_INTERVAL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+        logger.info(f"Campaign worker {self.worker_id} stopped")
+
+    async def run_once(self) -> int:
+        """Leases and processes one batch. Returns the number of recipients leased."""
+        token, rows = await self._lease_batch()
+        if not rows:
+            return 0
+        renewal = asyncio.create_task(self._renew_lease(token))
+        try:
+            await self._process_batch(token, rows)
+        finally:
+            renewal.cancel()
+            await asyncio.gather(renewal, return_exceptions=True)
+        return len(rows)
+
+    async def _process_batch(self, token: str, rows) -> None:
+        async with AsyncSessionLocal() as db:
+            campaign_ids = {row.campaign_id for row in rows}
+            result = await db.execute(select(Campaign).where(Campaign.id.in_(campaign_ids)))
+            campaigns = {c.id: c for c in result.scalars().all()}
+            await db.execute(
+                update(Campaign)
+                .where(Campaign.id.in_(campaign_ids), Campaign.status == "queued")
+                .values(status="running")
+            )
+            await db.commit()
+            await self._load_whatsapp_templates(db, campaigns)
+            fields = await self._load_personalization(db, rows, campaigns)
+
+        for channel in ("whatsapp", "email"):
+            batch = [row for row in rows if campaigns[row.campaign_id].channel == channel]
+            if not batch:
+                continue
+            bucket = get_phone_number_bucket(WHATSAPP_PHONE_NUMBER_ID) if channel == "whatsapp" else self._email_bucket
+            await dispatch(
+                batch, lambda row: self._deliver(token, row, campaigns[row.campaign_id], fields.get(row.id)), bucket
+            )
+
+        await self._complete_finished(campaign_ids)
+
+    async def _renew_lease(self, token: str) -> None:
+        """Extends the lease on a batch's unsent rows every third of CAMPAIGN_LEASE_SECONDS."""
+        while True:
+            await asyncio.sleep(settings.CAMPAIGN_LEASE_SECONDS / 3)
+            try:
+                async with AsyncSessionLocal() as db:
+                    await db.execute(
+                        update(CampaignRecipient)
+                        .where(CampaignRecipient.lease_token == token, CampaignRecipient.status == "leased")
+                        .values(lease_expires_at=datetime.utcnow() + timedelta(seconds=settings.CAMPAIGN_LEASE_SECONDS))
+                    )
+                    await db.commit()
+            except Exception as e:
+                logger.warning(f"Campaign worker {self.worker_id}: failed to renew lease {token}: {e}")
+
+    async def _lease_batch(self):
+        now = datetime.utcnow()
+        token = f"{self.worker_id}:{uuid4().hex}"
+        due = or_(
+            and_(CampaignRecipient.status == "pending", CampaignRecipient.next_attempt_at <= now),
+            # Leases left behind by a crashed worker
+            and_(CampaignRecipient.status == "leased", CampaignRecipient.lease_expires_at < now),
+        )
+        candidates = (
+            select(CampaignRecipient.id)
+            .where(due)
+            .order_by(CampaignRecipient.id)
+            .limit(settings.CAMPAIGN_BATCH_SIZE)
+            .scalar_subquery()
+        )
+        async with AsyncSessionLocal() as db:
+            # Re-checking `due` in the outer WHERE keeps two workers from claiming the same row
+            await db.execute(
+                update(CampaignRecipient)
+                .where(CampaignRecipient.id.in_(candidates), due)
+                .values(
+                    status="leased",
+                    lease_token=token,
+                    lease_expires_at=now + timedelta(seconds=settings.CAMPAIGN_LEASE_SECONDS),
+                )
+                .execution_options(synchronize_session=False)
+            )
+            await db.commit()
+            result = await db.execute(
+                select(CampaignRecipient)
+                .where(CampaignRecipient.lease_token == token, CampaignRecipient.status == "leased")
+                .order_by(CampaignRecipient.id)
+            )
+            return token, result.scalars().all()
+
+    async def _load_whatsapp_templates(self, db: AsyncSession, campaigns: Dict[int, Campaign]) -> None:
+        missing = [c.id for c in campaigns.values() if c.channel == "whatsapp" and c.id not in self._whatsapp_templates]
+        if not missing:
+            return
+        result = await db.execute(select(CampaignWhatsAppTemplate).where(CampaignWhatsAppTemplate.campaign_id.in_(missing)))
+        templates = {t.campaign_id: t for t in result.scalars().all()}
+        for campaign_id in missing:
+            t = templates.get(campaign_id)
+            self._whatsapp_templates[campaign_id] = WhatsAppTemplateMessage(
+                t.template_name, t.language_code, json.loads(t.body_parameters or "[]"), t.header_image_url,
+            ) if t else None
+
+    def _fields(self, campaign: Campaign) -> Tuple[str, ...]:
+        """Contact fields a campaign's message is personalized with."""
+        if campaign.channel == "email":
+            return self._prepared_email(campaign).html_template.fields
+        template_message = self._whatsapp_templates.get(campaign.id)
+        if template_message:
+            return template_message.fields
+        return compile_template(campaign.body).fields
+
+    async def _load_personalization(self, db: AsyncSession, rows, campaigns: Dict[int, Campaign]) -> Dict[int, Dict[str, Any]]:
+        """
+        Contact fields for the personalized campaigns in a leased batch, keyed by recipient
+        row id: one indexed lookup per campaign, so a campaign's audience is only ever
+        read one batch at a time.
+        """
+        fields: Dict[int, Dict[str, Any]] = {}
+        for campaign_id, campaign in campaigns.items():
+            campaign_fields = self._fields(campaign)
+            if not campaign_fields:
+                continue
+            campaign_rows = [row for row in rows if row.campaign_id == campaign_id]
+            key = "phone" if campaign.channel == "whatsapp" else "email"
+            contacts = await load_contact_fields(
+                db, campaign.owner_id, key, [row.recipient for row in campaign_rows], campaign_fields
+            )
+            for row in campaign_rows:
+                fields[row.id] = contacts.get(row.recipient) or {key: row.recipient}
+        return fields
+
+    async def _deliver(self, token: str, row: CampaignRecipient, campaign: Campaign, fields: Optional[Dict[str, Any]] = None) -> None:
+        if self._stopping.is_set():
+            await self._checkpoint(token, row, status="pending", lease_token=None, lease_expires_at=None)
+            return
+
+        try:
+            if campaign.channel == "whatsapp":
+                template_message = self._whatsapp_templates.get(campaign.id)
+                if template_message:
+                    response = await template_message.send(row.recipient, fields)
+                else:
+                    response = await send_whatsapp_message(row.recipient, compile_template(campaign.body).render(fields))
+            else:
+                response = await send_prepared_email(self._prepared_email(campaign), row.recipient, fields)
+        except Exception as e:
+            error = getattr(e, "detail", None) or str(e)
+            attempts = (row.attempts or 0) + 1
+            if attempts >= settings.CAMPAIGN_MAX_ATTEMPTS:
+                logger.warning(f"Campaign {campaign.id}: giving up on {row.recipient} after {attempts} attempts: {error}")
+                if await self._checkpoint(token, row, status="dead", attempts=attempts, last_error=error, lease_token=None):
+                    analytics.record(campaign.owner_id, campaign.id, failed=1)
+            else:
+                await self._checkpoint(
+                    token, row,
+                    status="pending",
+                    attempts=attempts,
+                    last_error=error,
+                    next_attempt_at=datetime.utcnow() + _retry_delay(attempts),
+                    lease_token=None,
+                    lease_expires_at=None,
+                )
+            return
+
+        sent = await self._checkpoint(
+            token, row,
+            status="sent",
+            attempts=(row.attempts or 0) + 1,
+            provider_message_id=message_id_from_response(response) if campaign.channel == "whatsapp" else response.get("message_id"),
+            sent_at=datetime.utcnow(),
+            lease_token=None,
+        )
+        # WhatsApp sends are counted from Meta's 'sent' status callback instead (services/message_status.py)
+        if sent and campaign.channel == "email":
+            analytics.record(campaign.owner_id, campaign.id, sent=1)
+
+    def _prepared_email(self, campaign: Campaign) -> PreparedEmail:
+        prepared = self._prepared_emails.get(campaign.id)
+        if prepared is None:
+            prepared = self._prepared_emails[campaign.id] = PreparedEmail(campaign.subject or "", campaign.body)
+        return prepared
+
+    async def _checkpoint(self, token: str, row: CampaignRecipient, **values) -> bool:
+        """Updates a leased row; False if the lease was lost (expired and taken by another worker)."""
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                update(CampaignRecipient)
+                .where(CampaignRecipient.id == row.id, CampaignRecipient.lease_token == token)
+                .values(**values)
+            )
+            await db.commit()
+            return result.rowcount == 1
+
+    async def _complete_finished(self, campaign_ids) -> None:
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                select(CampaignRecipient.campaign_id)
+                .where(CampaignRecipient.campaign_id.in_(campaign_ids), CampaignRecipient.status.in_(ACTIVE_STATUSES))
+                .distinct()
+            )
+            finished = set(campaign_ids) - set(result.scalars().all())
+            for campaign_id in finished:
+                self._prepared_emails.pop(campaign_id, None)
+                self._whatsapp_templates.pop(campaign_id, None)
+            if finished:
+                await db.execute(
+                    update(Campaign)
+                    .where(Campaign.id.in_(finished))
+                    .values(status="completed", completed_at=datetime.utcnow())
+                )
+                await db.commit()
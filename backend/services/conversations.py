@@ -0,0 +1,108 @@
+import logging
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from core.cache import TTLCache
+from core.config import settings
+from models.conversation import ConversationMessage
+
+logger = logging.getLogger(__name__)
+
+_ROLES = {"inbound": "user", "outbound": "assistant"}
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token plus per-message overhead); good enough for budgeting."""
+    return len(text) // 4 + 4
+
+def trim_to_budget(turns: List[Tuple[str, str]], budget: int) -> List[Dict[str, str]]:
+    """
+    Converts (direction, text) turns, oldest first, into chat messages that fit in `budget`
+    tokens, keeping the most recent turns. If the oldest turn that still partly fits is cut,
+    its tail is kept so the reply still has the immediate context.
+    """
+    messages: List[Dict[str, str]] = []
+    remaining = budget
+    for direction, text in reversed(turns):
+        cost = estimate_tokens(text)
+        if cost > remaining:
+            # Room for a meaningful fragment? Keep the end of the message.
+            chars = (remaining - 4) * 4
+            if chars >= 80:
+                messages.append({"role": _ROLES[direction], "content": "…" + text[-chars:]})
+            break
+        messages.append({"role": _ROLES[direction], "content": text})
+        remaining -= cost
+    messages.reverse()
+    return messages
+
+class ConversationStore:
+    """
+    Persists conversation turns and keeps the latest CONVERSATION_WINDOW_MESSAGES of each
+    active conversation in memory as a ring buffer (deque of (direction, text)), in a
+    bounded LRU, so building the agent prompt doesn't re-read the timeline every message.
+
+    The window is per worker process. Inbound processing serialises each conversation
+    (services/inbound.py), so a window is only appended to by one task at a time.
+    """
+    def __init__(self):
+        self._windows = TTLCache(settings.CONVERSATION_CACHE_SIZE, settings.CONVERSATION_CACHE_TTL_SECONDS)
+
+    async def _window(self, db: AsyncSession, owner_id: int, customer_phone: str) -> Deque[Tuple[str, str]]:
+        key = (owner_id, customer_phone)
+        window = self._windows.get(key)
+        if window is None:
+            result = await db.execute(
+                select(ConversationMessage.direction, ConversationMessage.text)
+                .where(ConversationMessage.owner_id == owner_id, ConversationMessage.customer_phone == customer_phone)
+                .order_by(ConversationMessage.created_at.desc(), ConversationMessage.id.desc())
+                .limit(settings.CONVERSATION_WINDOW_MESSAGES)
+            )
+            window = deque(reversed(result.all()), maxlen=settings.CONVERSATION_WINDOW_MESSAGES)
+            self._windows.set(key, window)
+        return window
+
+    async def history(self, db: AsyncSession, owner_id: int, customer_phone: str) -> List[Dict[str, str]]:
+        """Earlier turns as chat messages, trimmed to AGENT_HISTORY_TOKEN_BUDGET."""
+        window = await self._window(db, owner_id, customer_phone)
+        return trim_to_budget(list(window), settings.AGENT_HISTORY_TOKEN_BUDGET)
+
+    async def record(
+        self, db: AsyncSession, owner_id: int, customer_phone: str, direction: str, text: str,
+        whatsapp_message_id: Optional[str] = None,
+    ) -> None:
+        """
+        Stores a turn and commits. The window only gets the turn once it is committed, so a
+        failed commit can't leave the prompt history ahead of the timeline.
+        """
+        window = await self._window(db, owner_id, customer_phone)
+        await db.execute(insert(ConversationMessage).values(
+            owner_id=owner_id,
+            customer_phone=customer_phone,
+            direction=direction,
+            text=text,
+            whatsapp_message_id=whatsapp_message_id,
+        ))
+        await db.commit()
+        window.append((direction, text))
+
+    async def has_message(self, db: AsyncSession, owner_id: int, customer_phone: str, whatsapp_message_id: Optional[str]) -> bool:
+        """Whether a WhatsApp message is already in the timeline (a retried message was stored by its first attempt)."""
+        if not whatsapp_message_id:
+            return False
+        result = await db.execute(
+            select(ConversationMessage.id).where(
+                ConversationMessage.owner_id == owner_id,
+                ConversationMessage.customer_phone == customer_phone,
+                ConversationMessage.whatsapp_message_id == whatsapp_message_id,
+            ).limit(1)
+        )
+        return result.scalar() is not None
+
+    def snapshot(self) -> Dict[str, Any]:
+        return self._windows.stats()
+
+conversation_store = ConversationStore()
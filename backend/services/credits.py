@@ -0,0 +1,327 @@
+import time
+import uuid
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import delete, insert, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from core.config import settings
+from database import AsyncSessionLocal
+from models.user import User
+from models.credit import CreditLedgerEntry, CreditReservation
+from api.deps import invalidate_user_cache
+from services.analytics import analytics
+
+logger = logging.getLogger(__name__)
+
+async def _apply(
+    db: AsyncSession, user_id: int, delta: int, reason: str, reference: Optional[str], commit: bool,
+    require_balance: bool = False,
+) -> Optional[int]:
+    stmt = update(User).where(User.id == user_id)
+    if require_balance:
+        stmt = stmt.where(User.ai_credits_remaining >= -delta)
+    result = await db.execute(
+        stmt.values(ai_credits_remaining=User.ai_credits_remaining + delta)
+        .returning(User.ai_credits_remaining)
+        .execution_options(synchronize_session=False)
+    )
+    balance = result.scalar()
+    if balance is None:
+        return None
+
+    await db.execute(insert(CreditLedgerEntry).values(
+        user_id=user_id, delta=delta, balance_after=balance, reason=reason, reference=reference,
+    ))
+    if commit:
+        await db.commit()
+        invalidate_user_cache(user_id)
+    return balance
+
+async def debit_credits(
+    db: AsyncSession, user_id: int, amount: int = 1, reason: str = "usage",
+    reference: Optional[str] = None, commit: bool = True,
+) -> Optional[int]:
+    """
+    Atomically takes `amount` AI credits, only if the balance covers it, and records it in the ledger.
+    Returns the new balance, or None if there weren't enough credits.
+    With commit=False the caller commits (and then calls invalidate_user_cache).
+    """
+    return await _apply(db, user_id, -amount, reason, reference, commit, require_balance=True)
+
+async def grant_credits(
+    db: AsyncSession, user_id: int, amount: int, reason: str,
+    reference: Optional[str] = None, commit: bool = True,
+) -> Optional[int]:
+    """
+    Atomically adds `amount` AI credits and records it in the ledger.
+    Returns the new balance (None if the user doesn't exist).
+    """
+    return await _apply(db, user_id, amount, reason, reference, commit)
+
+async def _return_reservations(db: AsyncSession, *criteria) -> Dict[int, int]:
+    """
+    Deletes the matching reservations and puts their remaining credits back on the users'
+    balances. Returns user id -> credits returned. The caller commits.
+    """
+    result = await db.execute(
+        delete(CreditReservation).where(*criteria).returning(CreditReservation.user_id, CreditReservation.remaining)
+    )
+    returned: Dict[int, int] = {}
+    for user_id, remaining in result.all():
+        returned[user_id] = returned.get(user_id, 0) + remaining
+    for user_id, remaining in returned.items():
+        if remaining:
+            await db.execute(
+                update(User).where(User.id == user_id)
+                .values(ai_credits_remaining=User.ai_credits_remaining + remaining)
+                .execution_options(synchronize_session=False)
+            )
+    return returned
+
+class CreditReservoir:
+    """
+    Meters AI credits for high-volume tenants without a database write per message.
+
+    Usage is debited directly until a user consumes more than CREDIT_RESERVE_AFTER credits
+    within a minute. From then on credits are held in blocks of CREDIT_RESERVATION_BLOCK,
+    moved from the user's balance to a credit_reservations row of this worker, and handed
+    out from an in-process counter.
+
+    Every CREDIT_USAGE_FLUSH_SECONDS the credits used since the last flush are written to
+    the ledger, one entry each with its real reason and reference, and taken off the
+    reservation; the flush also marks all of this worker's reservations as alive.
+    Reservations idle for CREDIT_RESERVATION_IDLE_SECONDS, and all of them at shutdown,
+    are flushed and their remainder returned to the balance. Reservations not touched for
+    CREDIT_RESERVATION_STALE_SECONDS belong to a worker that died and are returned by the
+    others (and by every worker at startup): a crash loses only the ledger entries of
+    credits used since its last flush, which go back to the user with the rest of the block.
+    """
+    def __init__(self):
+        self.worker_id = uuid.uuid4().hex
+        self._reserved: Dict[int, int] = {}
+        self._uses: Dict[int, List[Tuple[str, Optional[str]]]] = {}  # user id -> unflushed (reason, reference)
+        self._last_used: Dict[int, float] = {}
+        self._locks: Dict[int, asyncio.Lock] = {}
+        self._usage: Dict[int, Tuple[float, int]] = {}  # user id -> (window start, credits used)
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {
+            "local_hits": 0, "direct_debits": 0, "reservations": 0, "flushed": 0,
+            "released": 0, "abandoned_released": 0, "refused": 0,
+        }
+
+    def _is_hot(self, user_id: int) -> bool:
+        now = time.monotonic()
+        started, count = self._usage.get(user_id, (now, 0))
+        if now - started >= 60:
+            started, count = now, 0
+        self._usage[user_id] = (started, count + 1)
+        return count + 1 > settings.CREDIT_RESERVE_AFTER
+
+    async def consume(self, db: AsyncSession, user_id: int, reason: str, reference: Optional[str] = None) -> bool:
+        """
+        Takes one credit for `reason`. Returns False if the user has none left.
+        """
+        if not await self._consume(db, user_id, reason, reference):
+            return False
+        analytics.record(user_id, ai_credits_used=1)
+        return True
+
+    async def _consume(self, db: AsyncSession, user_id: int, reason: str, reference: Optional[str]) -> bool:
+        if self._take_local(user_id, reason, reference):
+            return True
+
+        if not self._is_hot(user_id):
+            if await debit_credits(db, user_id, 1, reason, reference) is None:
+                self.stats["refused"] += 1
+                return False
+            self.stats["direct_debits"] += 1
+            return True
+
+        lock = self._locks.setdefault(user_id, asyncio.Lock())
+        async with lock:
+            # Another task may have refilled the reservoir while we waited
+            if self._take_local(user_id, reason, reference):
+                return True
+            block = settings.CREDIT_RESERVATION_BLOCK
+            if await self._hold(db, user_id, block):
+                self._reserved[user_id] = self._reserved.get(user_id, 0) + block
+                self.stats["reservations"] += 1
+                return self._take_local(user_id, reason, reference)
+            # Not enough for a whole block: take the last few credits one at a time
+            if await debit_credits(db, user_id, 1, reason, reference) is None:
+                self.stats["refused"] += 1
+                return False
+            self.stats["direct_debits"] += 1
+            return True
+
+    async def _hold(self, db: AsyncSession, user_id: int, amount: int) -> bool:
+        """Moves `amount` credits from the user's balance to this worker's reservation, if the balance covers it."""
+        result = await db.execute(
+            update(User).where(User.id == user_id, User.ai_credits_remaining >= amount)
+            .values(ai_credits_remaining=User.ai_credits_remaining - amount)
+            .returning(User.id)
+            .execution_options(synchronize_session=False)
+        )
+        if result.scalar() is None:
+            return False
+        now = datetime.utcnow()
+        result = await db.execute(
+            update(CreditReservation)
+            .where(CreditReservation.user_id == user_id, CreditReservation.worker_id == self.worker_id)
+            .values(remaining=CreditReservation.remaining + amount, updated_at=now)
+            .returning(CreditReservation.id)
+        )
+        if result.scalar() is None:
+            await db.execute(insert(CreditReservation).values(
+                user_id=user_id, worker_id=self.worker_id, remaining=amount, updated_at=now,
+            ))
+        await db.commit()
+        invalidate_user_cache(user_id)
+        return True
+
+    def _take_local(self, user_id: int, reason: str, reference: Optional[str]) -> bool:
+        if self._reserved.get(user_id, 0) > 0:
+            self._reserved[user_id] -= 1
+            self._uses.setdefault(user_id, []).append((reason, reference))
+            self._last_used[user_id] = time.monotonic()
+            self.stats["local_hits"] += 1
+            return True
+        return False
+
+    async def refund(self, db: AsyncSession, user_id: int, reason: str = "refund", reference: Optional[str] = None) -> None:
+        """Gives back a credit taken by consume() whose work failed."""
+        analytics.record(user_id, ai_credits_used=-1)
+        # Not flushed yet: drop the use, the credit is still held
+        uses = self._uses.get(user_id, [])
+        for i in range(len(uses) - 1, -1, -1):
+            if uses[i][1] == reference:
+                del uses[i]
+                self._reserved[user_id] += 1
+                return
+        await grant_credits(db, user_id, 1, reason, reference)
+
+    async def _record_uses(self, db: AsyncSession, user_id: int, uses: List[Tuple[str, Optional[str]]], now: datetime) -> None:
+        """Ledger entries for credits used from this worker's reservation. The caller commits."""
+        await db.execute(
+            update(CreditReservation)
+            .where(CreditReservation.user_id == user_id, CreditReservation.worker_id == self.worker_id)
+            .values(remaining=CreditReservation.remaining - len(uses), updated_at=now)
+        )
+        balance = (await db.execute(select(User.ai_credits_remaining).where(User.id == user_id))).scalar()
+        await db.execute(insert(CreditLedgerEntry), [
+            {"user_id": user_id, "delta": -1, "balance_after": balance, "reason": reason, "reference": reference}
+            for reason, reference in uses
+        ])
+
+    async def flush(self) -> None:
+        """Records the credits used from reservations since the last flush."""
+        uses = {user_id: entries for user_id, entries in self._uses.items() if entries}
+        self._uses = {}
+        try:
+            async with AsyncSessionLocal() as db:
+                now = datetime.utcnow()
+                # Still alive: keep this worker's reservations from being taken for abandoned
+                await db.execute(
+                    update(CreditReservation).where(CreditReservation.worker_id == self.worker_id).values(updated_at=now)
+                )
+                for user_id, entries in uses.items():
+                    await self._record_uses(db, user_id, entries, now)
+                await db.commit()
+        except Exception:
+            for user_id, entries in uses.items():
+                self._uses[user_id] = entries + self._uses.get(user_id, [])
+            raise
+        self.stats["flushed"] += sum(len(entries) for entries in uses.values())
+
+    async def reconcile(self, idle_seconds: Optional[float] = None) -> None:
+        """Returns unused reserved credits of users idle for `idle_seconds` (all users if None)."""
+        now = time.monotonic()
+        user_ids = [
+            user_id for user_id in list(self._reserved)
+            if idle_seconds is None or now - self._last_used.get(user_id, 0) >= idle_seconds
+        ]
+        if not user_ids:
+            return
+        async with AsyncSessionLocal() as db:
+            for user_id in user_ids:
+                lock = self._locks.setdefault(user_id, asyncio.Lock())
+                async with lock:
+                    remainder = self._reserved.pop(user_id, 0)
+                    uses = self._uses.pop(user_id, [])
+                    last_used = self._last_used.pop(user_id, None)
+                    try:
+                        if uses:
+                            await self._record_uses(db, user_id, uses, datetime.utcnow())
+                        await _return_reservations(
+                            db, CreditReservation.user_id == user_id, CreditReservation.worker_id == self.worker_id,
+                        )
+                        await db.commit()
+                    except Exception:
+                        await db.rollback()
+                        self._reserved[user_id] = remainder + self._reserved.get(user_id, 0)
+                        self._uses[user_id] = uses + self._uses.get(user_id, [])
+                        self._last_used[user_id] = last_used or now
+                        raise
+                    invalidate_user_cache(user_id)
+                    self.stats["released"] += remainder
+
+    async def release_abandoned(self) -> int:
+        """Returns the reservations of workers that stopped flushing. Returns the credits returned."""
+        cutoff = datetime.utcnow() - timedelta(seconds=settings.CREDIT_RESERVATION_STALE_SECONDS)
+        async with AsyncSessionLocal() as db:
+            returned = await _return_reservations(
+                db, CreditReservation.worker_id != self.worker_id, CreditReservation.updated_at < cutoff,
+            )
+            await db.commit()
+        for user_id, remaining in returned.items():
+            invalidate_user_cache(user_id)
+            logger.warning(f"Returned {remaining} credits abandoned in reservations to user {user_id}")
+        total = sum(returned.values())
+        self.stats["abandoned_released"] += total
+        return total
+
+    def _prune(self) -> None:
+        now = time.monotonic()
+        for user_id, (started, _) in list(self._usage.items()):
+            if now - started >= 60:
+                del self._usage[user_id]
+        for user_id, lock in list(self._locks.items()):
+            if not lock.locked() and user_id not in self._reserved:
+                del self._locks[user_id]
+
+    async def start(self) -> None:
+        await self.release_abandoned()
+        self._task = asyncio.create_task(self._reconcile_loop())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.reconcile()
+
+    async def _reconcile_loop(self) -> None:
+        while True:
+            await asyncio.sleep(settings.CREDIT_USAGE_FLUSH_SECONDS)
+            try:
+                await self.flush()
+                await self.reconcile(settings.CREDIT_RESERVATION_IDLE_SECONDS)
+                await self.release_abandoned()
+                self._prune()
+            except Exception as e:
+                logger.error(f"Failed to reconcile credit reservations: {e}")
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "outstanding": sum(self._reserved.values()),
+            "unflushed": sum(len(uses) for uses in self._uses.values()),
+            "users": len(self._reserved),
+        }
+
+credit_meter = CreditReservoir()
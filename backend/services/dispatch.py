@@ -0,0 +1,85 @@
+import time
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence
+
+from fastapi import HTTPException
+
+from core.config import settings
+from services.whatsapp import message_id_from_response
+
+logger = logging.getLogger(__name__)
+
+class TokenBucket:
+    """
+    Async token bucket limiter.
+    Refills `rate` tokens per second up to `capacity`; every acquire() takes one token,
+    waiting until one is available. Waiters are served in arrival order.
+    """
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+# Meta enforces throughput per business phone number, so every campaign sending
+# from the same number has to share one bucket.
+_buckets: Dict[str, TokenBucket] = {}
+
+def get_phone_number_bucket(phone_number_id: str) -> TokenBucket:
+    bucket = _buckets.get(phone_number_id)
+    if bucket is None:
+        bucket = _buckets[phone_number_id] = TokenBucket(settings.WHATSAPP_MESSAGES_PER_SECOND)
+    return bucket
+
+async def dispatch(
+    recipients: Sequence[Any],
+    send: Callable[[Any], Awaitable[Any]],
+    bucket: TokenBucket,
+    concurrency: Optional[int] = None,
+) -> Dict[str, Any]:
+    """
+    Sends to every recipient with at most `concurrency` requests in flight, paced by `bucket`.
+    A failing recipient is recorded in its result entry instead of aborting the whole run.
+    Results are returned in the same order as `recipients`.
+    """
+    concurrency = max(1, min(concurrency or settings.WHATSAPP_SEND_CONCURRENCY, len(recipients) or 1))
+    results: List[Optional[Dict[str, Any]]] = [None] * len(recipients)
+    pending = iter(enumerate(recipients))
+
+    async def _worker():
+        for index, recipient in pending:
+            await bucket.acquire()
+            try:
+                response = await send(recipient)
+                results[index] = {"to": recipient, "status": "sent", "message_id": message_id_from_response(response)}
+            except HTTPException as e:
+                results[index] = {"to": recipient, "status": "failed", "error": e.detail}
+            except Exception as e:
+                logger.error(f"Bulk send to {recipient} failed: {e}")
+                results[index] = {"to": recipient, "status": "failed", "error": str(e)}
+
+    started = time.monotonic()
+    await asyncio.gather(*(_worker() for _ in range(concurrency)))
+    elapsed = time.monotonic() - started
+
+    sent = sum(1 for r in results if r["status"] == "sent")
+    return {
+        "sent": sent,
+        "failed": len(results) - sent,
+        "elapsed_seconds": round(elapsed, 3),
+        "messages_per_second": round(len(results) / elapsed, 2) if elapsed > 0 else None,
+        "results": results,
+    }
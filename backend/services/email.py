@@ -1,18 +1,196 @@
 import os
+import re
+import quopri
+import asyncio
 import logging
-# import aioboto3  # Example for Amazon SES
+from html import escape, unescape
+from html.parser import HTMLParser
+from email.header import Header
+from email.utils import formatdate, make_msgid
+from typing import Any, Dict, List, Mapping, Optional
+
+from core.config import settings
+from services.templating import compile_template
+
+try:
+    import aiosmtplib
+except ImportError:  # only needed when SMTP_HOST is set
+    aiosmtplib = None
 
 logger = logging.getLogger(__name__)
 
 EMAIL_FROM = os.getenv("EMAIL_FROM", "hello@bharatmarketer.in")
+EMAIL_DOMAIN = EMAIL_FROM.rpartition("@")[2] or "bharatmarketer.in"
+
+class _TextExtractor(HTMLParser):
+    """Plain-text alternative of an HTML body (tags dropped, block elements become line breaks)."""
+    BLOCKS = {"p", "div", "br", "li", "tr", "h1", "h2", "h3", "h4", "h5", "h6"}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts: List[str] = []
+        self._skip = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in ("script", "style"):
+            self._skip += 1
+        elif tag in self.BLOCKS:
+            self.parts.append("\n")
+
+    def handle_endtag(self, tag):
+        if tag in ("script", "style"):
+            self._skip -= 1
+
+    def handle_data(self, data):
+        if not self._skip:
+            self.parts.append(data)
+
+def html_to_text(html: str) -> str:
+    parser = _TextExtractor()
+    parser.feed(html)
+    parser.close()
+    text = unescape("".join(parser.parts))
+    return re.sub(r"\n\s*\n+", "\n\n", re.sub(r"[ \t]+", " ", text)).strip()
+
+def _qp(text: str) -> bytes:
+    encoded = quopri.encodestring(text.replace("\r\n", "\n").encode("utf-8"))
+    return encoded.replace(b"\n", b"\r\n")
+
+class PreparedEmail:
+    """
+    A campaign email rendered once: the HTML is parsed (for the plain-text alternative) and the
+    multipart/alternative MIME skeleton encoded up front. render() then only adds the per-recipient
+    To/Date/Message-ID headers; a body with {{placeholders}} (services/templating.py) is filled
+    from the recipient's contact fields, HTML-escaped in the HTML part.
+    """
+    def __init__(self, subject: str, html_body: str, from_email: str = EMAIL_FROM):
+        self.from_email = from_email
+        text_body = html_to_text(html_body)
+        self.html_template = compile_template(html_body)
+        self.text_template = compile_template(text_body)
+        self._boundary = f"=_bm_{make_msgid(domain=EMAIL_DOMAIN)[1:-1].replace('@', '.')}"
+        self._headers = (
+            f"From: {from_email}\r\n"
+            f"Subject: {Header(subject, 'utf-8').encode()}\r\n"
+            "MIME-Version: 1.0\r\n"
+            f"Content-Type: multipart/alternative; boundary=\"{self._boundary}\"\r\n"
+        ).encode()
+        self._body = self._encode_body(text_body, html_body) if self.html_template.is_static else None
+
+    def _encode_body(self, text: str, html: str) -> bytes:
+        boundary = self._boundary.encode()
+        parts = []
+        for subtype, content in (("plain", text), ("html", html)):
+            parts.append(
+                b"--" + boundary + b"\r\n"
+                b"Content-Type: text/" + subtype.encode() + b"; charset=\"utf-8\"\r\n"
+                b"Content-Transfer-Encoding: quoted-printable\r\n\r\n" + _qp(content) + b"\r\n"
+            )
+        return b"\r\n" + b"".join(parts) + b"--" + boundary + b"--\r\n"
+
+    def render(self, to_email: str, message_id: str, fields: Optional[Mapping[str, Any]] = None) -> bytes:
+        if "\r" in to_email or "\n" in to_email:
+            raise ValueError(f"Invalid recipient address: {to_email!r}")
+        body = self._body
+        if body is None:
+            fields = {"email": to_email, **(fields or {})}
+            body = self._encode_body(self.text_template.render(fields), self.html_template.render(fields, escape=escape))
+        recipient_headers = f"To: {to_email}\r\nDate: {formatdate()}\r\nMessage-ID: {message_id}\r\n".encode()
+        return recipient_headers + self._headers + body
+
+class SMTPPool:
+    """
+    Pool of up to SMTP_POOL_SIZE persistent, authenticated SMTP connections. Each
+    connection sends up to SMTP_MAX_MESSAGES_PER_CONNECTION messages before it is
+    recycled; a connection that errors is dropped and replaced on demand.
+    """
+    def __init__(self):
+        self._idle: List[Any] = []
+        self._sent_on: Dict[int, int] = {}
+        self._slots: Optional[asyncio.Semaphore] = None
+        self.stats = {"connects": 0, "sent": 0, "failures": 0, "reconnects": 0}
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(settings.SMTP_POOL_SIZE)
+        return self._slots
+
+    async def _connect(self):
+        if aiosmtplib is None:
+            raise RuntimeError("SMTP_HOST is set but aiosmtplib is not installed")
+        client = aiosmtplib.SMTP(
+            hostname=settings.SMTP_HOST,
+            port=settings.SMTP_PORT,
+            username=settings.SMTP_USERNAME or None,
+            password=settings.SMTP_PASSWORD or None,
+            use_tls=settings.SMTP_USE_TLS,
+            timeout=settings.SMTP_TIMEOUT_SECONDS,
+        )
+        await client.connect()
+        self.stats["connects"] += 1
+        self._sent_on[id(client)] = 0
+        return client
+
+    async def _discard(self, client) -> None:
+        self._sent_on.pop(id(client), None)
+        try:
+            if client.is_connected:
+                await client.quit()
+        except Exception:
+            client.close()
+
+    async def send(self, sender: str, recipient: str, message: bytes) -> None:
+        async with self._semaphore():
+            client = self._idle.pop() if self._idle else await self._connect()
+            try:
+                try:
+                    await client.sendmail(sender, [recipient], message)
+                except aiosmtplib.SMTPServerDisconnected:
+                    # The server closed an idle connection; retry once on a fresh one
+                    self.stats["reconnects"] += 1
+                    await self._discard(client)
+                    client = await self._connect()
+                    await client.sendmail(sender, [recipient], message)
+            except Exception:
+                self.stats["failures"] += 1
+                await self._discard(client)
+                raise
+
+            self.stats["sent"] += 1
+            self._sent_on[id(client)] += 1
+            if self._sent_on[id(client)] >= settings.SMTP_MAX_MESSAGES_PER_CONNECTION:
+                await self._discard(client)
+            else:
+                self._idle.append(client)
+
+    async def close(self) -> None:
+        idle, self._idle = self._idle, []
+        self._slots = None
+        for client in idle:
+            await self._discard(client)
+
+smtp_pool = SMTPPool()
+
+async def send_prepared_email(email: PreparedEmail, to_email: str, fields: Optional[Mapping[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Sends a PreparedEmail to one recipient over the pooled SMTP connections,
+    personalized with the recipient's contact `fields`.
+    Without SMTP_HOST configured the send is mocked (logged only).
+    """
+    message_id = make_msgid(domain=EMAIL_DOMAIN)
+    message = email.render(to_email, message_id, fields)
+    if not settings.SMTP_HOST:
+        logger.info(f"Mock Email -> {to_email}")
+        return {"status": "mocked", "to": to_email}
+
+    await smtp_pool.send(email.from_email, to_email, message)
+    return {"status": "sent", "to": to_email, "message_id": message_id}
 
 async def send_email(to_email: str, subject: str, html_body: str):
     """
-    Mock service to send an email (to be replaced with SES, SendGrid, or SMTP)
+    Sends a single email. Campaigns should build one PreparedEmail and use send_prepared_email.
     """
-    logger.info(f"Mock Email -> {to_email}")
-    logger.info(f"Subject: {subject}")
-    # Here you would use aioboto3 for AWS SES or a SMTP client like aiosmtplib
-    # For now, we mock the success.
-    
-    return {"status": "mocked", "to": to_email}
+    return await send_prepared_email(PreparedEmail(subject, html_body), to_email)
+
+async def close_smtp_pool() -> None:
+    await smtp_pool.close()
@@ -0,0 +1,241 @@
+import time
+import random
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Set
+from urllib.parse import urlsplit
+
+import httpx
+
+from core.config import settings
+
+logger = logging.getLogger(__name__)
+
+try:
+    import h2  # noqa: F401  (enables HTTP/2 in httpx)
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+# Failures where the request never reached the upstream, so retrying cannot duplicate a send
+RETRYABLE_EXCEPTIONS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+# Upstream explicitly rejected the request without processing it
+RETRYABLE_STATUS_CODES = {429, 503}
+
+class CircuitOpenError(Exception):
+    """Raised without contacting the upstream while its circuit breaker is open."""
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures and rejects calls for
+    `reset_seconds`; then lets one trial call through (half-open) before closing again.
+    Other calls fail fast while the trial is in flight.
+    """
+    def __init__(self, failure_threshold: int, reset_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.times_opened = 0
+        self._trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_seconds:
+            return "half_open"
+        return "open"
+
+    def check(self) -> bool:
+        """
+        Raises CircuitOpenError if the call must not go through. Returns True if it is the
+        half-open trial call, which the caller must finish with end_trial().
+        """
+        state = self.state
+        if state == "open" or (state == "half_open" and self._trial_in_flight):
+            raise CircuitOpenError("Upstream circuit is open")
+        if state == "half_open":
+            self._trial_in_flight = True
+            return True
+        return False
+
+    def end_trial(self) -> None:
+        """Lets the next trial through if this one ended without a recorded outcome (e.g. cancelled)."""
+        self._trial_in_flight = False
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                self.times_opened += 1
+            self.opened_at = time.monotonic()
+        self._trial_in_flight = False
+
+class UpstreamClient:
+    """
+    One keep-alive connection pool (HTTP/2 when available) for a single upstream host,
+    with retries, a circuit breaker and connection-reuse counters.
+    """
+    def __init__(self, base_url: str):
+        self.base_url = base_url
+        self.breaker = CircuitBreaker(settings.HTTP_CIRCUIT_FAILURE_THRESHOLD, settings.HTTP_CIRCUIT_RESET_SECONDS)
+        self.client = httpx.AsyncClient(
+            base_url=base_url,
+            http2=HTTP2_AVAILABLE,
+            limits=httpx.Limits(
+                max_connections=settings.HTTP_MAX_CONNECTIONS_PER_HOST,
+                max_keepalive_connections=settings.HTTP_MAX_KEEPALIVE_PER_HOST,
+                keepalive_expiry=settings.HTTP_KEEPALIVE_EXPIRY_SECONDS,
+            ),
+            timeout=httpx.Timeout(settings.HTTP_TIMEOUT_SECONDS, connect=settings.HTTP_CONNECT_TIMEOUT_SECONDS),
+        )
+        self.stats = {
+            "requests": 0,
+            "pool_hits": 0,  # served on an already open connection
+            "pool_misses": 0,  # had to open a new connection
+            "tcp_connects": 0,
+            "tls_handshakes": 0,
+            "retries": 0,
+            "failures": 0,
+            "circuit_rejections": 0,
+        }
+
+    def _tracer(self, opened: Dict[str, bool]):
+        async def trace(event_name: str, info: Dict[str, Any]) -> None:
+            if event_name == "connection.connect_tcp.complete":
+                self.stats["tcp_connects"] += 1
+                opened["new"] = True
+            elif event_name == "connection.start_tls.complete":
+                self.stats["tls_handshakes"] += 1
+        return trace
+
+    async def _send_once(self, method: str, url: str, stream: bool, **kwargs) -> httpx.Response:
+        opened = {"new": False}
+        extensions = {**kwargs.pop("extensions", {}), "trace": self._tracer(opened)}
+        request = self.client.build_request(method, url, extensions=extensions, **kwargs)
+        try:
+            return await self.client.send(request, stream=stream)
+        finally:
+            self.stats["requests"] += 1
+            self.stats["pool_misses" if opened["new"] else "pool_hits"] += 1
+
+    async def request(self, method: str, url: str, stream: bool = False, **kwargs) -> httpx.Response:
+        """
+        Sends a request through the pool. Connection failures and 429/503 responses are
+        retried with jittered exponential backoff; other errors are returned/raised as-is.
+        With stream=True the caller must close the returned response.
+        """
+        try:
+            trial = self.breaker.check()
+        except CircuitOpenError:
+            self.stats["circuit_rejections"] += 1
+            raise
+        try:
+            return await self._request_with_retries(method, url, stream, **kwargs)
+        finally:
+            if trial:
+                self.breaker.end_trial()
+
+    async def _request_with_retries(self, method: str, url: str, stream: bool, **kwargs) -> httpx.Response:
+        attempt = 0
+        while True:
+            try:
+                response = await self._send_once(method, url, stream, **kwargs)
+            except RETRYABLE_EXCEPTIONS as e:
+                if attempt < settings.HTTP_MAX_RETRIES:
+                    attempt += 1
+                    await self._backoff(attempt, f"{type(e).__name__}")
+                    continue
+                self._record_failure()
+                raise
+            except httpx.HTTPError:
+                self._record_failure()
+                raise
+
+            if response.status_code in RETRYABLE_STATUS_CODES and attempt < settings.HTTP_MAX_RETRIES:
+                await response.aclose()
+                attempt += 1
+                await self._backoff(attempt, f"HTTP {response.status_code}")
+                continue
+
+            if response.status_code >= 500:
+                self._record_failure()
+            else:
+                self.breaker.record_success()
+            return response
+
+    async def post(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("POST", url, **kwargs)
+
+    async def get(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("GET", url, **kwargs)
+
+    async def _backoff(self, attempt: int, reason: str) -> None:
+        self.stats["retries"] += 1
+        delay = random.uniform(0, settings.HTTP_RETRY_BACKOFF_SECONDS * (2 ** (attempt - 1)))
+        logger.warning(f"Retrying {self.base_url} after {reason} (attempt {attempt}, sleeping {delay:.2f}s)")
+        await asyncio.sleep(delay)
+
+    def _record_failure(self) -> None:
+        self.stats["failures"] += 1
+        self.breaker.record_failure()
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "http2": HTTP2_AVAILABLE,
+            "circuit_state": self.breaker.state,
+            "circuit_times_opened": self.breaker.times_opened,
+        }
+
+# Least recently used last; bounded by HTTP_MAX_UPSTREAMS
+_clients: "OrderedDict[str, UpstreamClient]" = OrderedDict()
+_retired: Set[asyncio.Task] = set()
+
+def _origin(url: str) -> str:
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+async def _close_later(client: UpstreamClient) -> None:
+    # Requests already holding the client get the full request timeout to finish
+    await asyncio.sleep(settings.HTTP_TIMEOUT_SECONDS)
+    await client.client.aclose()
+
+def get_http_client(base_url: str) -> UpstreamClient:
+    """
+    Returns the shared client for the upstream host of `base_url`, creating it on first use.
+    Meant for the app's configured upstreams; past HTTP_MAX_UPSTREAMS hosts the least
+    recently used client is retired.
+    """
+    origin = _origin(base_url)
+    client = _clients.get(origin)
+    if client is not None:
+        _clients.move_to_end(origin)
+        return client
+    client = _clients[origin] = UpstreamClient(origin)
+    while len(_clients) > settings.HTTP_MAX_UPSTREAMS:
+        retired_origin, retired = _clients.popitem(last=False)
+        logger.warning(f"Retiring pooled HTTP client for {retired_origin} (more than {settings.HTTP_MAX_UPSTREAMS} upstreams)")
+        task = asyncio.get_running_loop().create_task(_close_later(retired))
+        _retired.add(task)
+        task.add_done_callback(_retired.discard)
+    return client
+
+async def close_http_clients() -> None:
+    """Closes every pooled connection. Called on app/worker shutdown."""
+    clients = list(_clients.values())
+    _clients.clear()
+    for task in list(_retired):
+        task.cancel()
+    for client in clients:
+        await client.client.aclose()
+
+def http_client_stats() -> Dict[str, Any]:
+    return {origin: client.snapshot() for origin, client in _clients.items()}
@@ -0,0 +1,442 @@
+import json
+import random
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import and_, delete, insert, or_, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from core.cache import TTLCache
+from core.config import settings
+from database import AsyncSessionLocal
+from models.webhook import InboundWebhookEvent, ProcessedWhatsAppMessage
+from api.deps import get_user_snapshot
+from services.ai import agentic_chat_response
+from services.conversations import conversation_store
+from services.credits import credit_meter
+from services.whatsapp import message_id_from_response, send_whatsapp_message
+from services.whatsapp_numbers import whatsapp_routes
+
+logger = logging.getLogger(__name__)
+
+PURGE_INTERVAL_SECONDS = 60 * 60
+# An event (or message) claimed longer ago than this and still 'processing' was abandoned by a crashed worker
+STALE_PROCESSING_AFTER = timedelta(minutes=10)
+# An event still unprocessed this long after receipt (its worker died before claiming it) is
+# re-queued by the retry sweep
+REQUEUE_AFTER_SECONDS = 60
+
+def _retry_delay(attempts: int) -> timedelta:
+    """Exponential backoff with full jitter."""
+    ceiling = settings.WEBHOOK_RETRY_BASE_SECONDS * (2 ** (attempts - 1))
+    return timedelta(seconds=random.uniform(ceiling / 2, ceiling))
+
+async def mark_handled(db: AsyncSession, message_id: Optional[str]) -> None:
+    """Marks a claimed message as answered, in the caller's transaction."""
+    if message_id:
+        await db.execute(
+            update(ProcessedWhatsAppMessage)
+            .where(ProcessedWhatsAppMessage.message_id == message_id)
+            .values(status="handled")
+        )
+
+async def handle_message(db: AsyncSession, value: Dict[str, Any], message: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Runs the autonomous AI agent for one inbound customer message:
+    look up the business, generate a reply with GPT-4o, send it back and deduct a credit.
+    Raises if no reply could be generated or sent, so the message is retried.
+    """
+    sender_phone = message.get("from", "")
+    message_type = message.get("type", "")
+
+    # We only handle text messages for now
+    if message_type != "text":
+        logger.info(f"Received non-text message type: {message_type} from {sender_phone}")
+        return {"status": "ok", "note": "Only text messages are supported by the AI agent currently."}
+
+    message_text = message.get("text", {}).get("body", "")
+
+    if not message_text:
+        return {"status": "ok"}
+
+    logger.info(f"Incoming WhatsApp from {sender_phone}: {message_text}")
+
+    # Route to the business that owns the WhatsApp number that received this message,
+    # by Meta's phone_number_id (an in-memory lookup, see services/whatsapp_numbers.py)
+    metadata = value.get("metadata", {})
+    owner_id = whatsapp_routes.resolve(metadata.get("phone_number_id"), metadata.get("display_phone_number"))
+    if owner_id is None:
+        owner_id = await whatsapp_routes.load_fallback(db)
+    business_owner = await get_user_snapshot(db, owner_id) if owner_id is not None else None
+
+    if not business_owner:
+        logger.warning("No business owner found for this WhatsApp number")
+        return {"status": "ok"}
+
+    # Check if the business owner has AI Agent enabled (Growth plan or higher)
+    if business_owner.subscription_tier in ["free", "starter"]:
+        logger.info(f"Business {business_owner.email} is on {business_owner.subscription_tier} plan - AI Agent not available")
+        return {"status": "ok", "note": "AI Agent requires Growth plan or higher"}
+
+    # Get the business context for smart replies
+    business_context = business_owner.business_context or f"Business: {business_owner.company_name or 'Unknown'}. Please assist the customer."
+
+    # Earlier turns of this conversation, then store the new message (even if the reply fails)
+    history = await conversation_store.history(db, business_owner.id, sender_phone)
+    if await conversation_store.has_message(db, business_owner.id, sender_phone, message.get("id")):
+        # A retry: the first attempt stored the message, so it is already the last turn of the history
+        history = history[:-1] if history and history[-1] == {"role": "user", "content": message_text} else history
+    else:
+        await conversation_store.record(db, business_owner.id, sender_phone, "inbound", message_text, message.get("id"))
+
+    # Take 1 AI credit up front; it is given back if no reply goes out
+    if not await credit_meter.consume(db, business_owner.id, "agent_reply", message.get("id")):
+        logger.info(f"Business {business_owner.email} has no AI credits remaining")
+        return {"status": "ok", "note": "No AI credits remaining"}
+
+    try:
+        # Generate the autonomous AI reply
+        ai_reply = await agentic_chat_response(message_text, business_context, history)
+
+        if not ai_reply:
+            raise RuntimeError("AI Agent failed to generate a response")
+
+        # Send the AI reply back to the customer via WhatsApp
+        # Reply from the business number the customer wrote to
+        send_result = await send_whatsapp_message(
+            sender_phone, ai_reply, whatsapp_routes.sender(metadata.get("phone_number_id"))
+        )
+    except Exception:
+        await credit_meter.refund(db, business_owner.id, reference=message.get("id"))
+        raise
+
+    # The reply and the message's handled mark commit together
+    await mark_handled(db, message.get("id"))
+    await conversation_store.record(
+        db, business_owner.id, sender_phone, "outbound", ai_reply, message_id_from_response(send_result)
+    )
+
+    logger.info(f"AI Agent replied to {sender_phone}: {ai_reply[:50]}...")
+    return {"status": "success", "customer_phone": sender_phone}
+
+def has_messages(body: Dict[str, Any]) -> bool:
+    """Whether a webhook payload carries customer messages (and not only delivery statuses)."""
+    return any(
+        change.get("value", {}).get("messages")
+        for entry in body.get("entry", [])
+        for change in entry.get("changes", [])
+    )
+
+def group_conversations(body: Dict[str, Any]) -> Dict[Tuple[str, str], List[Tuple[Dict[str, Any], Dict[str, Any]]]]:
+    """
+    Walks every entry/change/message of a Meta webhook payload (Meta batches them under load)
+    and groups the messages into conversations keyed by (business phone_number_id, customer).
+    Each conversation keeps payload order, with each message paired with its change `value`.
+    """
+    conversations = defaultdict(list)
+    for entry in body.get("entry", []):
+        for change in entry.get("changes", []):
+            value = change.get("value", {})
+            phone_number_id = value.get("metadata", {}).get("phone_number_id", "")
+            for message in value.get("messages", []):
+                conversations[(phone_number_id, message.get("from", ""))].append((value, message))
+    return dict(conversations)
+
+class InboundPipeline:
+    """
+    Processes stored inbound webhook events off the request path.
+
+    The webhook handler only persists the raw payload and calls submit(); a fixed
+    number of tasks then process events from an in-process queue. Every WhatsApp
+    message id is claimed in a TTL'd seen-set (memory in front of a table) before the
+    agent runs, so redeliveries of the same message never produce a second reply; the
+    claim is released if no reply went out. An event that fails goes back to 'received'
+    and is re-queued by a sweep after an exponential backoff, until WEBHOOK_MAX_ATTEMPTS;
+    the same sweep takes back events whose worker died while processing them.
+    """
+    def __init__(self):
+        self._queue: "asyncio.Queue[int]" = asyncio.Queue()
+        self._tasks: List[asyncio.Task] = []
+        self._pending: Set[int] = set()  # queued in this process, so the retry sweep skips them
+        self._seen = TTLCache(100_000, settings.WHATSAPP_DEDUPE_TTL_HOURS * 3600)
+        self._tenant_semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._conversation_locks: Dict[Tuple[str, str], list] = {}
+        self.stats = {"events": 0, "messages": 0, "duplicates": 0, "failures": 0, "retries": 0, "requeued": 0}
+
+    def submit(self, event_id: int) -> None:
+        self._pending.add(event_id)
+        self._queue.put_nowait(event_id)
+
+    async def start(self) -> None:
+        for _ in range(settings.WEBHOOK_PROCESSING_TASKS):
+            self._tasks.append(asyncio.create_task(self._consume()))
+        self._tasks.append(asyncio.create_task(self._retry_loop()))
+        self._tasks.append(asyncio.create_task(self._purge_loop()))
+        await self._recover()
+
+    async def stop(self, timeout: float = 10) -> None:
+        """Gives queued events `timeout` seconds to finish, then cancels the tasks."""
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Stopping inbound pipeline with {self._queue.qsize()} events still queued")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+        self._pending.clear()
+
+    async def _release_stale(self, db: AsyncSession) -> None:
+        """
+        Puts events whose worker died while processing them back to 'received'. An event
+        is only taken back once its claim is STALE_PROCESSING_AFTER old, however long it
+        waited in the queue before that.
+        """
+        now = datetime.utcnow()
+        stale = now - STALE_PROCESSING_AFTER
+        await db.execute(
+            update(InboundWebhookEvent)
+            .where(
+                InboundWebhookEvent.status == "processing",
+                or_(
+                    InboundWebhookEvent.claimed_at < stale,
+                    # Claimed before claimed_at was recorded
+                    and_(InboundWebhookEvent.claimed_at.is_(None), InboundWebhookEvent.received_at < stale),
+                ),
+            )
+            .values(status="received", claimed_at=None, next_attempt_at=now)
+        )
+        await db.commit()
+
+    async def _recover(self) -> None:
+        """Re-queues events left unprocessed by a restart or crash."""
+        async with AsyncSessionLocal() as db:
+            await self._release_stale(db)
+            result = await db.execute(
+                select(InboundWebhookEvent.id)
+                .where(InboundWebhookEvent.status == "received")
+                .order_by(InboundWebhookEvent.id)
+            )
+            event_ids = result.scalars().all()
+        for event_id in event_ids:
+            self.submit(event_id)
+        if event_ids:
+            logger.info(f"Re-queued {len(event_ids)} unprocessed inbound webhook events")
+
+    async def requeue_due(self) -> int:
+        """
+        Takes back stale claims, then queues 'received' events whose next attempt is due
+        and that aren't already queued here.
+        """
+        async with AsyncSessionLocal() as db:
+            await self._release_stale(db)
+            result = await db.execute(
+                select(InboundWebhookEvent.id)
+                .where(InboundWebhookEvent.status == "received", InboundWebhookEvent.next_attempt_at <= datetime.utcnow())
+                .order_by(InboundWebhookEvent.id)
+                .limit(1000)
+            )
+            due = [event_id for event_id in result.scalars().all() if event_id not in self._pending]
+        for event_id in due:
+            self.submit(event_id)
+        self.stats["requeued"] += len(due)
+        return len(due)
+
+    async def _retry_loop(self) -> None:
+        while True:
+            await asyncio.sleep(REQUEUE_AFTER_SECONDS)
+            try:
+                await self.requeue_due()
+            except Exception as e:
+                logger.error(f"Failed to re-queue inbound webhook events: {e}")
+
+    async def _consume(self) -> None:
+        while True:
+            event_id = await self._queue.get()
+            try:
+                await self.process_event(event_id)
+            except Exception as e:
+                logger.error(f"Inbound webhook event {event_id} crashed: {e}")
+            finally:
+                self._pending.discard(event_id)
+                self._queue.task_done()
+
+    async def process_event(self, event_id: int) -> None:
+        async with AsyncSessionLocal() as db:
+            # Claim the event so a recovering worker can't process it concurrently
+            result = await db.execute(
+                update(InboundWebhookEvent)
+                .where(InboundWebhookEvent.id == event_id, InboundWebhookEvent.status == "received")
+                .values(status="processing", claimed_at=datetime.utcnow())
+                .returning(InboundWebhookEvent.payload, InboundWebhookEvent.attempts)
+            )
+            claimed = result.first()
+            await db.commit()
+            if claimed is None:
+                return
+            self.stats["events"] += 1
+
+            values = {"status": "processed", "processed_at": datetime.utcnow()}
+            try:
+                await self.handle_payload(json.loads(claimed.payload))
+            except Exception as e:
+                await db.rollback()
+                # Messages that were answered stay claimed, so a retry only answers the rest
+                attempts = (claimed.attempts or 0) + 1
+                values = {"attempts": attempts, "last_error": str(e)}
+                if attempts >= settings.WEBHOOK_MAX_ATTEMPTS:
+                    self.stats["failures"] += 1
+                    logger.error(f"Giving up on inbound WhatsApp event {event_id} after {attempts} attempts: {e}")
+                    values.update(status="failed", processed_at=datetime.utcnow())
+                else:
+                    self.stats["retries"] += 1
+                    logger.warning(f"Inbound WhatsApp event {event_id} failed (attempt {attempts}), will retry: {e}")
+                    values.update(status="received", claimed_at=None, next_attempt_at=datetime.utcnow() + _retry_delay(attempts))
+
+            # If this fails the event stays 'processing' until the sweep takes back the stale claim
+            await db.execute(update(InboundWebhookEvent).where(InboundWebhookEvent.id == event_id).values(**values))
+            await db.commit()
+
+    async def handle_payload(self, body: Dict[str, Any]) -> None:
+        """
+        Processes every message in a (possibly batched) webhook payload. Conversations run
+        concurrently, capped per business number; each conversation's messages run in order.
+        """
+        conversations = group_conversations(body)
+        if not conversations:
+            # Status updates (delivered, read) are ingested by services/message_status.py
+            return
+
+        results = await asyncio.gather(
+            *(self._run_conversation(key, messages) for key, messages in conversations.items()),
+            return_exceptions=True,
+        )
+        errors = [r for r in results if isinstance(r, Exception)]
+        if errors:
+            raise RuntimeError(f"{len(errors)} of {len(results)} conversations failed, first error: {errors[0]}")
+
+    async def _run_conversation(self, key: Tuple[str, str], messages: List[Tuple[Dict[str, Any], Dict[str, Any]]]) -> None:
+        phone_number_id, _ = key
+        async with self._tenant_slot(phone_number_id), self._conversation_lock(key):
+            async with AsyncSessionLocal() as db:
+                first_error: Optional[Exception] = None
+                for value, message in messages:
+                    if not await self.claim_message(db, message.get("id")):
+                        self.stats["duplicates"] += 1
+                        logger.info(f"Ignoring redelivered WhatsApp message {message.get('id')}")
+                        continue
+                    self.stats["messages"] += 1
+                    try:
+                        await handle_message(db, value, message)
+                    except Exception as e:
+                        # Keep answering the rest of the conversation; this message is retried with the event
+                        await db.rollback()
+                        logger.error(f"Failed to handle WhatsApp message {message.get('id')}: {e}")
+                        await self.release_message(db, message.get("id"))
+                        first_error = first_error or e
+                        continue
+                    await self.finish_message(db, message.get("id"))
+                if first_error:
+                    raise first_error
+
+    def _tenant_slot(self, phone_number_id: str) -> asyncio.Semaphore:
+        semaphore = self._tenant_semaphores.get(phone_number_id)
+        if semaphore is None:
+            semaphore = self._tenant_semaphores[phone_number_id] = asyncio.Semaphore(settings.WEBHOOK_TENANT_CONCURRENCY)
+        return semaphore
+
+    @asynccontextmanager
+    async def _conversation_lock(self, key: Tuple[str, str]):
+        """
+        Serialises a conversation across concurrently processed events (a retry or a second
+        batch from Meta), so one customer's messages are never answered in parallel.
+        """
+        entry = self._conversation_locks.get(key)
+        if entry is None:
+            entry = self._conversation_locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._conversation_locks[key]
+
+    async def claim_message(self, db: AsyncSession, message_id: Optional[str]) -> bool:
+        """
+        Claims a message id before the agent answers it (committed, so a redelivery being
+        processed concurrently skips it). Returns False if the message was already answered
+        or is claimed by a live worker; a claim older than STALE_PROCESSING_AFTER was left
+        by a crashed worker and is taken over.
+        """
+        if not message_id:
+            return True
+        if self._seen.get(message_id):
+            return False
+        now = datetime.utcnow()
+        try:
+            await db.execute(insert(ProcessedWhatsAppMessage).values(message_id=message_id, status="processing", seen_at=now))
+            await db.commit()
+            return True
+        except IntegrityError:
+            await db.rollback()
+        taken_over = await db.execute(
+            update(ProcessedWhatsAppMessage)
+            .where(
+                ProcessedWhatsAppMessage.message_id == message_id,
+                ProcessedWhatsAppMessage.status == "processing",
+                ProcessedWhatsAppMessage.seen_at < now - STALE_PROCESSING_AFTER,
+            )
+            .values(seen_at=now)
+        )
+        await db.commit()
+        if taken_over.rowcount == 1:
+            logger.warning(f"Taking over abandoned claim on WhatsApp message {message_id}")
+            return True
+        return False
+
+    async def finish_message(self, db: AsyncSession, message_id: Optional[str]) -> None:
+        """Marks a message handled (if its reply didn't already) and remembers it in memory."""
+        if not message_id:
+            return
+        await mark_handled(db, message_id)
+        await db.commit()
+        self._seen.set(message_id, True)
+
+    async def release_message(self, db: AsyncSession, message_id: Optional[str]) -> None:
+        """Drops the claim on a message no reply went out for, so a retry answers it."""
+        if not message_id:
+            return
+        try:
+            await db.execute(
+                delete(ProcessedWhatsAppMessage)
+                .where(ProcessedWhatsAppMessage.message_id == message_id, ProcessedWhatsAppMessage.status == "processing")
+            )
+            await db.commit()
+        except Exception as e:
+            # The claim goes stale and is taken over by the retry after STALE_PROCESSING_AFTER
+            logger.error(f"Failed to release claim on WhatsApp message {message_id}: {e}")
+            await db.rollback()
+
+    async def _purge_loop(self) -> None:
+        while True:
+            try:
+                cutoff = datetime.utcnow() - timedelta(hours=settings.WHATSAPP_DEDUPE_TTL_HOURS)
+                async with AsyncSessionLocal() as db:
+                    await db.execute(delete(ProcessedWhatsAppMessage).where(ProcessedWhatsAppMessage.seen_at < cutoff))
+                    await db.commit()
+            except Exception as e:
+                logger.error(f"Failed to purge WhatsApp message seen-set: {e}")
+            await asyncio.sleep(PURGE_INTERVAL_SECONDS)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {**self.stats, "queued": self._queue.qsize(), "seen_cache": self._seen.stats()}
+
+inbound_pipeline = InboundPipeline()
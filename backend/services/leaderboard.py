@@ -0,0 +1,176 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import func, insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from core.config import settings
+from database import AsyncSessionLocal
+from models.referral import ReferralEvent
+from models.user import User
+
+logger = logging.getLogger(__name__)
+
+WINDOWS = ("all", "month", "week")
+
+def window_start(window: str, now: Optional[datetime] = None) -> Optional[datetime]:
+    """Start (UTC) of the current week (Monday) or month; None for the all-time board."""
+    now = now or datetime.utcnow()
+    day = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    if window == "week":
+        return day - timedelta(days=day.weekday())
+    if window == "month":
+        return day.replace(day=1)
+    return None
+
+class _Board:
+    """
+    Referral counts of one window with O(1) rank lookups and increments.
+
+    `above[c]` is the number of users with more than c referrals, so a user's rank is
+    1 + above[count]. Counts only ever grow by one, and moving a user from c to c + 1
+    changes only above[c]. `top` keeps the first `size` users in rank order (ties keep
+    whoever got there first).
+    """
+    def __init__(self, size: int, counts: Optional[Dict[int, int]] = None):
+        self.size = size
+        self.counts: Dict[int, int] = dict(counts or {})
+        histogram = [0] * (max(self.counts.values(), default=0) + 1)
+        for count in self.counts.values():
+            histogram[count] += 1
+        self.above = [0] * len(histogram)
+        for c in range(len(histogram) - 2, -1, -1):
+            self.above[c] = self.above[c + 1] + histogram[c + 1]
+        self.top = sorted(self.counts, key=lambda user_id: -self.counts[user_id])[:size]
+
+    def increment(self, user_id: int) -> None:
+        count = self.counts.get(user_id, 0)
+        self.counts[user_id] = count + 1
+        self.above[count] += 1
+        if count + 1 == len(self.above):
+            self.above.append(0)
+
+        top = self.top
+        if user_id in top:
+            i = top.index(user_id)
+        elif len(top) < self.size or count + 1 > self.counts[top[-1]]:
+            top.append(user_id)
+            i = len(top) - 1
+        else:
+            return
+        while i > 0 and self.counts[top[i - 1]] < count + 1:
+            top[i - 1], top[i] = top[i], top[i - 1]
+            i -= 1
+        del top[self.size:]
+
+    def rank(self, user_id: int) -> Optional[int]:
+        count = self.counts.get(user_id)
+        return 1 + self.above[count] if count else None
+
+class ReferralLeaderboard:
+    """
+    In-memory all-time, monthly and weekly referral leaderboards.
+
+    Loaded at startup (users.total_referrals and referral_events) and updated in place by
+    record() when a referral is applied, so top-N and rank lookups never touch the
+    database. Windows are emptied when a new week/month starts. Other workers' referrals
+    are picked up by a reload every REFERRAL_LEADERBOARD_REFRESH_SECONDS.
+    """
+    def __init__(self):
+        self._boards: Dict[str, _Board] = {window: _Board(settings.REFERRAL_LEADERBOARD_SIZE) for window in WINDOWS}
+        self._starts: Dict[str, Optional[datetime]] = {window: window_start(window) for window in WINDOWS}
+        self._names: Dict[int, str] = {}
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {"loads": 0, "records": 0, "rollovers": 0}
+
+    def _board(self, window: str) -> _Board:
+        start = window_start(window)
+        if start != self._starts[window]:
+            self._boards[window] = _Board(settings.REFERRAL_LEADERBOARD_SIZE)
+            self._starts[window] = start
+            self.stats["rollovers"] += 1
+        return self._boards[window]
+
+    def record(self, referrer_id: int, name: str) -> None:
+        """Counts a referral just committed for `referrer_id` on every window."""
+        self._names[referrer_id] = name
+        for window in WINDOWS:
+            self._board(window).increment(referrer_id)
+        self.stats["records"] += 1
+
+    def top(self, window: str = "all", limit: int = 10) -> List[Dict[str, Any]]:
+        board = self._board(window)
+        return [
+            {"rank": board.rank(user_id), "name": self._names.get(user_id, "Anonymous"), "referrals": board.counts[user_id]}
+            for user_id in board.top[:limit]
+        ]
+
+    def rank(self, user_id: int, window: str = "all") -> Dict[str, Any]:
+        board = self._board(window)
+        return {"window": window, "rank": board.rank(user_id), "referrals": board.counts.get(user_id, 0)}
+
+    async def load(self, db: AsyncSession) -> None:
+        size = settings.REFERRAL_LEADERBOARD_SIZE
+        result = await db.execute(select(User.id, User.total_referrals).where(User.total_referrals > 0))
+        boards = {"all": _Board(size, dict(result.all()))}
+        starts = {"all": None}
+        for window in ("month", "week"):
+            start = window_start(window)
+            result = await db.execute(
+                select(ReferralEvent.referrer_id, func.count())
+                .where(ReferralEvent.created_at >= start)
+                .group_by(ReferralEvent.referrer_id)
+            )
+            boards[window] = _Board(size, dict(result.all()))
+            starts[window] = start
+
+        leaders = {user_id for board in boards.values() for user_id in board.top}
+        result = await db.execute(select(User.id, User.full_name, User.company_name).where(User.id.in_(leaders)))
+        self._names = {user_id: full_name or company_name or "Anonymous" for user_id, full_name, company_name in result.all()}
+        self._boards, self._starts = boards, starts
+        self.stats["loads"] += 1
+
+    async def start(self) -> None:
+        async with AsyncSessionLocal() as db:
+            await self.load(db)
+        self._task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _refresh_loop(self) -> None:
+        while True:
+            await asyncio.sleep(settings.REFERRAL_LEADERBOARD_REFRESH_SECONDS)
+            try:
+                async with AsyncSessionLocal() as db:
+                    await self.load(db)
+            except Exception as e:
+                logger.error(f"Failed to reload referral leaderboard: {e}")
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {**self.stats, **{f"{window}_referrers": len(board.counts) for window, board in self._boards.items()}}
+
+referral_leaderboard = ReferralLeaderboard()
+
+async def backfill_referral_events(db: AsyncSession) -> int:
+    """
+    One-off migration: adds referral_events rows for referrals applied before the table
+    existed, dated at the referred user's signup. Cheap no-op afterwards.
+    """
+    missing = select(User.referred_by_id, User.id, User.created_at).where(
+        User.referred_by_id.is_not(None),
+        ~select(ReferralEvent.id).where(ReferralEvent.referred_id == User.id).exists(),
+    )
+    result = await db.execute(
+        insert(ReferralEvent).from_select(["referrer_id", "referred_id", "created_at"], missing)
+    )
+    await db.commit()
+    if result.rowcount:
+        logger.info(f"Backfilled {result.rowcount} referral events")
+    return result.rowcount
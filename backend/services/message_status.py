@@ -0,0 +1,272 @@
+import asyncio
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import DateTime, and_, bindparam, func, or_, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.future import select
+
+from core.cache import TTLCache
+from core.config import settings
+from database import AsyncSessionLocal, engine
+from models.campaign import CampaignRecipient
+from models.contact import Contact
+from models.message_event import MessageEvent
+from services.analytics import STATUS_COUNTERS, analytics
+from services.whatsapp_numbers import whatsapp_routes
+
+logger = logging.getLogger(__name__)
+
+STATUSES = ("sent", "delivered", "read", "failed")
+
+def _occurred_at(status: Dict[str, Any]) -> datetime:
+    try:
+        return datetime.utcfromtimestamp(int(status["timestamp"]))
+    except (KeyError, TypeError, ValueError):
+        return datetime.utcnow()
+
+def _error(status: Dict[str, Any]) -> Optional[str]:
+    errors = status.get("errors")
+    if not errors:
+        return None
+    first = errors[0]
+    return f"{first.get('code')}: {first.get('title') or first.get('message') or ''}".strip()
+
+def _phone_candidates(recipient: str) -> Dict[str, str]:
+    """Forms a contact's phone may be stored in: Meta reports bare international digits."""
+    national = recipient[2:] if recipient.startswith("91") and len(recipient) == 12 else recipient
+    return {"digits": recipient, "e164": f"+{recipient}", "national": national}
+
+class MessageStatusAggregator:
+    """
+    Write-behind ingestion of WhatsApp status callbacks (and of customer replies, for analytics).
+
+    ingest() runs on the webhook request and only touches memory: the event is buffered
+    for a batched insert into message_events. Every MESSAGE_STATUS_FLUSH_SECONDS, or as
+    soon as MESSAGE_STATUS_BATCH_SIZE events are buffered, one flush inserts the events,
+    skipping redelivered callbacks on the (dedupe id, status) unique key, and applies the
+    inserted events' effect on the contacts' engagement counters (total_messages_sent,
+    total_messages_opened, last_contacted_at) with a single executemany UPDATE; after the
+    commit they feed the analytics rollups (services/analytics.py). A bounded seen-set
+    drops recent redeliveries before they are buffered. Buffered events are lost if the
+    worker crashes before its next flush.
+    """
+    def __init__(self):
+        self._events: List[Dict[str, Any]] = []
+        self._seen = TTLCache(settings.MESSAGE_STATUS_DEDUPE_CACHE_SIZE, settings.WHATSAPP_DEDUPE_TTL_HOURS * 3600)
+        self._flush_now = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {"ingested": 0, "duplicates": 0, "flushes": 0, "flushed_events": 0, "contact_updates": 0, "dropped": 0, "failures": 0}
+
+    def ingest(self, body: Dict[str, Any]) -> int:
+        """
+        Buffers every status callback of a (possibly batched) webhook payload.
+        Returns how many new statuses were accepted.
+        """
+        accepted = 0
+        for entry in body.get("entry", []):
+            for change in entry.get("changes", []):
+                value = change.get("value", {})
+                statuses = value.get("statuses") or []
+                messages = value.get("messages") or []
+                if not statuses and not messages:
+                    continue
+                metadata = value.get("metadata", {})
+                phone_number_id = metadata.get("phone_number_id") or ""
+                display_phone_number = metadata.get("display_phone_number") or ""
+                for status in statuses:
+                    state = status.get("status")
+                    if state in STATUSES and self._add(
+                        phone_number_id, display_phone_number, status.get("id"), state, status.get("recipient_id"),
+                        _occurred_at(status), _error(status) if state == "failed" else None,
+                    ):
+                        accepted += 1
+                for message in messages:
+                    # A reply to one of our messages (e.g. a template's quick-reply button) carries its id as context
+                    if self._add(
+                        phone_number_id, display_phone_number, (message.get("context") or {}).get("id") or message.get("id"),
+                        "replied", message.get("from"), _occurred_at(message), dedupe_id=message.get("id"),
+                    ):
+                        accepted += 1
+        if len(self._events) >= settings.MESSAGE_STATUS_BATCH_SIZE:
+            self._flush_now.set()
+        return accepted
+
+    def _add(
+        self, phone_number_id: str, display_phone_number: str, message_id: Optional[str], state: str,
+        recipient: Optional[str], occurred_at: datetime, error: Optional[str] = None, dedupe_id: Optional[str] = None,
+    ) -> bool:
+        if not message_id or not recipient:
+            return False
+        dedupe_id = dedupe_id or message_id
+        if self._seen.get((dedupe_id, state)):
+            self.stats["duplicates"] += 1
+            return False
+        self._seen.set((dedupe_id, state), True)
+
+        self._events.append({
+            "phone_number_id": phone_number_id,
+            "display_phone_number": display_phone_number,
+            "provider_message_id": message_id,
+            "dedupe_id": dedupe_id,
+            "recipient": recipient,
+            "status": state,
+            "error": error,
+            "occurred_at": occurred_at,
+        })
+        self.stats["ingested"] += 1
+        return True
+
+    async def flush(self) -> None:
+        """Writes buffered events; on failure they are kept for the next flush."""
+        async with self._flush_lock:
+            events, self._events = self._events, []
+            if not events:
+                return
+            try:
+                recorded = await self._write(events)
+            except Exception:
+                self.stats["failures"] += 1
+                self._requeue(events)
+                raise
+            self.stats["flushes"] += 1
+            self.stats["flushed_events"] += len(recorded)
+            self.stats["duplicates"] += len(events) - len(recorded)
+
+        # Committed: a failure from here on must not write the events again
+        for owner_id, campaign_id, e in recorded:
+            analytics.record(owner_id, campaign_id, e["occurred_at"], **{STATUS_COUNTERS[e["status"]]: 1})
+
+    async def _write(self, events: List[Dict[str, Any]]) -> List[Tuple[Optional[int], Optional[int], Dict[str, Any]]]:
+        """
+        Inserts the events not already stored and applies their contact counter increments
+        in one transaction. Returns the inserted events with their owner and campaign.
+        """
+        insert = pg_insert if engine.dialect.name == "postgresql" else sqlite_insert
+        async with AsyncSessionLocal() as db:
+            owners: Dict[Tuple[str, str], Optional[int]] = {}
+            for phone_number_id, display_phone_number in {(e["phone_number_id"], e["display_phone_number"]) for e in events}:
+                owner_id = whatsapp_routes.resolve(phone_number_id, display_phone_number)
+                if owner_id is None:
+                    owner_id = await whatsapp_routes.load_fallback(db)
+                owners[(phone_number_id, display_phone_number)] = owner_id
+
+            result = await db.execute(
+                insert(MessageEvent)
+                .on_conflict_do_nothing(index_elements=["dedupe_id", "status"])
+                .returning(MessageEvent.dedupe_id, MessageEvent.status),
+                [
+                    {
+                        "owner_id": owners[(e["phone_number_id"], e["display_phone_number"])],
+                        "phone_number_id": e["phone_number_id"] or None,
+                        "provider_message_id": e["provider_message_id"],
+                        "dedupe_id": e["dedupe_id"],
+                        "recipient": e["recipient"],
+                        "status": e["status"],
+                        "error": e["error"],
+                        "occurred_at": e["occurred_at"],
+                    }
+                    for e in events
+                ],
+            )
+            inserted = set(result.all())
+            events = [e for e in events if (e["dedupe_id"], e["status"]) in inserted]
+
+            # Sum per contact (several business numbers may share one owner), then one executemany
+            increments: Dict[Tuple[int, str], list] = {}  # (owner, recipient) -> [sent, opened, last contacted at]
+            for e in events:
+                owner_id = owners[(e["phone_number_id"], e["display_phone_number"])]
+                if owner_id is None or e["status"] not in ("sent", "read"):
+                    continue
+                total = increments.setdefault((owner_id, e["recipient"]), [0, 0, None])
+                if e["status"] == "sent":
+                    total[0] += 1
+                    if total[2] is None or e["occurred_at"] > total[2]:
+                        total[2] = e["occurred_at"]
+                else:
+                    total[1] += 1
+            if increments:
+                contacts = Contact.__table__
+                await db.execute(
+                    update(contacts)
+                    .where(and_(
+                        contacts.c.owner_id == bindparam("owner"),
+                        or_(
+                            contacts.c.phone == bindparam("digits"),
+                            contacts.c.phone == bindparam("e164"),
+                            contacts.c.phone == bindparam("national"),
+                        ),
+                    ))
+                    .values(
+                        total_messages_sent=func.coalesce(contacts.c.total_messages_sent, 0) + bindparam("sent"),
+                        total_messages_opened=func.coalesce(contacts.c.total_messages_opened, 0) + bindparam("opened"),
+                        last_contacted_at=func.coalesce(bindparam("contacted_at", type_=DateTime(timezone=True)), contacts.c.last_contacted_at),
+                    ),
+                    [
+                        {"owner": owner_id, **_phone_candidates(recipient), "sent": sent, "opened": opened, "contacted_at": contacted_at}
+                        for (owner_id, recipient), (sent, opened, contacted_at) in increments.items()
+                    ],
+                )
+                self.stats["contact_updates"] += len(increments)
+            campaigns = await self._campaign_ids(db, {e["provider_message_id"] for e in events})
+            await db.commit()
+
+        return [
+            (owners[(e["phone_number_id"], e["display_phone_number"])], campaigns.get(e["provider_message_id"]), e)
+            for e in events
+        ]
+
+    async def _campaign_ids(self, db, provider_message_ids) -> Dict[str, int]:
+        """Campaign of each outbound message id (those not sent by a campaign are left out)."""
+        campaigns: Dict[str, int] = {}
+        ids = list(provider_message_ids)
+        for i in range(0, len(ids), 500):
+            result = await db.execute(
+                select(CampaignRecipient.provider_message_id, CampaignRecipient.campaign_id)
+                .where(CampaignRecipient.provider_message_id.in_(ids[i:i + 500]))
+            )
+            campaigns.update(result.all())
+        return campaigns
+
+    def _requeue(self, events: List[Dict[str, Any]]) -> None:
+        """Puts a failed flush back in front of newer data, dropping events beyond MESSAGE_STATUS_MAX_PENDING."""
+        overflow = len(events) + len(self._events) - settings.MESSAGE_STATUS_MAX_PENDING
+        if overflow > 0:
+            self.stats["dropped"] += overflow
+            logger.error(f"Dropping {overflow} buffered WhatsApp status events after failed flushes")
+            events = events[overflow:]
+        self._events = events + self._events
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error(f"Failed to flush WhatsApp status events at shutdown: {e}")
+
+    async def _flush_loop(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_now.wait(), settings.MESSAGE_STATUS_FLUSH_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_now.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Failed to flush WhatsApp status events: {e}")
+                await asyncio.sleep(settings.MESSAGE_STATUS_FLUSH_SECONDS)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {**self.stats, "buffered": len(self._events), "seen_cache": self._seen.stats()}
+
+message_status = MessageStatusAggregator()
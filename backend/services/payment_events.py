@@ -0,0 +1,374 @@
+import json
+import random
+import asyncio
+import hashlib
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Set
+
+from sqlalchemy import bindparam, delete, or_, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.future import select
+
+from core.cache import TTLCache
+from core.config import settings
+from database import AsyncSessionLocal, engine
+from models.payment import PaymentEvent
+from models.user import User
+from api.deps import invalidate_user_cache
+
+logger = logging.getLogger(__name__)
+
+PURGE_INTERVAL_SECONDS = 60 * 60
+# An event still unprocessed this long after receipt (its worker died, or recording a failed
+# attempt failed too) is re-queued by the retry sweep
+REQUEUE_AFTER_SECONDS = 60
+
+# Events that change a user's subscription; the tier each gateway's subscriptions map to
+SUBSCRIPTION_EVENTS = {
+    "stripe": {"checkout.session.completed"},
+    "razorpay": {"subscription.authenticated", "subscription.charged"},
+}
+# TODO: Retrieve actual plan name from Stripe subscription
+PAID_TIERS = {"stripe": "paid_stripe", "razorpay": "paid_razorpay"}
+CUSTOMER_ID_COLUMNS = {"stripe": "stripe_customer_id", "razorpay": "razorpay_customer_id"}
+
+def _activate_statement(provider: str):
+    """
+    Executemany UPDATE activating a gateway's paid subscription, matching only users with no
+    newer applied event (the guard also covers other workers' concurrent updates).
+    """
+    users = User.__table__
+    return (
+        update(users)
+        .where(
+            users.c.id == bindparam("user"),
+            or_(users.c.subscription_event_at.is_(None), users.c.subscription_event_at <= bindparam("at")),
+        )
+        .values({
+            CUSTOMER_ID_COLUMNS[provider]: bindparam("customer"),
+            "subscription_status": "active",
+            "subscription_tier": PAID_TIERS[provider],
+            "subscription_event_at": bindparam("at"),
+        })
+    )
+
+def _retry_delay(attempts: int) -> timedelta:
+    """Exponential backoff with full jitter."""
+    ceiling = settings.PAYMENT_EVENT_RETRY_BASE_SECONDS * (2 ** (attempts - 1))
+    return timedelta(seconds=random.uniform(ceiling / 2, ceiling))
+
+def _user_id(value: Any) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+def stripe_event_row(payload: bytes) -> Optional[Dict[str, Any]]:
+    """
+    The payment_events row for a Stripe webhook whose signature has been verified, or None
+    if we don't act on its type. Read from the JSON payload (StripeObject has no dict .get()).
+    """
+    event = json.loads(payload)
+    if event["type"] not in SUBSCRIPTION_EVENTS["stripe"]:
+        return None
+    session = event["data"]["object"]
+    return {
+        "provider": "stripe",
+        "event_id": event["id"],
+        "event_type": event["type"],
+        "user_id": _user_id(session.get("client_reference_id")),
+        "customer_id": session.get("customer"),
+        "occurred_at": datetime.utcfromtimestamp(event["created"]),
+        "payload": payload.decode("utf-8"),
+    }
+
+def razorpay_event_row(data: Dict[str, Any], payload: bytes, event_id: Optional[str]) -> Optional[Dict[str, Any]]:
+    """
+    The payment_events row for a verified Razorpay webhook, or None if we don't act on its
+    type or it carries no subscription entity (acknowledged all the same: a retry would
+    resend the same body). Razorpay sends the event id in the X-Razorpay-Event-Id header;
+    without it the payload digest stands in.
+    """
+    if data.get("event") not in SUBSCRIPTION_EVENTS["razorpay"]:
+        return None
+    subscription = ((data.get("payload") or {}).get("subscription") or {}).get("entity")
+    if not subscription:
+        return None
+    return {
+        "provider": "razorpay",
+        "event_id": event_id or hashlib.sha256(payload).hexdigest(),
+        "event_type": data["event"],
+        "user_id": _user_id((subscription.get("notes") or {}).get("user_id")),
+        "customer_id": subscription.get("customer_id"),
+        "occurred_at": datetime.utcfromtimestamp(data.get("created_at") or datetime.utcnow().timestamp()),
+        "payload": payload.decode("utf-8"),
+    }
+
+class PaymentEventProcessor:
+    """
+    Applies stored payment webhook events off the request path.
+
+    The webhook handlers verify the signature, insert the event into the payment_events
+    inbox (a read finds an event id already there, a memory lookup one seen recently) and
+    acknowledge. Events are applied by a fixed number of tasks, each owning the users whose
+    id hashes to it, so one customer's events are applied one batch at a time in arrival
+    order. Subscription changes are single UPDATEs guarded by the event's gateway
+    timestamp, so an older event delivered late can't undo a newer one.
+
+    An event that fails to apply stays 'received' and is re-queued by a sweep after an
+    exponential backoff; after PAYMENT_EVENT_MAX_ATTEMPTS failures it is marked 'failed'
+    and kept for inspection (the purge only deletes applied and stale events).
+    """
+    def __init__(self):
+        self._queues: List["asyncio.Queue[int]"] = []
+        self._tasks: List[asyncio.Task] = []
+        self._pending: Set[int] = set()  # queued in this process, so the retry sweep skips them
+        self._seen = TTLCache(100_000, settings.PAYMENT_EVENT_DEDUPE_TTL_HOURS * 3600)
+        self.stats = {"received": 0, "duplicates": 0, "applied": 0, "stale": 0, "retries": 0, "failures": 0, "requeued": 0}
+
+    async def receive(self, row: Dict[str, Any]) -> bool:
+        """
+        Stores an event in the inbox and queues it. Returns False for an event that was
+        already received.
+        """
+        key = (row["provider"], row["event_id"])
+        if self._seen.get(key):
+            self.stats["duplicates"] += 1
+            return False
+        insert = pg_insert if engine.dialect.name == "postgresql" else sqlite_insert
+        async with AsyncSessionLocal() as db:
+            # A replayed event is found with a read, without taking the write lock
+            existing = await db.execute(
+                select(PaymentEvent.id).where(PaymentEvent.provider == row["provider"], PaymentEvent.event_id == row["event_id"])
+            )
+            duplicate = existing.scalar() is not None
+            # End the read so the insert starts its own write transaction (no lock upgrade)
+            await db.rollback()
+            event_id = None
+            if not duplicate:
+                requeue_at = datetime.utcnow() + timedelta(seconds=REQUEUE_AFTER_SECONDS)
+                result = await db.execute(
+                    insert(PaymentEvent)
+                    .values(**row, next_attempt_at=requeue_at)
+                    .on_conflict_do_nothing(index_elements=["provider", "event_id"])
+                    .returning(PaymentEvent.id)
+                )
+                event_id = result.scalar()
+                await db.commit()
+        self._seen.set(key, True)
+        if event_id is None:
+            self.stats["duplicates"] += 1
+            return False
+        self.stats["received"] += 1
+        self.submit(event_id, row["user_id"])
+        return True
+
+    def submit(self, event_id: int, user_id: Optional[int]) -> None:
+        # Without workers (a script or test) events stay in the inbox until the next start()
+        if self._queues:
+            self._pending.add(event_id)
+            self._queues[(user_id or 0) % len(self._queues)].put_nowait(event_id)
+
+    async def start(self) -> None:
+        self._queues = [asyncio.Queue() for _ in range(settings.PAYMENT_EVENT_PROCESSING_TASKS)]
+        for queue in self._queues:
+            self._tasks.append(asyncio.create_task(self._consume(queue)))
+        self._tasks.append(asyncio.create_task(self._retry_loop()))
+        self._tasks.append(asyncio.create_task(self._purge_loop()))
+        await self._recover()
+
+    async def stop(self, timeout: float = 10) -> None:
+        """Gives queued events `timeout` seconds to be applied, then cancels the tasks."""
+        try:
+            await asyncio.wait_for(asyncio.gather(*(queue.join() for queue in self._queues)), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Stopping payment event processor with {self._queued()} events still queued")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+        self._queues = []
+        self._pending.clear()
+
+    async def _recover(self) -> None:
+        """Queues events left unprocessed by a restart or crash, oldest first."""
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                select(PaymentEvent.id, PaymentEvent.user_id)
+                .where(PaymentEvent.status == "received")
+                .order_by(PaymentEvent.id)
+            )
+            events = result.all()
+        for event_id, user_id in events:
+            self.submit(event_id, user_id)
+        if events:
+            logger.info(f"Re-queued {len(events)} unprocessed payment events")
+
+    async def _consume(self, queue: "asyncio.Queue[int]") -> None:
+        while True:
+            # Events arriving within PAYMENT_EVENT_BATCH_SECONDS are applied in one transaction
+            batch = [await queue.get()]
+            await asyncio.sleep(settings.PAYMENT_EVENT_BATCH_SECONDS)
+            while len(batch) < settings.PAYMENT_EVENT_BATCH_SIZE and not queue.empty():
+                batch.append(queue.get_nowait())
+            try:
+                await self.process_events(batch)
+            except Exception as e:
+                logger.error(f"Payment events {batch[0]}..{batch[-1]} crashed: {e}")
+            finally:
+                for event_id in batch:
+                    self._pending.discard(event_id)
+                    queue.task_done()
+
+    async def process_events(self, event_ids: List[int]) -> None:
+        """
+        Applies a batch of events (in arrival order) in one transaction of a fixed number of
+        statements: claim them (received -> processed), read their users' last applied event
+        time, activate each user's newest event with one guarded UPDATE per gateway, and mark
+        the rest stale (older than what the user already has, or superseded in the batch).
+        If the batch fails its events are retried one by one, and an event that still fails
+        is scheduled for another attempt.
+        """
+        async with AsyncSessionLocal() as db:
+            try:
+                # Claim first, so the transaction starts by taking the write lock
+                result = await db.execute(
+                    update(PaymentEvent)
+                    .where(PaymentEvent.id.in_(event_ids), PaymentEvent.status == "received")
+                    .values(status="processed", processed_at=datetime.utcnow())
+                    .returning(PaymentEvent.id, PaymentEvent.provider, PaymentEvent.user_id, PaymentEvent.customer_id, PaymentEvent.occurred_at)
+                )
+                claimed = {event.id: event for event in result.all()}
+                events = [claimed[event_id] for event_id in dict.fromkeys(event_ids) if event_id in claimed]
+
+                result = await db.execute(
+                    select(User.id, User.subscription_event_at)
+                    .where(User.id.in_({event.user_id for event in events if event.user_id is not None}))
+                )
+                latest = dict(result.all())
+                newest, stale = {}, []
+                for event in events:
+                    if event.user_id not in latest:
+                        stale.append(event.id)
+                        continue
+                    if latest[event.user_id] is not None and event.occurred_at < latest[event.user_id]:
+                        stale.append(event.id)
+                        continue
+                    if event.user_id in newest:
+                        stale.append(newest[event.user_id].id)
+                    newest[event.user_id] = event
+                    latest[event.user_id] = event.occurred_at
+
+                for provider in PAID_TIERS:
+                    activations = [
+                        {"user": event.user_id, "customer": event.customer_id, "at": event.occurred_at}
+                        for event in newest.values() if event.provider == provider
+                    ]
+                    if activations:
+                        await db.execute(_activate_statement(provider), activations)
+                if stale:
+                    await db.execute(update(PaymentEvent).where(PaymentEvent.id.in_(stale)).values(status="stale"))
+                await db.commit()
+            except Exception as e:
+                await db.rollback()
+                if len(event_ids) > 1:
+                    for event_id in event_ids:
+                        await self.process_events([event_id])
+                    return
+                await self._failed(event_ids[0], e)
+                return
+
+        self.stats["applied"] += len(newest)
+        self.stats["stale"] += len(stale)
+        invalidate_user_cache(*newest)
+
+    async def _failed(self, event_id: int, error: Exception) -> None:
+        """
+        Records a failed attempt: the event stays 'received' until its next attempt is due,
+        or is marked 'failed' after PAYMENT_EVENT_MAX_ATTEMPTS. If this can't be recorded
+        either, the event keeps its earlier next_attempt_at and the sweep re-queues it.
+        """
+        try:
+            async with AsyncSessionLocal() as db:
+                attempts = (await db.execute(
+                    select(PaymentEvent.attempts).where(PaymentEvent.id == event_id)
+                )).scalar() or 0
+                attempts += 1
+                values = {"attempts": attempts, "last_error": str(error)}
+                if attempts >= settings.PAYMENT_EVENT_MAX_ATTEMPTS:
+                    values.update(status="failed", processed_at=datetime.utcnow())
+                else:
+                    values.update(next_attempt_at=datetime.utcnow() + _retry_delay(attempts))
+                await db.rollback()
+                await db.execute(
+                    update(PaymentEvent)
+                    .where(PaymentEvent.id == event_id, PaymentEvent.status == "received")
+                    .values(**values)
+                )
+                await db.commit()
+        except Exception as e:
+            logger.error(f"Could not record failed payment event {event_id} ({error}): {e}")
+            return
+        if attempts >= settings.PAYMENT_EVENT_MAX_ATTEMPTS:
+            self.stats["failures"] += 1
+            logger.error(f"Giving up on payment event {event_id} after {attempts} attempts: {error}")
+        else:
+            self.stats["retries"] += 1
+            logger.warning(f"Payment event {event_id} failed (attempt {attempts}), will retry: {error}")
+
+    async def requeue_due(self) -> int:
+        """
+        Queues 'received' events whose next attempt is due and that aren't already queued
+        here: retries, and events whose worker died before applying them.
+        """
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                select(PaymentEvent.id, PaymentEvent.user_id)
+                .where(PaymentEvent.status == "received", PaymentEvent.next_attempt_at <= datetime.utcnow())
+                .order_by(PaymentEvent.id)
+                .limit(settings.PAYMENT_EVENT_BATCH_SIZE)
+            )
+            due = [(event_id, user_id) for event_id, user_id in result.all() if event_id not in self._pending]
+        for event_id, user_id in due:
+            self.submit(event_id, user_id)
+        self.stats["requeued"] += len(due)
+        return len(due)
+
+    async def _retry_loop(self) -> None:
+        while True:
+            await asyncio.sleep(settings.PAYMENT_EVENT_RETRY_BASE_SECONDS)
+            try:
+                await self.requeue_due()
+            except Exception as e:
+                logger.error(f"Failed to re-queue payment events: {e}")
+
+    async def purge(self) -> int:
+        """Deletes applied and stale events older than PAYMENT_EVENT_RETENTION_DAYS."""
+        cutoff = datetime.utcnow() - timedelta(days=settings.PAYMENT_EVENT_RETENTION_DAYS)
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                delete(PaymentEvent).where(
+                    PaymentEvent.status.in_(("processed", "stale")),
+                    PaymentEvent.received_at < cutoff,
+                )
+            )
+            await db.commit()
+        return result.rowcount
+
+    async def _purge_loop(self) -> None:
+        while True:
+            try:
+                await self.purge()
+            except Exception as e:
+                logger.error(f"Failed to purge payment events: {e}")
+            await asyncio.sleep(PURGE_INTERVAL_SECONDS)
+
+    def _queued(self) -> int:
+        return sum(queue.qsize() for queue in self._queues)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {**self.stats, "queued": self._queued(), "seen_cache": self._seen.stats()}
+
+payment_events = PaymentEventProcessor()
@@ -0,0 +1,117 @@
+"""
+Payment gateway adapter: Stripe and Razorpay SDK calls off the event loop.
+
+Both SDKs are synchronous (requests-based), so every network call runs on a small
+dedicated thread pool; at most PAYMENT_GATEWAY_MAX_PENDING calls may be queued or in
+flight, beyond which callers get PaymentGatewayBusy instead of piling up. Each pool
+thread keeps its own keep-alive connections (a requests.Session per thread: Stripe's
+client does this itself, Razorpay gets one client per thread), calls time out after
+PAYMENT_GATEWAY_TIMEOUT_SECONDS, and failed connections are retried (Stripe retries
+with idempotency keys, so a retried create can't charge or subscribe twice).
+"""
+import time
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional
+
+import razorpay
+import requests
+import stripe
+import urllib3
+
+from core.config import settings
+
+logger = logging.getLogger(__name__)
+
+stripe.api_key = settings.STRIPE_SECRET_KEY
+stripe.api_base = settings.STRIPE_API_BASE_URL
+stripe.max_network_retries = settings.PAYMENT_GATEWAY_MAX_RETRIES
+# Without a session argument the client keeps one requests.Session per thread
+stripe.default_http_client = stripe.RequestsClient(timeout=settings.PAYMENT_GATEWAY_TIMEOUT_SECONDS)
+
+_gateway_executor = ThreadPoolExecutor(max_workers=settings.PAYMENT_GATEWAY_WORKERS, thread_name_prefix="payments")
+_gateway_pending = 0
+_razorpay_clients = threading.local()
+
+stats = {"calls": 0, "failures": 0, "retries": 0, "busy": 0}
+
+class PaymentGatewayBusy(Exception):
+    """Raised when PAYMENT_GATEWAY_MAX_PENDING gateway calls are already queued or running."""
+
+class PaymentGatewayNotConfigured(Exception):
+    """Raised when the gateway's API keys are not set."""
+
+async def _run_gateway_call(fn, *args):
+    global _gateway_pending
+    if _gateway_pending >= settings.PAYMENT_GATEWAY_MAX_PENDING:
+        stats["busy"] += 1
+        raise PaymentGatewayBusy()
+    _gateway_pending += 1
+    stats["calls"] += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_gateway_executor, fn, *args)
+    except Exception:
+        stats["failures"] += 1
+        raise
+    finally:
+        _gateway_pending -= 1
+
+def get_razorpay_client() -> razorpay.Client:
+    """
+    The calling thread's Razorpay client, created on first use (so the API starts without
+    Razorpay keys). A razorpay.Client wraps a single requests.Session, which isn't safe to
+    share between the pool's threads.
+    """
+    client = getattr(_razorpay_clients, "client", None)
+    if client is None:
+        if not settings.RAZORPAY_KEY_ID or not settings.RAZORPAY_KEY_SECRET:
+            raise PaymentGatewayNotConfigured("Razorpay not configured")
+        client = _razorpay_clients.client = razorpay.Client(
+            auth=(settings.RAZORPAY_KEY_ID, settings.RAZORPAY_KEY_SECRET),
+            base_url=settings.RAZORPAY_API_BASE_URL,
+        )
+    return client
+
+def _create_stripe_checkout_session(params: Dict[str, Any]):
+    if not stripe.api_key:
+        raise PaymentGatewayNotConfigured("Stripe not configured")
+    return stripe.checkout.Session.create(**params)
+
+def _never_sent(error: requests.exceptions.ConnectionError) -> bool:
+    """Whether a requests connection error happened before the request was sent."""
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], "reason", None) if error.args else None
+    return isinstance(reason, urllib3.exceptions.NewConnectionError)
+
+def _create_razorpay_subscription(data: Dict[str, Any]) -> Dict[str, Any]:
+    client = get_razorpay_client()
+    for attempt in range(settings.PAYMENT_GATEWAY_MAX_RETRIES + 1):
+        try:
+            return client.subscription.create(data=data, timeout=settings.PAYMENT_GATEWAY_TIMEOUT_SECONDS)
+        except requests.exceptions.ConnectionError as e:
+            # Only retry when the request never reached Razorpay, so a retry can't create a duplicate subscription
+            if attempt == settings.PAYMENT_GATEWAY_MAX_RETRIES or not _never_sent(e):
+                raise
+            stats["retries"] += 1
+            time.sleep(settings.PAYMENT_GATEWAY_RETRY_BACKOFF_SECONDS * (2 ** attempt))
+
+async def stripe_create_checkout_session(**params):
+    """stripe.checkout.Session.create on the gateway pool."""
+    return await _run_gateway_call(_create_stripe_checkout_session, params)
+
+async def razorpay_create_subscription(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Razorpay subscription.create on the gateway pool."""
+    return await _run_gateway_call(_create_razorpay_subscription, data)
+
+def construct_stripe_event(payload: bytes, signature: Optional[str]):
+    """
+    Verifies a Stripe webhook signature and parses the event. This is a local HMAC check
+    with no network call, so it runs inline.
+    """
+    return stripe.Webhook.construct_event(payload, signature, settings.STRIPE_WEBHOOK_SECRET)
+
+def payment_gateway_stats() -> Dict[str, Any]:
+    return {**stats, "pending": _gateway_pending}
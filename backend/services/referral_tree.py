@@ -0,0 +1,175 @@
+"""
+Multi-level referral tree backed by the referral_closure table.
+
+Every downline question is a single range scan of the (ancestor_id, depth, descendant_id)
+index. To (re)build the table from users.referred_by_id:
+
+    cd backend && python -m services.referral_tree backfill [--rebuild]
+"""
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import delete, func, insert, literal, true, union_all
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from database import AsyncSessionLocal, engine
+from models.referral import ReferralClosure
+from models.user import User
+
+logger = logging.getLogger(__name__)
+
+# Guards the backfill against cycles in legacy referred_by_id data
+MAX_BACKFILL_DEPTH = 1000
+
+async def is_in_downline(db: AsyncSession, ancestor_id: int, user_id: int) -> bool:
+    """Whether `user_id` is somewhere below `ancestor_id` in the referral tree."""
+    result = await db.execute(
+        select(literal(1)).where(ReferralClosure.ancestor_id == ancestor_id, ReferralClosure.descendant_id == user_id)
+    )
+    return result.scalar() is not None
+
+async def link_referral(db: AsyncSession, referrer_id: int, user_id: int) -> int:
+    """
+    Adds closure rows for `user_id` (and any downline it already has) joining the tree
+    under `referrer_id`: every ancestor of the referrer, and the referrer itself, becomes
+    an ancestor of every user in the new subtree. One INSERT ... SELECT; does not commit.
+    """
+    ancestors = union_all(
+        select(ReferralClosure.ancestor_id.label("id"), ReferralClosure.depth.label("depth"))
+        .where(ReferralClosure.descendant_id == referrer_id),
+        select(literal(referrer_id).label("id"), literal(0).label("depth")),
+    ).subquery()
+    subtree = union_all(
+        select(ReferralClosure.descendant_id.label("id"), ReferralClosure.depth.label("depth"))
+        .where(ReferralClosure.ancestor_id == user_id),
+        select(literal(user_id).label("id"), literal(0).label("depth")),
+    ).subquery()
+    result = await db.execute(
+        insert(ReferralClosure).from_select(
+            ["ancestor_id", "descendant_id", "depth"],
+            select(ancestors.c.id, subtree.c.id, ancestors.c.depth + subtree.c.depth + 1)
+            .select_from(ancestors.join(subtree, true())),
+        )
+    )
+    return result.rowcount
+
+def _downline(user_id: int, max_depth: Optional[int]):
+    filters = [ReferralClosure.ancestor_id == user_id]
+    if max_depth is not None:
+        filters.append(ReferralClosure.depth <= max_depth)
+    return filters
+
+async def downline_size(db: AsyncSession, user_id: int, max_depth: Optional[int] = None) -> int:
+    result = await db.execute(select(func.count()).select_from(ReferralClosure).where(*_downline(user_id, max_depth)))
+    return result.scalar_one()
+
+async def downline_depth_counts(db: AsyncSession, user_id: int, max_depth: Optional[int] = None) -> List[Dict[str, int]]:
+    result = await db.execute(
+        select(ReferralClosure.depth, func.count())
+        .where(*_downline(user_id, max_depth))
+        .group_by(ReferralClosure.depth)
+        .order_by(ReferralClosure.depth)
+    )
+    return [{"depth": depth, "count": count} for depth, count in result.all()]
+
+async def list_downline(
+    db: AsyncSession,
+    user_id: int,
+    depth: Optional[int] = None,
+    max_depth: Optional[int] = None,
+    after: Optional[Tuple[int, int]] = None,
+    limit: int = 50,
+) -> List[Dict[str, Any]]:
+    """
+    Users below `user_id`, nearest levels first, ordered by (depth, user id).
+    `after` is the (depth, id) of the previous page's last row. Returns up to `limit + 1`
+    rows so the caller can tell whether there is a next page.
+    """
+    filters = _downline(user_id, max_depth)
+    if depth is not None:
+        filters.append(ReferralClosure.depth == depth)
+    if after is not None:
+        after_depth, after_id = after
+        filters.append(
+            (ReferralClosure.depth > after_depth)
+            | ((ReferralClosure.depth == after_depth) & (ReferralClosure.descendant_id > after_id))
+        )
+    result = await db.execute(
+        select(
+            ReferralClosure.descendant_id.label("id"), ReferralClosure.depth,
+            User.full_name, User.company_name, User.referred_by_id, User.created_at,
+        )
+        .join(User, User.id == ReferralClosure.descendant_id)
+        .where(*filters)
+        .order_by(ReferralClosure.depth, ReferralClosure.descendant_id)
+        .limit(limit + 1)
+    )
+    return [
+        {
+            "id": row.id,
+            "name": row.full_name or row.company_name or "Anonymous",
+            "depth": row.depth,
+            "referred_by_id": row.referred_by_id,
+            "joined_at": row.created_at,
+        }
+        for row in result.all()
+    ]
+
+async def backfill_referral_closure(db: AsyncSession, rebuild: bool = False) -> int:
+    """
+    Builds referral_closure from users.referred_by_id one tree level at a time (one
+    INSERT ... SELECT per level). Without `rebuild` it is a no-op once the table has rows.
+    Returns the number of rows written.
+    """
+    if rebuild:
+        await db.execute(delete(ReferralClosure))
+    elif (await db.execute(select(literal(1)).select_from(ReferralClosure).limit(1))).scalar() is not None:
+        return 0
+
+    result = await db.execute(
+        insert(ReferralClosure).from_select(
+            ["ancestor_id", "descendant_id", "depth"],
+            select(User.referred_by_id, User.id, literal(1)).where(User.referred_by_id.is_not(None), User.referred_by_id != User.id),
+        )
+    )
+    written = level_rows = result.rowcount
+    depth = 1
+    while level_rows and depth < MAX_BACKFILL_DEPTH:
+        # Extend every path ending at this level by the users its last member referred
+        result = await db.execute(
+            insert(ReferralClosure).from_select(
+                ["ancestor_id", "descendant_id", "depth"],
+                select(ReferralClosure.ancestor_id, User.id, literal(depth + 1))
+                .join(User, User.referred_by_id == ReferralClosure.descendant_id)
+                .where(ReferralClosure.depth == depth, User.id != ReferralClosure.ancestor_id),
+            )
+        )
+        level_rows = result.rowcount
+        written += level_rows
+        depth += 1
+    await db.commit()
+    if written:
+        logger.info(f"Backfilled {written} referral closure rows ({depth} levels)")
+    return written
+
+async def _main(argv=None) -> None:
+    import argparse
+    from models.contact import Contact  # noqa: F401  (mapper referenced by User)
+
+    parser = argparse.ArgumentParser(prog="python -m services.referral_tree", description="Referral closure table")
+    parser.add_argument("command", choices=["backfill"])
+    parser.add_argument("--rebuild", action="store_true", help="drop existing rows and rebuild from users.referred_by_id")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    try:
+        async with AsyncSessionLocal() as db:
+            rows = await backfill_referral_closure(db, rebuild=args.rebuild)
+        logger.info(f"Referral closure backfill done: {rows} rows written")
+    finally:
+        await engine.dispose()
+
+if __name__ == "__main__":
+    asyncio.run(_main())
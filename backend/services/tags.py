@@ -0,0 +1,108 @@
+import logging
+from typing import Any, Dict, Iterable, List, Optional
+
+from sqlalchemy import delete, func, insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from models.contact import Contact, ContactTag
+
+logger = logging.getLogger(__name__)
+
+BACKFILL_BATCH_SIZE = 1000
+
+def parse_tags(raw: Optional[str]) -> List[str]:
+    """
+    Splits a comma-separated tag string into normalized (trimmed, lower-case) unique tags,
+    keeping their original order.
+    """
+    tags: List[str] = []
+    for part in (raw or "").split(","):
+        tag = part.strip().lower()
+        if tag and tag not in tags:
+            tags.append(tag)
+    return tags
+
+def format_tags(tags: Iterable[str]) -> str:
+    return ",".join(tags)
+
+async def set_contact_tags(db: AsyncSession, owner_id: int, contact_id: int, tags: List[str]) -> None:
+    """Replaces a contact's tag rows. The caller commits."""
+    await db.execute(delete(ContactTag).where(ContactTag.contact_id == contact_id))
+    if tags:
+        await db.execute(
+            insert(ContactTag),
+            [{"contact_id": contact_id, "owner_id": owner_id, "tag": tag} for tag in tags],
+        )
+
+async def add_tag_rows(db: AsyncSession, owner_id: int, tags_by_contact: Dict[int, List[str]]) -> None:
+    """Bulk-inserts tag rows for freshly created contacts. The caller commits."""
+    rows = [
+        {"contact_id": contact_id, "owner_id": owner_id, "tag": tag}
+        for contact_id, tags in tags_by_contact.items()
+        for tag in tags
+    ]
+    if rows:
+        await db.execute(insert(ContactTag), rows)
+
+def tag_filters(owner_id: int, all_of: List[str] = (), any_of: List[str] = (), none_of: List[str] = ()) -> List[Any]:
+    """
+    WHERE clauses on Contact.id for AND / OR / NOT tag filtering.
+    Each clause is a set operation over the (owner_id, tag) index rather than a scan of contacts.
+    """
+    def tagged(tags):
+        return select(ContactTag.contact_id).where(ContactTag.owner_id == owner_id, ContactTag.tag.in_(tags))
+
+    # Matching tag rows are counted against len(all_of), so a repeated tag would match nothing
+    all_of = list(dict.fromkeys(all_of))
+    clauses = []
+    if all_of:
+        clauses.append(Contact.id.in_(
+            tagged(all_of).group_by(ContactTag.contact_id).having(func.count() == len(all_of))
+        ))
+    if any_of:
+        clauses.append(Contact.id.in_(tagged(any_of)))
+    if none_of:
+        clauses.append(Contact.id.not_in(tagged(none_of)))
+    return clauses
+
+async def get_tag_counts(db: AsyncSession, owner_id: int) -> List[Dict[str, Any]]:
+    result = await db.execute(
+        select(ContactTag.tag, func.count())
+        .where(ContactTag.owner_id == owner_id)
+        .group_by(ContactTag.tag)
+        .order_by(func.count().desc(), ContactTag.tag)
+    )
+    return [{"tag": tag, "count": count} for tag, count in result.all()]
+
+async def backfill_contact_tags(db: AsyncSession) -> int:
+    """
+    One-off migration: builds contact_tags rows for contacts whose tags predate the table.
+    Cheap no-op once every tagged contact has rows. Returns the number of contacts backfilled.
+    """
+    untagged = (
+        select(Contact.id, Contact.owner_id, Contact.tags)
+        .where(Contact.tags.is_not(None), Contact.tags != "")
+        .where(~select(ContactTag.contact_id).where(ContactTag.contact_id == Contact.id).exists())
+        .order_by(Contact.id)
+    )
+    backfilled = 0
+    last_id = 0
+    while True:
+        rows = (await db.execute(untagged.where(Contact.id > last_id).limit(BACKFILL_BATCH_SIZE))).all()
+        if not rows:
+            break
+        tag_rows = [
+            {"contact_id": contact_id, "owner_id": owner_id, "tag": tag}
+            for contact_id, owner_id, tags in rows
+            for tag in parse_tags(tags)
+        ]
+        if tag_rows:
+            await db.execute(insert(ContactTag), tag_rows)
+        await db.commit()
+        backfilled += len(rows)
+        last_id = rows[-1][0]
+
+    if backfilled:
+        logger.info(f"Backfilled contact_tags for {backfilled} contacts")
+    return backfilled
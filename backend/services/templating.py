@@ -0,0 +1,99 @@
+import re
+from functools import lru_cache
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Optional, Sequence, Tuple
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from models.contact import Contact
+
+# {{ field }} or {{ field | default text }}
+PLACEHOLDER = re.compile(r"\{\{\s*(\w+)\s*(?:\|([^}]*))?\}\}")
+
+# Contact columns a campaign message may reference
+TEMPLATE_FIELDS = ("name", "phone", "email", "tags", "notes", "source")
+
+class TemplateError(ValueError):
+    pass
+
+class CompiledTemplate:
+    """
+    A message compiled once into a %-format string plus the (field, default) of each
+    placeholder, so rendering a recipient is one tuple build and one string format.
+    """
+    __slots__ = ("source", "fields", "_format", "_slots")
+
+    def __init__(self, source: str, fmt: str, slots: Tuple[Tuple[str, str], ...]):
+        self.source = source
+        self._format = fmt
+        self._slots = slots
+        self.fields = tuple(dict.fromkeys(field for field, _ in slots))
+
+    @property
+    def is_static(self) -> bool:
+        return not self._slots
+
+    def render(self, row: Optional[Mapping[str, Any]], escape: Optional[Callable[[str], str]] = None) -> str:
+        """Renders for one contact row; missing or empty fields use the placeholder's default."""
+        if not self._slots:
+            return self.source
+        row = row or {}
+        values = []
+        for field, default in self._slots:
+            value = row.get(field)
+            if value is None or value == "":
+                values.append(default)
+            else:
+                values.append(escape(str(value)) if escape else value)
+        return self._format % tuple(values)
+
+    def render_many(self, rows: Iterable[Mapping[str, Any]], escape: Optional[Callable[[str], str]] = None) -> List[str]:
+        render = self.render
+        return [render(row, escape) for row in rows]
+
+@lru_cache(maxsize=256)
+def compile_template(source: str) -> CompiledTemplate:
+    """
+    Compiles a campaign message. Raises TemplateError if it references anything
+    other than TEMPLATE_FIELDS, so mistakes surface before a campaign is queued.
+    """
+    parts: List[str] = []
+    slots: List[Tuple[str, str]] = []
+    unknown: List[str] = []
+    last = 0
+    for match in PLACEHOLDER.finditer(source):
+        field, default = match.group(1), (match.group(2) or "").strip()
+        if field not in TEMPLATE_FIELDS:
+            unknown.append(field)
+        parts.append(source[last:match.start()].replace("%", "%%"))
+        parts.append("%s")
+        slots.append((field, default))
+        last = match.end()
+    if unknown:
+        raise TemplateError(
+            f"Unknown placeholder(s): {', '.join(sorted(set(unknown)))}. Available: {', '.join(TEMPLATE_FIELDS)}"
+        )
+    parts.append(source[last:].replace("%", "%%"))
+    return CompiledTemplate(source, "".join(parts), tuple(slots))
+
+async def load_contact_fields(
+    db: AsyncSession, owner_id: int, key: str, recipients: Sequence[str], fields: Sequence[str],
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Template fields of the owner's contacts matching a batch of recipients, keyed by
+    recipient, in one query. `key` is the contact column recipients are ("phone" or "email").
+    """
+    if not recipients or not fields:
+        return {}
+    key_column = getattr(Contact, key)
+    columns = [getattr(Contact, f) for f in fields if f != key]
+    result = await db.execute(
+        select(key_column, *columns)
+        .where(Contact.owner_id == owner_id, key_column.in_(set(recipients)))
+        .order_by(Contact.id)
+    )
+    rows: Dict[str, Dict[str, Any]] = {}
+    for row in result.mappings():
+        # Keep the oldest contact if a recipient is on the list twice
+        rows.setdefault(row[key], dict(row))
+    return rows
@@ -1,6 +1,19 @@
 import os
 import httpx
+import socket
+import asyncio
+import hashlib
 import logging
+import ipaddress
+from typing import Any, Dict, List, Mapping, NamedTuple, Optional, Sequence, Tuple
+from urllib.parse import urlsplit
+
+from fastapi import HTTPException
+
+from core.config import settings
+from services.ai_cache import ResponseCache
+from services.http_client import get_http_client
+from services.templating import compile_template
 
 logger = logging.getLogger(__name__)
 
@@ -8,22 +21,63 @@ logger = logging.getLogger(__name__)
 WHATSAPP_TOKEN = os.getenv("WHATSAPP_TOKEN", "")
 WHATSAPP_PHONE_NUMBER_ID = os.getenv("WHATSAPP_PHONE_NUMBER_ID", "")
 WHATSAPP_API_VERSION = "v18.0"
+# Overridable so bulk sends can be pointed at a local fake Graph API
+WHATSAPP_API_BASE_URL = os.getenv("WHATSAPP_API_BASE_URL", "https://graph.facebook.com")
+
+class WhatsAppSender(NamedTuple):
+    """A connected business number and the access token its owner verified it with."""
+    phone_number_id: str
+    token: str
 
-async def send_whatsapp_message(to_number: str, message_text: str):
+# Header media URL -> uploaded media id (Meta keeps uploads for 30 days)
+media_cache = ResponseCache(1000, 29 * 24 * 60 * 60)
+
+def ensure_whatsapp_configured():
     """
-    Sends a simple text message via WhatsApp Cloud API.
+    Raises a 500 if the WhatsApp Cloud API credentials are not configured.
     """
     if not WHATSAPP_TOKEN or not WHATSAPP_PHONE_NUMBER_ID:
-        from fastapi import HTTPException
         logger.error("WhatsApp API Keys missing.")
         raise HTTPException(status_code=500, detail="WhatsApp API Keys missing. Please configure WHATSAPP_TOKEN and WHATSAPP_PHONE_NUMBER_ID in your environment variables.")
 
-    url = f"https://graph.facebook.com/{WHATSAPP_API_VERSION}/{WHATSAPP_PHONE_NUMBER_ID}/messages"
+def message_id_from_response(response) -> Optional[str]:
+    """
+    Extracts the `wamid` of a sent message from a Cloud API send response.
+    """
+    try:
+        return response["messages"][0]["id"]
+    except (KeyError, IndexError, TypeError):
+        return None
+
+def _messages_url(sender: Optional[WhatsAppSender] = None) -> str:
+    phone_number_id = sender.phone_number_id if sender else WHATSAPP_PHONE_NUMBER_ID
+    return f"{WHATSAPP_API_BASE_URL}/{WHATSAPP_API_VERSION}/{phone_number_id}/messages"
+
+def _auth_headers(token: Optional[str] = None) -> Dict[str, str]:
+    return {"Authorization": f"Bearer {token or WHATSAPP_TOKEN}"}
+
+async def _post_message(payload: Dict[str, Any], sender: Optional[WhatsAppSender] = None):
+    url = _messages_url(sender)
+    headers = {**_auth_headers(sender.token if sender else None), "Content-Type": "application/json"}
     
-    headers = {
-        "Authorization": f"Bearer {WHATSAPP_TOKEN}",
-        "Content-Type": "application/json"
-    }
+    try:
+        response = await get_http_client(url).post(url, json=payload, headers=headers)
+        response.raise_for_status()
+        return response.json()
+    except httpx.HTTPStatusError as e:
+        logger.error(f"WhatsApp API Error: {e.response.text}")
+        raise HTTPException(status_code=500, detail=f"Failed to send WhatsApp message. Meta API responded with error.")
+    except Exception as e:
+        logger.error(f"Unknown WhatsApp Error: {e}")
+        raise HTTPException(status_code=500, detail="Failed to connect to Meta API.")
+
+async def send_whatsapp_message(to_number: str, message_text: str, sender: Optional[WhatsAppSender] = None):
+    """
+    Sends a simple text message via WhatsApp Cloud API, from `sender` (a business
+    number connected by a user) or else from the globally configured number.
+    """
+    if sender is None:
+        ensure_whatsapp_configured()
     
     payload = {
         "messaging_product": "whatsapp",
@@ -31,24 +85,181 @@ async def send_whatsapp_message(to_number: str, message_text: str):
         "type": "text",
         "text": {"body": message_text}
     }
+    return await _post_message(payload, sender)
+
+async def fetch_phone_number(phone_number_id: str, access_token: str) -> str:
+    """
+    Reads a business number from the Graph API with the caller's own access token and
+    returns its display number. Meta only answers for tokens granted on the WhatsApp
+    Business Account that owns the number, so this proves the caller controls it.
+    """
+    url = f"{WHATSAPP_API_BASE_URL}/{WHATSAPP_API_VERSION}/{phone_number_id}"
+    try:
+        response = await get_http_client(url).get(
+            url, params={"fields": "display_phone_number"}, headers=_auth_headers(access_token)
+        )
+        response.raise_for_status()
+        return response.json()["display_phone_number"]
+    except httpx.HTTPStatusError as e:
+        logger.warning(f"WhatsApp number lookup rejected: {e.response.text}")
+        raise HTTPException(status_code=403, detail="Meta did not confirm that this access token can use this WhatsApp number.")
+    except Exception as e:
+        logger.error(f"Unknown WhatsApp number lookup error: {e}")
+        raise HTTPException(status_code=500, detail="Failed to connect to Meta API.")
+
+async def send_whatsapp_template(
+    to_number: str,
+    template_name: str,
+    language_code: str = "en_US",
+    components: Optional[List[Dict[str, Any]]] = None,
+):
+    """
+    Sends a pre-approved WhatsApp template (the only thing Meta allows outside the
+    24h customer service window). `components` carries the header/body parameters,
+    see WhatsAppTemplateMessage for building them.
+    """
+    ensure_whatsapp_configured()
     
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.post(url, json=payload, headers=headers)
+    template: Dict[str, Any] = {"name": template_name, "language": {"code": language_code}}
+    if components:
+        template["components"] = components
+    payload = {
+        "messaging_product": "whatsapp",
+        "to": to_number,
+        "type": "template",
+        "template": template,
+    }
+    return await _post_message(payload)
+
+async def upload_whatsapp_media(content: bytes, mime_type: str, filename: str = "media") -> str:
+    """
+    Uploads media to the Cloud API and returns its media id, reusable in any number of sends.
+    """
+    ensure_whatsapp_configured()
+    url = f"{WHATSAPP_API_BASE_URL}/{WHATSAPP_API_VERSION}/{WHATSAPP_PHONE_NUMBER_ID}/media"
+    try:
+        response = await get_http_client(url).post(
+            url,
+            headers=_auth_headers(),
+            data={"messaging_product": "whatsapp", "type": mime_type},
+            files={"file": (filename, content, mime_type)},
+        )
+        response.raise_for_status()
+        return response.json()["id"]
+    except httpx.HTTPStatusError as e:
+        logger.error(f"WhatsApp media upload error: {e.response.text}")
+        raise HTTPException(status_code=500, detail="Failed to upload WhatsApp media. Meta API responded with error.")
+    except Exception as e:
+        logger.error(f"Unknown WhatsApp media upload error: {e}")
+        raise HTTPException(status_code=500, detail="Failed to connect to Meta API.")
+
+def _invalid_media_url(reason: str) -> HTTPException:
+    return HTTPException(status_code=400, detail=f"header_image_url {reason}.")
+
+def _media_host_allowed(host: str) -> bool:
+    allowed = [h.strip().lower() for h in settings.WHATSAPP_MEDIA_ALLOWED_HOSTS.split(",") if h.strip()]
+    return not allowed or any(host == h or host.endswith(f".{h}") for h in allowed)
+
+async def resolve_media_url(media_url: str) -> Tuple[str, str]:
+    """
+    Checks that a client-supplied media URL is https on a host that resolves only to public
+    addresses (no loopback, private, link-local/cloud metadata or reserved ranges) and
+    returns (host, address). The fetch connects to that address, so a DNS answer that
+    changes between the check and the fetch can't redirect it.
+    """
+    parts = urlsplit(media_url)
+    host = (parts.hostname or "").lower()
+    if parts.scheme != "https" or not host or parts.username or parts.password:
+        raise _invalid_media_url("must be an https URL")
+    if not _media_host_allowed(host):
+        raise _invalid_media_url("host is not allowed")
+    try:
+        infos = await asyncio.get_running_loop().getaddrinfo(host, parts.port or 443, type=socket.SOCK_STREAM)
+    except (socket.gaierror, ValueError):
+        raise _invalid_media_url("host could not be resolved")
+    addresses = sorted({info[4][0].split("%")[0] for info in infos})
+    if not addresses or not all(ipaddress.ip_address(address).is_global for address in addresses):
+        raise _invalid_media_url("must point to a public address")
+    return host, addresses[0]
+
+async def _fetch_media(media_url: str) -> Tuple[bytes, str]:
+    host, address = await resolve_media_url(media_url)
+    parts = urlsplit(media_url)
+    netloc = f"[{address}]" if ":" in address else address
+    pinned_url = parts._replace(netloc=f"{netloc}:{parts.port}" if parts.port else netloc).geturl()
+
+    # A one-off client: arbitrary hosts must not get a pooled client in services/http_client.py
+    async with httpx.AsyncClient(timeout=settings.WHATSAPP_MEDIA_FETCH_TIMEOUT_SECONDS, follow_redirects=False) as client:
+        async with client.stream(
+            "GET", pinned_url, headers={"Host": parts.netloc}, extensions={"sni_hostname": host},
+        ) as response:
             response.raise_for_status()
-            return response.json()
-        except httpx.HTTPStatusError as e:
-            logger.error(f"WhatsApp API Error: {e.response.text}")
-            from fastapi import HTTPException
-            raise HTTPException(status_code=500, detail=f"Failed to send WhatsApp message. Meta API responded with error.")
-        except Exception as e:
-            logger.error(f"Unknown WhatsApp Error: {e}")
-            from fastapi import HTTPException
-            raise HTTPException(status_code=500, detail="Failed to connect to Meta API.")
-
-async def send_whatsapp_template(to_number: str, template_name: str, language_code: str = "en_US"):
-    """
-    Sends a pre-approved WhatsApp template.
-    """
-    # Implementation similar to text format
-    pass
+            mime_type = response.headers.get("content-type", "image/jpeg").split(";")[0].strip()
+            if not mime_type.startswith("image/"):
+                raise _invalid_media_url(f"is not an image ({mime_type})")
+            if int(response.headers.get("content-length") or 0) > settings.WHATSAPP_MEDIA_MAX_BYTES:
+                raise _invalid_media_url("image is too large")
+            chunks, size = [], 0
+            async for chunk in response.aiter_bytes():
+                size += len(chunk)
+                if size > settings.WHATSAPP_MEDIA_MAX_BYTES:
+                    raise _invalid_media_url("image is too large")
+                chunks.append(chunk)
+    return b"".join(chunks), mime_type
+
+async def _upload_media_from_url(media_url: str) -> str:
+    try:
+        content, mime_type = await asyncio.wait_for(_fetch_media(media_url), settings.WHATSAPP_MEDIA_FETCH_TIMEOUT_SECONDS)
+    except HTTPException:
+        raise
+    except asyncio.TimeoutError:
+        logger.error(f"Timed out fetching WhatsApp header media {media_url}")
+        raise HTTPException(status_code=500, detail="Timed out fetching header_image_url.")
+    except httpx.HTTPStatusError as e:
+        logger.error(f"Header media fetch error: {media_url} responded {e.response.status_code}")
+        raise HTTPException(status_code=500, detail="Failed to fetch header_image_url.")
+    except Exception as e:
+        logger.error(f"Unknown header media fetch error for {media_url}: {e}")
+        raise HTTPException(status_code=500, detail="Failed to fetch header_image_url.")
+    filename = media_url.rsplit("/", 1)[-1].split("?")[0] or "media"
+    media_id = await upload_whatsapp_media(content, mime_type, filename)
+    logger.info(f"Uploaded WhatsApp header media {media_url} as {media_id}")
+    return media_id
+
+async def get_media_id(media_url: str) -> str:
+    """
+    Media id for a header image/document URL, uploaded on first use and then cached
+    (uploaded media stays valid on Meta's side for 30 days). Concurrent first sends
+    share one upload.
+    """
+    key = hashlib.sha256(f"{WHATSAPP_PHONE_NUMBER_ID}\n{media_url}".encode()).hexdigest()
+    media_id, _ = await media_cache.get_or_generate(key, lambda: _upload_media_from_url(media_url))
+    return media_id
+
+class WhatsAppTemplateMessage:
+    """
+    A template send prepared once per campaign: body parameters are compiled contact
+    templates (services/templating.py) and the header image is uploaded once and
+    referenced by media id for every recipient.
+    """
+    def __init__(
+        self, template_name: str, language_code: str = "en_US",
+        body_parameters: Sequence[str] = (), header_image_url: Optional[str] = None,
+    ):
+        self.template_name = template_name
+        self.language_code = language_code
+        self.header_image_url = header_image_url
+        self.parameters = [compile_template(p) for p in body_parameters]
+        self.fields = tuple(dict.fromkeys(f for t in self.parameters for f in t.fields))
+
+    async def send(self, to_number: str, fields: Optional[Mapping[str, Any]] = None):
+        components: List[Dict[str, Any]] = []
+        if self.header_image_url:
+            media_id = await get_media_id(self.header_image_url)
+            components.append({"type": "header", "parameters": [{"type": "image", "image": {"id": media_id}}]})
+        if self.parameters:
+            components.append({
+                "type": "body",
+                "parameters": [{"type": "text", "text": t.render(fields)} for t in self.parameters],
+            })
+        return await send_whatsapp_template(to_number, self.template_name, self.language_code, components)
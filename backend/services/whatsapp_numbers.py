@@ -0,0 +1,119 @@
+import asyncio
+import logging
+from typing import Any, Dict, Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from core.config import settings
+from core.phone import normalize_e164
+from database import AsyncSessionLocal
+from models.user import User
+from models.whatsapp_number import WhatsAppNumber
+from services.whatsapp import WhatsAppSender
+
+logger = logging.getLogger(__name__)
+
+class WhatsAppRoutingTable:
+    """
+    In-process map from Meta phone_number_id (and E.164 display number) to the owning
+    user id, so routing an inbound message needs no database round trip. Verified numbers
+    also map to the sender their replies go out from.
+
+    The whole whatsapp_numbers table is loaded at startup and swapped in atomically on
+    refresh. This worker refreshes right after its own registry writes; other workers pick
+    changes up within WHATSAPP_ROUTES_REFRESH_SECONDS.
+    """
+    def __init__(self):
+        self._by_phone_number_id: Dict[str, int] = {}
+        self._by_display_number: Dict[str, int] = {}
+        self._senders: Dict[str, WhatsAppSender] = {}
+        # Demo/MVP fallback for unregistered numbers: the first active user
+        self._fallback_owner_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {"refreshes": 0, "hits": 0, "display_hits": 0, "fallbacks": 0, "misses": 0}
+
+    async def refresh(self, db: AsyncSession) -> None:
+        result = await db.execute(
+            select(
+                WhatsAppNumber.phone_number_id, WhatsAppNumber.display_phone_number,
+                WhatsAppNumber.owner_id, WhatsAppNumber.access_token,
+            )
+        )
+        by_phone_number_id: Dict[str, int] = {}
+        by_display_number: Dict[str, int] = {}
+        senders: Dict[str, WhatsAppSender] = {}
+        for phone_number_id, display_phone_number, owner_id, access_token in result.all():
+            by_phone_number_id[phone_number_id] = owner_id
+            by_display_number[display_phone_number] = owner_id
+            if access_token:
+                senders[phone_number_id] = WhatsAppSender(phone_number_id, access_token)
+
+        self._by_phone_number_id = by_phone_number_id
+        self._by_display_number = by_display_number
+        self._senders = senders
+        await self.load_fallback(db)
+        self.stats["refreshes"] += 1
+
+    async def load_fallback(self, db: AsyncSession) -> Optional[int]:
+        """
+        (Re)loads the demo fallback owner. Also called on a routing miss while there is
+        none yet, so the first user to sign up is picked up without waiting for a refresh.
+        """
+        result = await db.execute(select(User.id).where(User.is_active == True).order_by(User.id).limit(1))
+        self._fallback_owner_id = result.scalar()
+        return self._fallback_owner_id
+
+    def resolve(self, phone_number_id: Optional[str], display_phone_number: Optional[str] = None) -> Optional[int]:
+        """Owner user id for the business number a webhook message was sent to."""
+        owner_id = self._by_phone_number_id.get(phone_number_id or "")
+        if owner_id is not None:
+            self.stats["hits"] += 1
+            return owner_id
+
+        if display_phone_number:
+            try:
+                owner_id = self._by_display_number.get(normalize_e164(display_phone_number))
+            except ValueError:
+                owner_id = None
+            if owner_id is not None:
+                self.stats["display_hits"] += 1
+                return owner_id
+
+        if self._fallback_owner_id is not None:
+            self.stats["fallbacks"] += 1
+        else:
+            self.stats["misses"] += 1
+        return self._fallback_owner_id
+
+    def sender(self, phone_number_id: Optional[str]) -> Optional[WhatsAppSender]:
+        """
+        The verified number to reply from, for a message sent to `phone_number_id`; None
+        means the globally configured number.
+        """
+        return self._senders.get(phone_number_id or "")
+
+    async def start(self) -> None:
+        async with AsyncSessionLocal() as db:
+            await self.refresh(db)
+        self._task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _refresh_loop(self) -> None:
+        while True:
+            await asyncio.sleep(settings.WHATSAPP_ROUTES_REFRESH_SECONDS)
+            try:
+                async with AsyncSessionLocal() as db:
+                    await self.refresh(db)
+            except Exception as e:
+                logger.error(f"Failed to refresh WhatsApp routing table: {e}")
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {**self.stats, "numbers": len(self._by_phone_number_id)}
+
+whatsapp_routes = WhatsAppRoutingTable()
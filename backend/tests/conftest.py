@@ -0,0 +1,89 @@
+"""
+Shared fixtures. The app reads its settings from the environment at import time, so the
+test database and settings are set up before main is imported.
+
+    cd backend && python -m pytest
+
+Benchmarks (tests marked `bench`) are skipped unless asked for; -s shows their figures:
+
+    cd backend && python -m pytest --bench -s -m bench
+"""
+import os
+import sys
+import uuid
+import tempfile
+
+_db_dir = tempfile.mkdtemp(prefix="bharatmarketer-tests-")
+os.environ.update(
+    DATABASE_URL=f"sqlite+aiosqlite:///{_db_dir}/test.db",
+    RATE_LIMIT_ENABLED="false",
+    OPENAI_API_KEY="test-key",
+    RAZORPAY_KEY_ID="rzp_test",
+    RAZORPAY_KEY_SECRET="rzp_secret",
+    STRIPE_WEBHOOK_SECRET="whsec_test",
+    PAYMENT_EVENT_BATCH_SECONDS="0",
+)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import update
+
+import main
+from database import AsyncSessionLocal
+from models.user import User
+from tests.fake_graph import FakeGraphAPI
+
+def pytest_addoption(parser):
+    parser.addoption("--bench", action="store_true", help="also run the benchmarks (tests marked bench)")
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "bench: throughput benchmark, only run with --bench")
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption("--bench"):
+        return
+    skip = pytest.mark.skip(reason="benchmark: run with --bench")
+    for item in items:
+        if "bench" in item.keywords:
+            item.add_marker(skip)
+
+@pytest.fixture(scope="session")
+def client():
+    with TestClient(main.app) as c:
+        yield c
+
+def run(client, fn, *args):
+    """Runs a coroutine function on the app's event loop."""
+    return client.portal.call(fn, *args)
+
+def register_user(client):
+    """Registers and logs in a new user: (id, auth headers)."""
+    email = f"{uuid.uuid4().hex[:12]}@example.com"
+    user_id = client.post("/api/v1/auth/register", json={"email": email, "password": "secret-pw"}).json()["id"]
+    token = client.post("/api/v1/auth/login", data={"username": email, "password": "secret-pw"}).json()["access_token"]
+    return user_id, {"Authorization": f"Bearer {token}"}
+
+@pytest.fixture
+def user(client):
+    """A fresh registered user: (id, auth headers)."""
+    return register_user(client)
+
+def set_user(client, user_id: int, **values) -> None:
+    async def _set():
+        async with AsyncSessionLocal() as db:
+            await db.execute(update(User).where(User.id == user_id).values(**values))
+            await db.commit()
+    run(client, _set)
+
+@pytest.fixture
+def fake_graph(monkeypatch):
+    """services/whatsapp.py pointed at a running FakeGraphAPI."""
+    import services.whatsapp as whatsapp
+
+    graph = FakeGraphAPI().start()
+    monkeypatch.setattr(whatsapp, "WHATSAPP_API_BASE_URL", graph.url)
+    monkeypatch.setattr(whatsapp, "WHATSAPP_TOKEN", "test-token")
+    monkeypatch.setattr(whatsapp, "WHATSAPP_PHONE_NUMBER_ID", "pn-fake")
+    yield graph
+    graph.stop()
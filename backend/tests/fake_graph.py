@@ -0,0 +1,57 @@
+"""
+A local fake of the Meta Graph API. Point services/whatsapp.py at it with the
+`fake_graph` fixture (tests/conftest.py).
+"""
+import asyncio
+import time
+import uuid
+from collections import Counter
+from typing import List
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+from tests.servers import BackgroundServer
+
+class FakeGraphAPI(BackgroundServer):
+    """
+    Accepts message sends and media uploads, answering after `latency` seconds.
+    Counts what it received and when, so a test can check how many sends and uploads a
+    run made and the rate they arrived at. Sends to a number in `failing_numbers` are
+    rejected the way Meta rejects an invalid recipient.
+    """
+    def __init__(self, latency: float = 0.0, failing_numbers=()):
+        self.latency = latency
+        self.failing_numbers = set(failing_numbers)
+        self.sends: Counter = Counter()  # message type -> count
+        self.recipients: List[str] = []
+        self.uploads = 0
+        self.send_times: List[float] = []
+        super().__init__(Starlette(routes=[
+            Route("/{version}/{phone_number_id}/messages", self._messages, methods=["POST"]),
+            Route("/{version}/{phone_number_id}/media", self._media, methods=["POST"]),
+        ]))
+
+    async def _messages(self, request: Request):
+        payload = await request.json()
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if payload["to"] in self.failing_numbers:
+            return JSONResponse({"error": {"message": "(#131026) Message undeliverable", "code": 131026}}, status_code=400)
+        self.sends[payload["type"]] += 1
+        self.recipients.append(payload["to"])
+        self.send_times.append(time.monotonic())
+        return JSONResponse({"messaging_product": "whatsapp", "messages": [{"id": f"wamid.{uuid.uuid4().hex}"}]})
+
+    async def _media(self, request: Request):
+        await request.body()
+        self.uploads += 1
+        return JSONResponse({"id": f"media-{uuid.uuid4().hex}"})
+
+    def messages_per_second(self) -> float:
+        """Rate the sends arrived at, from the first to the last."""
+        if len(self.send_times) < 2:
+            return 0.0
+        return (len(self.send_times) - 1) / (self.send_times[-1] - self.send_times[0])
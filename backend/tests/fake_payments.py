@@ -0,0 +1,49 @@
+"""
+A local fake of the Stripe and Razorpay APIs. Point services/payments.py at it with the
+`fake_payments` fixture (tests/test_payments.py).
+"""
+import asyncio
+import uuid
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+from tests.servers import BackgroundServer
+
+class FakePaymentGateways(BackgroundServer):
+    """
+    Creates Stripe checkout sessions and Razorpay subscriptions, answering after `latency`
+    seconds like a slow gateway would. Both APIs share one server; counts what it created.
+    """
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.checkout_sessions = 0
+        self.subscriptions = 0
+        super().__init__(Starlette(routes=[
+            Route("/v1/checkout/sessions", self._checkout_session, methods=["POST"]),
+            Route("/v1/subscriptions", self._subscription, methods=["POST"]),
+        ]))
+
+    async def _checkout_session(self, request: Request):
+        await request.form()
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.checkout_sessions += 1
+        session_id = f"cs_test_{uuid.uuid4().hex}"
+        return JSONResponse({
+            "id": session_id, "object": "checkout.session",
+            "url": f"https://checkout.stripe.com/c/pay/{session_id}",
+        })
+
+    async def _subscription(self, request: Request):
+        await request.json()
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.subscriptions += 1
+        subscription_id = f"sub_{uuid.uuid4().hex[:14]}"
+        return JSONResponse({
+            "id": subscription_id, "entity": "subscription", "status": "created",
+            "short_url": f"https://rzp.io/i/{subscription_id}",
+        })
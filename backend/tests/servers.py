@@ -0,0 +1,32 @@
+"""
+Local fakes of the external APIs the backend calls, served over real HTTP from a
+background thread so requests go through the same clients and connection pools as in
+production.
+"""
+import socket
+import threading
+import time
+from typing import Optional
+
+import uvicorn
+
+class BackgroundServer:
+    """Serves an ASGI app on a free local port from a daemon thread; `url` is its base URL."""
+    def __init__(self, app):
+        self._sock = socket.socket()
+        self._sock.bind(("127.0.0.1", 0))
+        self.url = f"http://127.0.0.1:{self._sock.getsockname()[1]}"
+        self._server = uvicorn.Server(uvicorn.Config(app, log_level="warning", lifespan="off"))
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.run, kwargs={"sockets": [self._sock]}, daemon=True)
+        self._thread.start()
+        while not self._server.started:
+            time.sleep(0.01)
+        return self
+
+    def stop(self) -> None:
+        self._server.should_exit = True
+        if self._thread:
+            self._thread.join(timeout=5)
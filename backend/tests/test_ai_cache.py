@@ -0,0 +1,89 @@
+import asyncio
+
+from services.ai_cache import ResponseCache
+
+def test_followers_take_over_when_the_leader_is_cancelled():
+    cache = ResponseCache(max_entries=10, ttl=60)
+    calls = []
+
+    async def generate():
+        calls.append(len(calls))
+        await asyncio.sleep(0.1)
+        return f"copy #{len(calls)}"
+
+    async def scenario():
+        leader = asyncio.create_task(cache.get_or_generate("key", generate))
+        await asyncio.sleep(0.01)
+        followers = [asyncio.create_task(cache.get_or_generate("key", generate)) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        leader.cancel()  # e.g. its client disconnected
+        return await asyncio.gather(*followers, return_exceptions=True)
+
+    results = asyncio.run(scenario())
+    # one follower generated again, the others shared its call
+    assert len(calls) == 2
+    assert sorted(results, key=lambda r: r[1]) == [("copy #2", False), ("copy #2", False), ("copy #2", True)]
+
+def fake_stream(tokens, started, closed):
+    async def stream():
+        started.append(1)
+        try:
+            for token in tokens:
+                await asyncio.sleep(0.02)
+                yield token
+        finally:
+            closed.append(1)
+    return stream
+
+def test_concurrent_streams_share_one_upstream_call():
+    cache = ResponseCache(max_entries=10, ttl=60)
+    started, closed, settled = [], [], []
+
+    async def on_done(generated):
+        settled.append(generated)
+
+    async def read(tokens, leave_after=None):
+        parts = []
+        async for token in tokens:
+            parts.append(token)
+            if len(parts) == leave_after:
+                await tokens.aclose()  # this client disconnected
+                break
+        return "".join(parts)
+
+    async def scenario():
+        start = fake_stream(["Shubh ", "Deepavali ", "sale!"], started, closed)
+        leader, called = cache.stream("key", start, on_done)
+        assert called
+        leaving = asyncio.create_task(read(leader, leave_after=2))
+        await asyncio.sleep(0.03)  # a follower joins after the first token
+        follower, called = cache.stream("key", start)
+        assert not called
+        results = await asyncio.gather(leaving, read(follower))
+        value, called = await cache.get_or_generate("key", lambda: None)
+        return results, value, called
+
+    (left, followed), value, called = asyncio.run(scenario())
+    assert len(started) == 1 and len(closed) == 1
+    # the leader's client leaving doesn't cut the stream short for the follower
+    assert (left, followed) == ("Shubh Deepavali ", "Shubh Deepavali sale!")
+    assert (value, called) == ("Shubh Deepavali sale!", False)
+    assert settled == [True]
+
+def test_a_stream_everyone_left_is_cancelled_and_not_cached():
+    cache = ResponseCache(max_entries=10, ttl=60)
+    started, closed, settled = [], [], []
+
+    async def on_done(generated):
+        settled.append(generated)
+
+    async def scenario():
+        tokens, _ = cache.stream("key", fake_stream(["a", "b", "c"] * 50, started, closed), on_done)
+        await tokens.__anext__()
+        await tokens.aclose()
+        await asyncio.sleep(0.05)
+        return await cache.get("key")
+
+    assert asyncio.run(scenario()) is None
+    assert closed == [1]
+    assert settled == [True]  # tokens went out: the credit is kept
@@ -0,0 +1,201 @@
+import asyncio
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import func, update
+from sqlalchemy.future import select
+
+import routers.ai as ai_router
+from database import AsyncSessionLocal
+from core.config import settings
+from models.credit import CreditLedgerEntry, CreditReservation
+from models.user import User
+from services.credits import CreditReservoir
+from tests.conftest import run, set_user
+
+def balance(client, user_id):
+    async def _balance():
+        async with AsyncSessionLocal() as db:
+            credits = (await db.execute(select(User.ai_credits_remaining).where(User.id == user_id))).scalar_one()
+            entries = (await db.execute(
+                select(func.count()).select_from(CreditLedgerEntry).where(CreditLedgerEntry.user_id == user_id)
+            )).scalar_one()
+            return credits, entries
+    return run(client, _balance)
+
+def copy_request(**overrides):
+    return {"prompt": f"Diwali sale {uuid.uuid4().hex}", "language": "Hindi", "tone": "Persuasive", **overrides}
+
+@pytest.fixture
+def model(monkeypatch):
+    calls = []
+
+    async def generate(prompt, language, tone):
+        calls.append(prompt)
+        return model.reply
+
+    async def stream(prompt, language, tone):
+        calls.append(prompt)
+        for token in model.tokens:
+            if isinstance(token, Exception):
+                raise token
+            yield token
+
+    model.reply, model.tokens, model.calls = "Shubh Deepavali!", ["Shubh ", "Deepavali!"], calls
+    monkeypatch.setattr(ai_router, "generate_marketing_copy", generate)
+    monkeypatch.setattr(ai_router, "stream_marketing_copy", stream)
+    return model
+
+def test_generated_copy_takes_one_credit_and_repeats_are_free(client, user, model):
+    user_id, headers = user
+    before, _ = balance(client, user_id)
+    body = copy_request()
+
+    first = client.post("/api/v1/ai/generate-copy", json=body, headers=headers)
+    again = client.post("/api/v1/ai/generate-copy", json=body, headers=headers)
+
+    assert first.json() == {"status": "success", "content": "Shubh Deepavali!", "cached": False}
+    assert again.json()["cached"] is True
+    assert len(model.calls) == 1
+    assert balance(client, user_id)[0] == before - 1
+
+def test_no_credits_is_refused_even_if_the_cached_user_says_otherwise(client, user, model):
+    user_id, headers = user
+    # Cache the user with a positive balance (the repeat is a cache hit, so nothing
+    # invalidates it afterwards), then empty the balance behind the cache's back
+    body = copy_request()
+    client.post("/api/v1/ai/generate-copy", json=body, headers=headers)
+    client.post("/api/v1/ai/generate-copy", json=body, headers=headers)
+    set_user(client, user_id, ai_credits_remaining=0)
+
+    response = client.post("/api/v1/ai/generate-copy", json=copy_request(), headers=headers)
+
+    assert response.status_code == 403
+    assert len(model.calls) == 1
+    assert balance(client, user_id)[0] == 0
+
+def test_failed_generation_is_refunded(client, user, model):
+    user_id, headers = user
+    before, entries = balance(client, user_id)
+    model.reply = None
+
+    response = client.post("/api/v1/ai/generate-copy", json=copy_request(), headers=headers)
+
+    assert response.status_code == 500
+    # A debit and its refund, both in the ledger
+    assert balance(client, user_id) == (before, entries + 2)
+
+def test_stream_charges_once_tokens_flow(client, user, model):
+    user_id, headers = user
+    before, _ = balance(client, user_id)
+
+    response = client.post("/api/v1/ai/generate-copy", json=copy_request(stream=True), headers=headers)
+
+    assert "Deepavali" in response.text and "event: done" in response.text
+    assert balance(client, user_id)[0] == before - 1
+
+def test_stream_failing_before_the_first_token_is_refunded(client, user, model):
+    user_id, headers = user
+    before, _ = balance(client, user_id)
+    model.tokens = [RuntimeError("upstream reset")]
+
+    response = client.post("/api/v1/ai/generate-copy", json=copy_request(stream=True), headers=headers)
+
+    assert "event: error" in response.text
+    assert balance(client, user_id)[0] == before
+
+def test_stream_without_credits_is_refused_before_streaming(client, user, model):
+    user_id, headers = user
+    set_user(client, user_id, ai_credits_remaining=0)
+
+    response = client.post("/api/v1/ai/generate-copy", json=copy_request(stream=True), headers=headers)
+
+    assert response.status_code == 403
+    assert model.calls == []
+
+def ledger(client, user_id, reason):
+    """Sum of the user's ledger deltas, and how many entries have `reason`."""
+    async def _ledger():
+        async with AsyncSessionLocal() as db:
+            total = (await db.execute(
+                select(func.coalesce(func.sum(CreditLedgerEntry.delta), 0)).where(CreditLedgerEntry.user_id == user_id)
+            )).scalar_one()
+            count = (await db.execute(
+                select(func.count()).select_from(CreditLedgerEntry)
+                .where(CreditLedgerEntry.user_id == user_id, CreditLedgerEntry.reason == reason)
+            )).scalar_one()
+            return total, count
+    return run(client, _ledger)
+
+@pytest.fixture
+def reservoir(monkeypatch):
+    """A credit meter of its own (another worker), reserving blocks from the first credit."""
+    monkeypatch.setattr(settings, "CREDIT_RESERVE_AFTER", 0)
+    monkeypatch.setattr(settings, "CREDIT_RESERVATION_BLOCK", 25)
+    return CreditReservoir()
+
+def test_thousands_of_parallel_deductions_leave_the_exact_balance(client, user, reservoir):
+    user_id, _ = user
+    set_user(client, user_id, ai_credits_remaining=2000)
+    ledger_before, _ = ledger(client, user_id, "stress")
+
+    async def deduct(i):
+        async with AsyncSessionLocal() as db:
+            if not await reservoir.consume(db, user_id, "stress", f"msg-{i}"):
+                return 0
+            if i % 10 == 0:  # the work failed
+                await asyncio.sleep(0)
+                await reservoir.refund(db, user_id, reference=f"msg-{i}")
+                return 0
+            return 1
+
+    async def flusher(done):
+        while not done.is_set():
+            await reservoir.flush()
+            await asyncio.sleep(0.01)
+
+    async def scenario():
+        done = asyncio.Event()
+        flushing = asyncio.create_task(flusher(done))
+        used = await asyncio.gather(*(deduct(i) for i in range(3000)))
+        done.set()
+        await flushing
+        await reservoir.reconcile()
+        return sum(used)
+
+    used = run(client, scenario)
+    credits, _ = balance(client, user_id)
+    ledger_after, entries = ledger(client, user_id, "stress")
+
+    # More was asked for than there was: no credit was handed out twice or lost
+    assert used > 1500
+    assert credits == 2000 - used
+    assert ledger_after - ledger_before == -used
+    # Every credit used has its own entry (refunded ones that were already flushed, plus their refund)
+    assert entries - ledger(client, user_id, "refund")[1] == used
+    assert reservoir.stats["reservations"] > 1 and reservoir.snapshot()["outstanding"] == 0
+
+def test_a_dead_workers_reservation_is_returned(client, user, reservoir):
+    user_id, _ = user
+    set_user(client, user_id, ai_credits_remaining=100)
+
+    async def crash():
+        async with AsyncSessionLocal() as db:
+            for i in range(5):
+                assert await reservoir.consume(db, user_id, "agent_reply", f"wamid.{i}")
+        await reservoir.flush()
+        assert await reservoir.consume(db, user_id, "agent_reply", "wamid.unflushed")
+        # ... and the worker dies, its reservation no longer refreshed
+        async with AsyncSessionLocal() as db:
+            await db.execute(
+                update(CreditReservation).where(CreditReservation.worker_id == reservoir.worker_id)
+                .values(updated_at=datetime.utcnow() - timedelta(hours=1))
+            )
+            await db.commit()
+        return await CreditReservoir().release_abandoned()
+
+    assert run(client, crash) == 20
+    # The flushed uses stay used and recorded; the unflushed one is given back with the rest
+    assert balance(client, user_id)[0] == 95
+    assert ledger(client, user_id, "agent_reply")[1] == 5
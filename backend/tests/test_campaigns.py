@@ -0,0 +1,78 @@
+import asyncio
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert
+from sqlalchemy.future import select
+
+import services.campaigns as campaigns
+import services.whatsapp as whatsapp
+from core.config import settings
+from database import AsyncSessionLocal
+from models.campaign import Campaign, CampaignRecipient
+from services.campaigns import CampaignWorker, enqueue_campaign
+from tests.conftest import run
+
+def test_a_batch_that_outlasts_its_lease_is_not_taken_over(client, user, monkeypatch):
+    user_id, _ = user
+    monkeypatch.setattr(settings, "CAMPAIGN_LEASE_SECONDS", 1)
+    sends = []
+
+    async def slow_send(recipient, text):
+        sends.append(recipient)
+        await asyncio.sleep(2)  # rate limited and retried well past the lease
+        return {"messages": [{"id": f"wamid.{recipient}"}]}
+    monkeypatch.setattr(campaigns, "send_whatsapp_message", slow_send)
+
+    async def scenario():
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                insert(Campaign).values(owner_id=user_id, channel="whatsapp", body="Hi", total_recipients=1).returning(Campaign.id)
+            )
+            campaign_id = result.scalar_one()
+            await db.execute(insert(CampaignRecipient).values(
+                campaign_id=campaign_id, recipient="919800000001", status="pending",
+                attempts=0, next_attempt_at=datetime.utcnow() - timedelta(seconds=1),
+            ))
+            await db.commit()
+
+        sending = asyncio.create_task(CampaignWorker("first").run_once())
+        await asyncio.sleep(1.5)
+        _, taken = await CampaignWorker("second")._lease_batch()
+        leased = await sending
+
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(select(CampaignRecipient.status).where(CampaignRecipient.campaign_id == campaign_id))
+            return leased, [row.campaign_id for row in taken], campaign_id, result.scalars().all()
+
+    leased, taken, campaign_id, statuses = run(client, scenario)
+    assert leased == 1
+    assert campaign_id not in taken
+    assert statuses == ["sent"]
+    assert sends == ["919800000001"]
+
+def test_template_campaigns_upload_their_header_image_once(client, user, fake_graph, monkeypatch):
+    user_id, _ = user
+    fetches = []
+
+    async def fetch_media(url):
+        fetches.append(url)
+        return b"\xff\xd8 a jpeg", "image/jpeg"
+    monkeypatch.setattr(whatsapp, "_fetch_media", fetch_media)
+    diwali, holi = (f"https://cdn.example.com/{uuid.uuid4().hex}.jpg" for _ in range(2))
+
+    async def scenario():
+        async with AsyncSessionLocal() as db:
+            for image, size in ((diwali, 30), (holi, 20), (diwali, 10)):
+                await enqueue_campaign(
+                    db, user_id, "whatsapp", [f"9196{size:02d}{i:06d}" for i in range(size)], "[template] offer",
+                    whatsapp_template={"template_name": "offer", "body_parameters": ["{{name|there}}"], "header_image_url": image},
+                )
+        worker = CampaignWorker("template-test")
+        while await worker.run_once():
+            pass
+
+    run(client, scenario)
+    # One upload per header image, however many recipients and campaigns use it
+    assert fake_graph.uploads == 2 and sorted(fetches) == sorted([diwali, holi])
+    assert fake_graph.sends["template"] == 60
@@ -0,0 +1,75 @@
+from datetime import datetime
+
+from sqlalchemy import event, update
+
+from core.config import settings
+from database import AsyncSessionLocal, engine
+from models.contact import Contact
+from tests.conftest import run
+
+def add_contact(client, headers, phone, tags):
+    response = client.post("/api/v1/contacts/", headers=headers, json={"name": phone, "phone": phone, "tags": tags})
+    assert response.status_code == 201
+    return response.json()["id"]
+
+def test_a_tag_given_both_as_tag_and_in_tags_all_still_matches(client, user):
+    _, headers = user
+    vip = add_contact(client, headers, "+919800000001", "vip,delhi")
+    add_contact(client, headers, "+919800000002", "delhi")
+
+    for params in ({"tag": "vip", "tags_all": "vip"}, {"tags_all": "vip,VIP"}, {"tag": "vip", "tags_all": "delhi,vip"}):
+        page = client.get("/api/v1/contacts/", headers=headers, params=params).json()
+        assert [c["id"] for c in page["items"]] == [vip], params
+
+def set_created_at(client, created_at):
+    async def _set():
+        async with AsyncSessionLocal() as db:
+            for contact_id, at in created_at.items():
+                await db.execute(update(Contact).where(Contact.id == contact_id).values(created_at=at))
+            await db.commit()
+    run(client, _set)
+
+def list_all(client, headers, order, limit=2):
+    ids, cursor = [], None
+    while True:
+        params = {"order": order, "limit": limit, **({"cursor": cursor} if cursor else {})}
+        response = client.get("/api/v1/contacts/", headers=headers, params=params)
+        assert response.status_code == 200
+        page = response.json()
+        ids += [c["id"] for c in page["items"]]
+        cursor = page["next_cursor"]
+        if not cursor:
+            return ids
+
+def test_contacts_without_created_at_are_paged_as_the_oldest(client, user):
+    _, headers = user
+    ids = [add_contact(client, headers, f"+91981000000{i}", "") for i in range(6)]
+    set_created_at(client, {
+        ids[0]: datetime(2026, 3, 1), ids[1]: None, ids[2]: datetime(2026, 1, 1),
+        ids[3]: None, ids[4]: datetime(2026, 3, 1), ids[5]: datetime(2026, 2, 1),
+    })
+    oldest_first = [ids[1], ids[3], ids[2], ids[5], ids[0], ids[4]]
+
+    assert list_all(client, headers, "created_at") == oldest_first
+    assert list_all(client, headers, "-created_at") == oldest_first[::-1]
+
+def test_a_full_import_batch_stays_under_sqlites_bound_variable_limit(client, user):
+    _, headers = user
+    rows = settings.CONTACT_IMPORT_BATCH_SIZE
+    csv = "name,phone\n" + "".join(f"c{i},+9197{i:08d}\n" for i in range(rows))
+    lookups = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith("SELECT contacts.phone"):
+            lookups.append(len(parameters))
+
+    event.listen(engine.sync_engine, "before_cursor_execute", record)
+    try:
+        response = client.post("/api/v1/contacts/import-csv", headers=headers, files={"file": ("contacts.csv", csv, "text/csv")})
+    finally:
+        event.remove(engine.sync_engine, "before_cursor_execute", record)
+
+    assert response.status_code == 200
+    assert response.json()["imported"] == rows
+    assert sum(lookups) == rows + len(lookups)  # every phone looked up once, plus the owner id
+    assert max(lookups) <= 999
@@ -0,0 +1,23 @@
+import pytest
+
+from database import AsyncSessionLocal
+from services.conversations import ConversationStore
+from tests.conftest import run
+
+def test_a_turn_reaches_the_window_only_once_committed(client, user):
+    user_id, _ = user
+    store = ConversationStore()
+
+    async def scenario():
+        async with AsyncSessionLocal() as db:
+            await store.record(db, user_id, "919800000002", "inbound", "Are you open today?")
+
+            async def failing_commit():
+                raise RuntimeError("database is locked")
+            db.commit = failing_commit
+            with pytest.raises(RuntimeError):
+                await store.record(db, user_id, "919800000002", "outbound", "Yes, 9 to 5!")
+            await db.rollback()
+            return await store.history(db, user_id, "919800000002")
+
+    assert run(client, scenario) == [{"role": "user", "content": "Are you open today?"}]
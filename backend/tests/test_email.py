@@ -0,0 +1,80 @@
+import asyncio
+import email
+import socket
+import time
+
+import pytest
+from aiosmtpd.controller import Controller
+
+import services.email as email_service
+from core.config import settings
+from services.email import PreparedEmail, SMTPPool, send_prepared_email
+
+class Sink:
+    """aiosmtpd handler keeping every message it accepts, after `latency` seconds per message."""
+    def __init__(self):
+        self.messages = []
+        self.latency = 0.0
+
+    async def handle_DATA(self, server, session, envelope):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.messages.append((envelope.rcpt_tos, email.message_from_bytes(envelope.content)))
+        return "250 OK"
+
+@pytest.fixture
+def smtp_sink(monkeypatch):
+    """A local SMTP server the email service sends to, through a pool of its own."""
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    sink = Sink()
+    controller = Controller(sink, hostname="127.0.0.1", port=port)
+    controller.start()
+    monkeypatch.setattr(settings, "SMTP_HOST", "127.0.0.1")
+    monkeypatch.setattr(settings, "SMTP_PORT", port)
+    monkeypatch.setattr(email_service, "smtp_pool", SMTPPool())
+    yield sink
+    controller.stop()
+
+def send_campaign(prepared, count):
+    async def scenario():
+        started = time.monotonic()
+        await asyncio.gather(*(
+            send_prepared_email(prepared, f"customer{i}@example.com", {"name": f"Customer {i}"}) for i in range(count)
+        ))
+        elapsed = time.monotonic() - started
+        await email_service.smtp_pool.close()
+        return count / elapsed
+    return asyncio.run(scenario())
+
+def test_campaign_is_delivered_personalized_over_reused_connections(smtp_sink, monkeypatch):
+    monkeypatch.setattr(settings, "SMTP_POOL_SIZE", 4)
+    monkeypatch.setattr(settings, "SMTP_MAX_MESSAGES_PER_CONNECTION", 20)
+    prepared = PreparedEmail("Diwali offers", "<p>Namaste {{name|there}},</p><p>20% off <b>today</b>.</p>")
+
+    send_campaign(prepared, 60)
+
+    assert len(smtp_sink.messages) == 60
+    for recipients, message in smtp_sink.messages:
+        name = f"Customer {recipients[0][len('customer'):].split('@')[0]}"
+        assert message["To"] == recipients[0]
+        text, html = (part.get_payload(decode=True).decode() for part in message.get_payload())
+        assert f"Namaste {name}," in text and f"<p>Namaste {name},</p>" in html
+    # 4 connections, each recycled after 20 messages
+    stats = email_service.smtp_pool.stats
+    assert stats["sent"] == 60 and stats["failures"] == 0
+    assert 3 <= stats["connects"] <= 4 + 60 // 20
+
+@pytest.mark.bench
+def test_smtp_throughput_by_pool_size(smtp_sink, monkeypatch):
+    smtp_sink.latency = 0.01  # the server's time to accept a message
+    prepared = PreparedEmail("Diwali offers", "<p>Namaste {{name|there}},</p><p>20% off <b>today</b>.</p>")
+    rates = {}
+    for pool_size in (1, 4, 8, 16):
+        monkeypatch.setattr(settings, "SMTP_POOL_SIZE", pool_size)
+        monkeypatch.setattr(email_service, "smtp_pool", SMTPPool())
+        rates[pool_size] = send_campaign(prepared, 1000)
+        print(f"\nSMTP pool of {pool_size}: {rates[pool_size]:.0f} messages/sec", end="")
+    print()
+    assert rates[4] > 2 * rates[1]
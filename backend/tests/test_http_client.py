@@ -0,0 +1,66 @@
+import asyncio
+
+import httpx
+import pytest
+
+import services.http_client as http_client
+from core.config import settings
+from services.http_client import CircuitOpenError, UpstreamClient
+
+def upstream(handler) -> UpstreamClient:
+    client = UpstreamClient("https://upstream.test")
+    client.client = httpx.AsyncClient(base_url="https://upstream.test", transport=httpx.MockTransport(handler))
+    return client
+
+def test_half_open_lets_one_trial_through_and_fails_the_rest_fast():
+    calls = []
+
+    async def handler(request):
+        calls.append(request.url.path)
+        await asyncio.sleep(0.05)
+        return httpx.Response(200)
+
+    async def scenario():
+        client = upstream(handler)
+        client.breaker.opened_at = 0  # opened long ago: half-open
+        results = await asyncio.gather(*(client.get("/ping") for _ in range(5)), return_exceptions=True)
+        after = await client.get("/ping")
+        return results, after
+
+    results, after = asyncio.run(scenario())
+    assert sum(isinstance(r, httpx.Response) for r in results) == 1
+    assert sum(isinstance(r, CircuitOpenError) for r in results) == 4
+    # The successful trial closed the circuit
+    assert after.status_code == 200 and len(calls) == 2
+
+def test_cancelled_trial_lets_the_next_one_through():
+    async def handler(request):
+        await asyncio.sleep(10)
+
+    async def scenario():
+        client = upstream(handler)
+        client.breaker.opened_at = 0
+        trial = asyncio.create_task(client.get("/ping"))
+        await asyncio.sleep(0.01)
+        trial.cancel()
+        await asyncio.gather(trial, return_exceptions=True)
+        return client.breaker.check()
+
+    assert asyncio.run(scenario()) is True
+
+def test_client_registry_is_bounded(monkeypatch):
+    monkeypatch.setattr(settings, "HTTP_MAX_UPSTREAMS", 2)
+    monkeypatch.setattr(settings, "HTTP_TIMEOUT_SECONDS", 0)
+    monkeypatch.setattr(http_client, "_clients", http_client.OrderedDict())
+
+    async def scenario():
+        first = http_client.get_http_client("https://a.test/x")
+        http_client.get_http_client("https://b.test/x")
+        http_client.get_http_client("https://a.test/y")  # a is now the most recently used
+        http_client.get_http_client("https://c.test/x")
+        await asyncio.sleep(0.01)
+        return first, list(http_client._clients)
+
+    first, origins = asyncio.run(scenario())
+    assert origins == ["https://a.test", "https://c.test"]
+    assert not first.client.is_closed
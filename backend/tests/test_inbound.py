@@ -0,0 +1,145 @@
+import asyncio
+import time
+import uuid
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import insert
+from sqlalchemy.future import select
+
+import services.inbound as inbound
+from api.deps import invalidate_user_cache
+from core.config import settings
+from database import AsyncSessionLocal
+from models.webhook import InboundWebhookEvent
+from services.inbound import inbound_pipeline
+from tests.conftest import run, set_user
+
+def test_recovery_takes_back_stale_claims_not_old_events(client):
+    long_ago = datetime.utcnow() - timedelta(hours=1)
+
+    async def scenario():
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                insert(InboundWebhookEvent).returning(InboundWebhookEvent.id),
+                [
+                    # waited in the queue for an hour, claimed just now: still being processed
+                    {"payload": "{}", "status": "processing", "received_at": long_ago, "claimed_at": datetime.utcnow()},
+                    # its worker died an hour ago
+                    {"payload": "{}", "status": "processing", "received_at": long_ago, "claimed_at": long_ago},
+                ],
+            )
+            busy_id, abandoned_id = result.scalars().all()
+            await db.commit()
+
+        await inbound_pipeline._recover()
+        await inbound_pipeline._queue.join()
+
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                select(InboundWebhookEvent.status).where(InboundWebhookEvent.id.in_((busy_id, abandoned_id))).order_by(InboundWebhookEvent.id)
+            )
+            return result.scalars().all()
+
+    assert run(client, scenario) == ["processing", "processed"]
+
+def webhook(*messages):
+    """A Meta webhook payload carrying (customer, message id, text) messages."""
+    return {"entry": [{"changes": [{"value": {
+        "metadata": {"phone_number_id": "pn-inbound-test", "display_phone_number": "15550002222"},
+        "messages": [
+            {"from": customer, "id": message_id, "type": "text", "text": {"body": text}}
+            for customer, message_id, text in messages
+        ],
+    }}]}]}
+
+@pytest.fixture
+def agent(client, user, monkeypatch):
+    """A Growth-plan business all inbound messages are routed to, with a fake model and Graph API."""
+    user_id, _ = user
+    set_user(client, user_id, subscription_tier="growth", ai_credits_remaining=1000)
+    invalidate_user_cache(user_id)
+    monkeypatch.setattr(inbound.whatsapp_routes, "resolve", lambda *numbers: user_id)
+    sends = Counter()
+    replies = defaultdict(list)  # customer -> replies, in the order they went out
+    failing = set()
+
+    async def reply(text, business_context, history):
+        return f"Re: {text}"
+
+    async def send(phone, text, sender=None):
+        if text in failing:
+            failing.discard(text)
+            raise RuntimeError("Graph API timed out")
+        sends[text] += 1
+        replies[phone].append(text)
+        return {"messages": [{"id": f"wamid.out.{uuid.uuid4().hex}"}]}
+
+    monkeypatch.setattr(inbound, "agentic_chat_response", reply)
+    monkeypatch.setattr(inbound, "send_whatsapp_message", send)
+    agent.sends, agent.replies, agent.failing = sends, replies, failing
+    return agent
+
+def drain(client):
+    run(client, inbound_pipeline._queue.join)
+
+def test_a_burst_of_redeliveries_gets_exactly_one_reply_per_message(client, agent):
+    messages = [(f"9198000{i:05d}", f"wamid.in.{uuid.uuid4().hex}", f"Question {uuid.uuid4().hex}") for i in range(3)]
+    # Meta redelivers each payload, and batches some messages together with others
+    payloads = [webhook(m) for m in messages] * 5 + [webhook(*messages)] * 5
+    for payload in payloads:
+        assert client.post("/api/v1/webhooks/whatsapp", json=payload).status_code == 200
+    drain(client)
+
+    assert agent.sends == Counter({f"Re: {text}": 1 for _, _, text in messages})
+
+def test_a_message_whose_reply_failed_is_answered_on_retry(client, agent, monkeypatch):
+    monkeypatch.setattr(settings, "WEBHOOK_RETRY_BASE_SECONDS", 0)
+    customer, message_id, text = "919800099999", f"wamid.in.{uuid.uuid4().hex}", f"Open on Sunday? {uuid.uuid4().hex}"
+    agent.failing.add(f"Re: {text}")
+
+    client.post("/api/v1/webhooks/whatsapp", json=webhook((customer, message_id, text)))
+    drain(client)
+    assert agent.sends[f"Re: {text}"] == 0
+    # the claim was released, and the retry sweep picks the event up again
+    assert run(client, inbound_pipeline.requeue_due) >= 1
+    drain(client)
+
+    assert agent.sends[f"Re: {text}"] == 1
+
+@pytest.mark.bench
+def test_batched_webhook_throughput(client, agent, user, monkeypatch):
+    set_user(client, user[0], ai_credits_remaining=100_000)
+    latency = 0.05  # a model round trip
+
+    async def reply(text, business_context, history):
+        await asyncio.sleep(latency)
+        return f"Re: {text}"
+    monkeypatch.setattr(inbound, "agentic_chat_response", reply)
+
+    # Each payload batches 4 business numbers x 5 customers x 2 messages, the way Meta does under load
+    payloads = []
+    for p in range(40):
+        payloads.append({"entry": [{"changes": [{"value": {
+            "metadata": {"phone_number_id": f"pn-bench-{n}", "display_phone_number": f"1555000{n:04d}"},
+            "messages": [
+                {"from": f"91970{p:03d}{n}{c}", "id": f"wamid.bench.{uuid.uuid4().hex}", "type": "text",
+                 "text": {"body": f"Question {m} from {p}/{n}/{c}"}}
+                for c in range(5) for m in range(2)
+            ],
+        }}]} for n in range(4)]})
+    messages = 40 * 4 * 5 * 2
+
+    started = time.monotonic()
+    for payload in payloads:
+        assert client.post("/api/v1/webhooks/whatsapp", json=payload).status_code == 200
+    drain(client)
+    rate = messages / (time.monotonic() - started)
+    print(f"\nbatched webhooks, 50 ms model latency: {rate:.0f} messages/sec answered "
+          f"(one at a time: {1 / latency:.0f}/sec)")
+
+    assert sum(agent.sends.values()) == messages
+    # Concurrent across conversations, in order within each
+    assert all(texts == sorted(texts) for texts in agent.replies.values())
+    assert rate > 3 / latency
@@ -0,0 +1,74 @@
+import uuid
+
+import pytest
+from sqlalchemy import insert
+from sqlalchemy.future import select
+
+import services.message_status as message_status_module
+from database import AsyncSessionLocal
+from models.contact import Contact
+from models.message_event import MessageEvent
+from services.message_status import message_status
+from tests.conftest import run
+
+def status_callback(message_id, recipient, state="sent", timestamp=1767225600):
+    return {"entry": [{"changes": [{"value": {
+        "metadata": {"phone_number_id": "pn-test", "display_phone_number": "15550001111"},
+        "statuses": [{"id": message_id, "status": state, "recipient_id": recipient, "timestamp": str(timestamp)}],
+    }}]}]}
+
+@pytest.fixture
+def contact(client, user, monkeypatch):
+    """A contact of the test user, whose business number all callbacks are routed to."""
+    user_id, _ = user
+    phone = "91" + str(uuid.uuid4().int)[:10]
+    monkeypatch.setattr(message_status_module.whatsapp_routes, "resolve", lambda *numbers: user_id)
+
+    async def _create():
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(insert(Contact).values(owner_id=user_id, name="Asha", phone=phone).returning(Contact.id))
+            contact_id = result.scalar_one()
+            await db.commit()
+            return contact_id
+    return run(client, _create), phone
+
+def stored(client, contact_id, message_id):
+    async def _stored():
+        async with AsyncSessionLocal() as db:
+            statuses = (await db.execute(select(MessageEvent.status).where(MessageEvent.dedupe_id == message_id))).scalars().all()
+            sent = (await db.execute(select(Contact.total_messages_sent).where(Contact.id == contact_id))).scalar_one()
+            return sorted(statuses), sent
+    return run(client, _stored)
+
+def test_a_redelivered_status_is_stored_and_counted_once(client, contact):
+    contact_id, phone = contact
+    message_id = f"wamid.{uuid.uuid4().hex}"
+
+    assert message_status.ingest(status_callback(message_id, phone)) == 1
+    assert message_status.ingest(status_callback(message_id, phone)) == 0
+    run(client, message_status.flush)
+    # Meta redelivers after the seen-set has forgotten the callback: the unique key drops it
+    message_status._seen.clear()
+    assert message_status.ingest(status_callback(message_id, phone)) == 1
+    message_status.ingest(status_callback(message_id, phone, state="delivered"))
+    run(client, message_status.flush)
+
+    assert stored(client, contact_id, message_id) == (["delivered", "sent"], 1)
+
+def test_a_failure_after_the_commit_does_not_write_the_events_again(client, contact, monkeypatch):
+    contact_id, phone = contact
+    message_id = f"wamid.{uuid.uuid4().hex}"
+
+    def broken_record(*args, **kwargs):
+        raise RuntimeError("analytics down")
+    monkeypatch.setattr(message_status_module.analytics, "record", broken_record)
+
+    message_status.ingest(status_callback(message_id, phone))
+    try:
+        run(client, message_status.flush)
+    except RuntimeError:
+        pass  # unless the background flush got there first
+    assert message_status.snapshot()["buffered"] == 0
+    run(client, message_status.flush)
+
+    assert stored(client, contact_id, message_id) == (["sent"], 1)
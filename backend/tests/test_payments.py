@@ -0,0 +1,103 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import stripe
+
+import services.payments as payments
+from core.config import settings
+from services.payments import get_razorpay_client
+from tests.conftest import register_user
+from tests.fake_payments import FakePaymentGateways
+
+@pytest.fixture
+def fake_payments(monkeypatch):
+    """services/payments.py pointed at running fake Stripe and Razorpay APIs, 0.2 s per call."""
+    gateways = FakePaymentGateways(latency=0.2).start()
+    monkeypatch.setattr(stripe, "api_key", "sk_test_fake")
+    monkeypatch.setattr(stripe, "api_base", gateways.url)
+    monkeypatch.setattr(settings, "RAZORPAY_API_BASE_URL", gateways.url)
+    # drop Razorpay clients the pool threads made for the real API
+    monkeypatch.setattr(payments, "_razorpay_clients", threading.local())
+    yield gateways
+    gateways.stop()
+
+def checkout(client, headers, i):
+    if i % 2:
+        return client.post("/api/v1/payments/create-razorpay-subscription?plan_key=growth_inr", headers=headers)
+    return client.post("/api/v1/payments/create-stripe-checkout?plan_key=growth_inr", headers=headers)
+
+def checkout_burst(client, headers, n, concurrency):
+    """Fires n checkouts from `concurrency` threads, timing the app's event loop meanwhile: (responses, seconds, longest loop stall)."""
+    done = threading.Event()
+
+    async def watch_loop():
+        longest, last = 0.0, time.perf_counter()
+        while not done.is_set():
+            await asyncio.sleep(0.005)
+            now = time.perf_counter()
+            longest, last = max(longest, now - last - 0.005), now
+        return longest
+
+    stall = client.portal.start_task_soon(watch_loop)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        responses = list(pool.map(lambda i: checkout(client, headers, i), range(n)))
+    elapsed = time.perf_counter() - started
+    done.set()
+    return responses, elapsed, stall.result()
+
+def test_each_gateway_thread_gets_its_own_razorpay_session():
+    both_running = threading.Barrier(2)
+
+    def clients(_):
+        both_running.wait()  # make the pool use two threads
+        return get_razorpay_client(), get_razorpay_client()
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        first, second = pool.map(clients, range(2))
+    # reused within a thread (keep-alive), never shared between threads
+    assert first[0] is first[1] and second[0] is second[1]
+    assert first[0].session is not second[0].session
+
+def test_a_checkout_burst_runs_on_the_gateway_pool(client, user, fake_payments):
+    _, headers = user
+    fake_payments.latency = 0.5
+    n = 2 * settings.PAYMENT_GATEWAY_WORKERS
+    responses, elapsed, stall = checkout_burst(client, headers, n, concurrency=n)
+
+    assert [r.status_code for r in responses] == [200] * n
+    assert responses[0].json()["url"].startswith("https://checkout.stripe.com/")
+    assert responses[1].json()["subscription_id"].startswith("sub_")
+    assert (fake_payments.checkout_sessions, fake_payments.subscriptions) == (n // 2, n // 2)
+    # two rounds of the pool, where one call at a time would take n rounds
+    assert elapsed < n * fake_payments.latency / 2
+    # the gateway calls never held up the event loop
+    assert stall < fake_payments.latency / 2
+
+@pytest.mark.bench
+def test_checkout_burst_throughput(client, fake_payments):
+    _, headers = register_user(client)
+    ceiling = settings.PAYMENT_GATEWAY_WORKERS / fake_payments.latency
+    latency_ms = fake_payments.latency * 1000
+
+    # as many clients as the pool queues: all are served, at close to the pool's rate
+    n, concurrency = 200, settings.PAYMENT_GATEWAY_MAX_PENDING
+    responses, elapsed, stall = checkout_burst(client, headers, n, concurrency)
+    assert [r.status_code for r in responses] == [200] * n
+    print(f"\n{n} checkouts from {concurrency} clients at {latency_ms:.0f} ms per gateway call: "
+          f"{n / elapsed:.1f} created/s (pool ceiling {ceiling:.0f}/s), longest event loop stall {stall * 1000:.1f} ms")
+    # (the stall here is the harness's client threads contending for the GIL)
+    assert n / elapsed > 0.7 * ceiling
+
+    # twice that: the excess is shed with a 503 rather than queued
+    n, concurrency = 400, 2 * settings.PAYMENT_GATEWAY_MAX_PENDING
+    responses, elapsed, stall = checkout_burst(client, headers, n, concurrency)
+    statuses = [r.status_code for r in responses]
+    created = statuses.count(200)
+    print(f"{n} checkouts from {concurrency} clients: {created / elapsed:.1f} created/s, "
+          f"{statuses.count(503)} shed with 503, longest event loop stall {stall * 1000:.1f} ms")
+    assert set(statuses) == {200, 503}
+    assert fake_payments.checkout_sessions + fake_payments.subscriptions == 200 + created
@@ -0,0 +1,121 @@
+import asyncio
+import os
+import random
+import sqlite3
+import time
+from collections import Counter
+
+import pytest
+from sqlalchemy import create_engine, func, insert
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.future import select
+
+from database import AsyncSessionLocal, Base
+from models.referral import ReferralClosure
+from models.user import User
+from services.referral_tree import (
+    backfill_referral_closure, downline_depth_counts, downline_size, link_referral, list_downline,
+)
+from tests.conftest import register_user, run
+
+def referral_code(client, headers):
+    return client.get("/api/v1/referrals/dashboard", headers=headers).json()["your_referral_code"]
+
+def user_row(client, user_id):
+    async def _get():
+        async with AsyncSessionLocal() as db:
+            return (await db.execute(select(User.referred_by_id, User.ai_credits_remaining).where(User.id == user_id))).one()
+    return run(client, _get)
+
+def test_referring_someone_from_your_own_downline_is_refused(client):
+    (a, a_headers), (b, b_headers) = register_user(client), register_user(client)
+    apply = client.post("/api/v1/referrals/apply", headers=b_headers, json={"referral_code": referral_code(client, a_headers)})
+    assert apply.status_code == 200
+
+    response = client.post("/api/v1/referrals/apply", headers=a_headers, json={"referral_code": referral_code(client, b_headers)})
+    assert response.status_code == 400
+    assert user_row(client, a).referred_by_id is None
+
+def test_a_concurrently_linked_referral_is_a_400_not_a_500(client):
+    (a, a_headers), (b, b_headers) = register_user(client), register_user(client)
+    before = user_row(client, b)
+
+    # The closure row another request committed between the checks and the link
+    async def link():
+        async with AsyncSessionLocal() as db:
+            await db.execute(insert(ReferralClosure).values(ancestor_id=a, descendant_id=b, depth=1))
+            await db.commit()
+    run(client, link)
+
+    response = client.post("/api/v1/referrals/apply", headers=b_headers, json={"referral_code": referral_code(client, a_headers)})
+
+    assert response.status_code == 400
+    # Rolled back: not referred, no welcome credits
+    assert user_row(client, b) == before
+
+@pytest.mark.bench
+def test_referral_tree_on_a_million_users(tmp_path):
+    """Backfill and downline queries on a synthetic tree (REFERRAL_BENCH_USERS, default 1M)."""
+    users = int(os.getenv("REFERRAL_BENCH_USERS", "1000000"))
+    path = tmp_path / "referrals.db"
+    sync_engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(sync_engine, tables=[User.__table__, ReferralClosure.__table__])
+    sync_engine.dispose()
+
+    # Every user after the first was referred by a random earlier one (expected depth ~ ln n)
+    rng = random.Random(23)
+    parents = [None] + [rng.randrange(i) for i in range(1, users)]
+    depths = [0] * users
+    for i in range(1, users):
+        depths[i] = depths[parents[i]] + 1
+    with sqlite3.connect(path) as conn:
+        conn.executemany(
+            "INSERT INTO users (id, email, hashed_password, referred_by_id) VALUES (?, ?, 'x', ?)",
+            ((i + 1, f"user{i}@bench.test", None if p is None else p + 1) for i, p in enumerate(parents)),
+        )
+
+    engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+
+    async def timed(fn, *args, **kwargs):
+        async with AsyncSession(engine) as db:
+            started = time.perf_counter()
+            result = await fn(db, *args, **kwargs)
+            return result, time.perf_counter() - started
+
+    async def scenario():
+        rows, backfill = await timed(backfill_referral_closure)
+        # A user three levels down: early users have the biggest downlines
+        mid = 1 + next(i for i in range(users) if depths[i] == 3)
+        figures = {"backfill": (rows, backfill)}
+        for name, fn, args in (
+            ("root size", downline_size, (1,)),
+            ("root depth counts", downline_depth_counts, (1,)),
+            ("root first page", list_downline, (1,)),
+            ("root page at depth 8", list_downline, (1, 8)),
+            ("mid size", downline_size, (mid,)),
+            ("mid depth counts", downline_depth_counts, (mid,)),
+        ):
+            figures[name] = await timed(fn, *args)
+
+        async def link(db):
+            db.add(User(id=users + 1, email="new@bench.test", hashed_password="x", referred_by_id=users))
+            await db.flush()
+            return await link_referral(db, users, users + 1)
+        figures["link a new user"] = await timed(link)
+        await engine.dispose()
+        return figures
+
+    figures = asyncio.run(scenario())
+    print(f"\nreferral tree, {users:,} users, max depth {max(depths)}:")
+    for name, (result, seconds) in figures.items():
+        summary = result if isinstance(result, int) else f"{len(result)} rows"
+        print(f"  {name}: {seconds * 1000:.1f} ms ({summary})")
+
+    assert figures["backfill"][0] == sum(depths)
+    assert figures["root size"][0] == users - 1
+    assert figures["root depth counts"][0] == [
+        {"depth": d, "count": c} for d, c in sorted(Counter(depths[1:]).items())
+    ]
+    assert figures["link a new user"][0] == depths[users - 1] + 1
+    # Paging and a new link stay fast however big the tree is
+    assert figures["root first page"][1] < 0.05 and figures["link a new user"][1] < 0.05
@@ -0,0 +1,47 @@
+from sqlalchemy import create_engine, inspect, text
+
+import main  # noqa: F401 (registers every model on Base.metadata)
+from database import Base, upgrade_schema
+
+# The users and contacts tables as the first release created them
+BASELINE_SCHEMA = [
+    """CREATE TABLE users (
+        id INTEGER PRIMARY KEY, email VARCHAR NOT NULL, hashed_password VARCHAR NOT NULL,
+        full_name VARCHAR, company_name VARCHAR, phone_number VARCHAR, business_context TEXT,
+        subscription_tier VARCHAR, subscription_status VARCHAR,
+        stripe_customer_id VARCHAR, razorpay_customer_id VARCHAR, referral_code VARCHAR,
+        referred_by_id INTEGER REFERENCES users (id), referral_credits INTEGER, total_referrals INTEGER,
+        ai_credits_remaining INTEGER, is_active BOOLEAN, created_at DATETIME, updated_at DATETIME
+    )""",
+    "CREATE UNIQUE INDEX ix_users_email ON users (email)",
+    """CREATE TABLE contacts (
+        id INTEGER PRIMARY KEY, owner_id INTEGER NOT NULL REFERENCES users (id), name VARCHAR NOT NULL,
+        phone VARCHAR, email VARCHAR, tags VARCHAR, notes TEXT, source VARCHAR,
+        total_messages_sent INTEGER, last_messaged_at DATETIME, created_at DATETIME, updated_at DATETIME
+    )""",
+    "INSERT INTO users (id, email, hashed_password) VALUES (1, 'old@example.com', 'x')",
+]
+
+def test_upgrade_schema_adds_new_columns_and_indexes_to_existing_tables(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path}/old.db")
+    with engine.begin() as conn:
+        for statement in BASELINE_SCHEMA:
+            conn.exec_driver_sql(statement)
+    with engine.begin() as conn:
+        Base.metadata.create_all(conn)
+        upgrade_schema(conn)
+
+    inspector = inspect(engine)
+    assert "subscription_event_at" in {column["name"] for column in inspector.get_columns("users")}
+    user_indexes = {index["name"] for index in inspector.get_indexes("users")}
+    assert {"ix_users_referred_by_id", "ix_users_total_referrals"} <= user_indexes
+    # read from the catalog: reflection skips the expression index
+    with engine.connect() as conn:
+        contact_indexes = set(conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'contacts'")).scalars())
+    assert {"ix_contacts_owner_phone", "ix_contacts_owner_email", "ix_contacts_owner_id_id", "ix_contacts_owner_created_key_id"} <= contact_indexes
+
+    with engine.begin() as conn:
+        # existing rows survive and the ORM's column list now resolves
+        assert conn.execute(text("SELECT email, subscription_event_at FROM users")).all() == [("old@example.com", None)]
+        # running it again is a no-op
+        upgrade_schema(conn)
@@ -0,0 +1,32 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from core.config import settings
+from services.whatsapp import resolve_media_url
+
+@pytest.mark.parametrize("url", [
+    "http://example.com/banner.jpg",  # not https
+    "file:///etc/passwd",
+    "https://user:pw@example.com/banner.jpg",
+    "https://127.0.0.1/banner.jpg",  # loopback
+    "https://localhost/banner.jpg",
+    "https://10.0.0.5/banner.jpg",  # private
+    "https://169.254.169.254/latest/meta-data/",  # cloud metadata (link-local)
+    "https://[::1]/banner.jpg",
+    "https://[::ffff:127.0.0.1]/banner.jpg",
+    "https://0.0.0.0/banner.jpg",
+])
+def test_internal_and_non_https_media_urls_are_rejected(url):
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(resolve_media_url(url))
+    assert error.value.status_code == 400
+
+def test_public_address_is_accepted_and_pinned():
+    assert asyncio.run(resolve_media_url("https://8.8.8.8/banner.jpg")) == ("8.8.8.8", "8.8.8.8")
+
+def test_allowlist_limits_hosts(monkeypatch):
+    monkeypatch.setattr(settings, "WHATSAPP_MEDIA_ALLOWED_HOSTS", "cdn.example.com")
+    with pytest.raises(HTTPException):
+        asyncio.run(resolve_media_url("https://8.8.8.8/banner.jpg"))
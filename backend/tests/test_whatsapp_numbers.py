@@ -0,0 +1,76 @@
+import asyncio
+import uuid
+
+import httpx
+import pytest
+
+import services.whatsapp as whatsapp
+from database import AsyncSessionLocal
+from models.whatsapp_number import WhatsAppNumber
+from services.http_client import UpstreamClient
+from services.whatsapp import send_whatsapp_message
+from services.whatsapp_numbers import whatsapp_routes
+from tests.conftest import register_user, run
+
+@pytest.fixture
+def graph(monkeypatch):
+    """A fake Graph API: one business number, readable only with its owner's token."""
+    number = {"id": f"pn-{uuid.uuid4().hex[:10]}", "token": f"EAAG{uuid.uuid4().hex}", "display": "+1 555-000-3333"}
+    sent = []
+
+    async def handler(request):
+        if request.headers["Authorization"] != f"Bearer {number['token']}":
+            return httpx.Response(400, json={"error": {"type": "OAuthException", "message": "Unsupported get request."}})
+        if request.method == "GET" and request.url.path == f"/v18.0/{number['id']}":
+            return httpx.Response(200, json={"id": number["id"], "display_phone_number": number["display"]})
+        if request.method == "POST" and request.url.path == f"/v18.0/{number['id']}/messages":
+            sent.append(request)
+            return httpx.Response(200, json={"messages": [{"id": "wamid.out"}]})
+        return httpx.Response(404)
+
+    upstream = UpstreamClient("https://graph.test")
+    upstream.client = httpx.AsyncClient(base_url="https://graph.test", transport=httpx.MockTransport(handler))
+    monkeypatch.setattr(whatsapp, "get_http_client", lambda url: upstream)
+    graph.number, graph.sent = number, sent
+    return graph
+
+def register(client, headers, number, token):
+    return client.post("/api/v1/marketing/whatsapp/numbers", headers=headers, json={
+        "phone_number_id": number["id"], "display_phone_number": "15550003333", "access_token": token,
+    })
+
+def test_a_number_cannot_be_claimed_without_a_token_for_it(client, user, graph):
+    _, headers = user
+    assert register(client, headers, graph.number, "EAAG-someone-else").status_code == 403
+    assert whatsapp_routes.sender(graph.number["id"]) is None
+
+    response = client.post("/api/v1/marketing/whatsapp/numbers", headers=headers, json={
+        "phone_number_id": graph.number["id"], "display_phone_number": "15550004444", "access_token": graph.number["token"],
+    })
+    assert response.status_code == 403  # Meta knows the number by another display number
+
+def test_replies_go_out_from_the_verified_number(client, user, graph):
+    user_id, headers = user
+    assert register(client, headers, graph.number, graph.number["token"]).status_code == 201
+    assert whatsapp_routes.resolve(graph.number["id"]) == user_id
+
+    # Once verified, nobody else can take the number over
+    _, rival_headers = register_user(client)
+    assert register(client, rival_headers, graph.number, graph.number["token"]).status_code == 409
+
+    sender = whatsapp_routes.sender(graph.number["id"])
+    asyncio.run(send_whatsapp_message("919800011111", "Hi!", sender))
+    assert len(graph.sent) == 1
+
+def test_a_verified_registration_takes_over_an_unverified_one(client, user, graph):
+    squatter_id, _ = register_user(client)
+
+    async def squat():
+        async with AsyncSessionLocal() as db:
+            db.add(WhatsAppNumber(owner_id=squatter_id, phone_number_id=graph.number["id"], display_phone_number="+15550003333"))
+            await db.commit()
+    run(client, squat)
+
+    user_id, headers = user
+    assert register(client, headers, graph.number, graph.number["token"]).status_code == 201
+    assert whatsapp_routes.resolve(graph.number["id"]) == user_id
@@ -0,0 +1,52 @@
+"""
+Campaign worker entry point.
+
+Run alongside the API: `cd backend && python worker.py`
+Sends queued WhatsApp/email campaigns in the background. SIGTERM/SIGINT drain
+in-flight sends before exiting, so it is safe to restart during a campaign.
+"""
+import signal
+import asyncio
+import logging
+
+from database import Base, engine, upgrade_schema
+from models.user import User
+from models.contact import Contact, ContactTag
+from models.campaign import Campaign, CampaignRecipient, CampaignWhatsAppTemplate
+from models.webhook import InboundWebhookEvent, ProcessedWhatsAppMessage
+from models.whatsapp_number import WhatsAppNumber
+from models.conversation import ConversationMessage
+from models.credit import CreditLedgerEntry, CreditReservation
+from models.message_event import MessageEvent
+from models.analytics import CampaignStatsHourly, CampaignStatsDaily
+from models.referral import ReferralEvent, ReferralClosure
+from models.payment import PaymentEvent
+from services.analytics import analytics
+from services.campaigns import CampaignWorker
+from services.http_client import close_http_clients
+from services.email import close_smtp_pool
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+async def main():
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        # add columns and indexes that models gained after their tables were created
+        await conn.run_sync(upgrade_schema)
+
+    worker = CampaignWorker()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, worker.stop)
+
+    await analytics.start()
+    try:
+        await worker.run()
+    finally:
+        await analytics.stop()
+        await close_http_clients()
+        await close_smtp_pool()
+        await engine.dispose()
+
+if __name__ == "__main__":
+    asyncio.run(main())